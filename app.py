@@ -1,21 +1,67 @@
-from flask import Flask, request, render_template, redirect, url_for, session
+from flask import (Flask, request, render_template, redirect, url_for, session, g, jsonify,
+                   stream_template, stream_with_context)
+import io
+import os
 import sqlite3
-from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
+import click
+from datetime import date
 from functools import wraps
+from db_pool import SQLitePool, PoolTimeout
+import billing
+import charge_dates
+import forecast
+import bulk_io
+from password_hashing import PasswordHasher, HashingBusy
+from user_cache import UserCache, MISSING
 
 app = Flask(__name__)
 app.secret_key = 'secret_key_123'  # Простой ключ
 
-DATABASE = 'subscriptions.db'
+DATABASE = os.environ.get('SUBSCRIPTIONS_DB', 'subscriptions.db')
+
+# Пул соединений: WAL, synchronous и busy_timeout задаются один раз
+# при создании соединения, дальше соединения переиспользуются
+db_pool = SQLitePool(
+    DATABASE,
+    max_size=int(os.environ.get('DB_POOL_SIZE', 8)),
+    synchronous=os.environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+    busy_timeout=int(os.environ.get('DB_BUSY_TIMEOUT', 5000)),
+)
+
+# Хеширование паролей в отдельных процессах; стоимость задаётся методом
+# werkzeug, например 'pbkdf2:sha256:600000' или 'scrypt:32768:8:1'
+hasher = PasswordHasher(
+    method=os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'),
+    workers=int(os.environ['HASH_WORKERS']) if 'HASH_WORKERS' in os.environ else None,
+    max_pending=int(os.environ.get('HASH_MAX_PENDING', 64)),
+    timeout=float(os.environ.get('HASH_TIMEOUT', 10)),
+)
+
+# Кеш пользователей по имени (в том числе отрицательный - имени нет в базе)
+user_cache = UserCache(
+    max_size=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+    negative_ttl=float(os.environ.get('USER_CACHE_NEGATIVE_TTL', 5)),
+)
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Соединение текущего запроса (берётся из пула один раз на запрос)"""
+    if 'db_conn' not in g:
+        g.db_conn = db_pool.acquire()
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        db_pool.release(conn)
 
 def init_db():
-    conn = get_db_connection()
+    with db_pool.connection() as conn:
+        _init_schema(conn)
+
+def _init_schema(conn):
     cur = conn.cursor()
     
     # Упрощённая таблица пользователей
@@ -43,21 +89,163 @@ def init_db():
     
     conn.commit()
     cur.close()
-    conn.close()
+    
+    migrate_db(conn)
+
+# ====================================
+# МИГРАЦИИ СХЕМЫ
+# ====================================
+
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция применяется
+# один раз, в своей транзакции; новые миграции добавляются в конец списка.
+MIGRATIONS = [
+    (1, [
+        # Активные подписки пользователя в порядке списания (view_subscriptions)
+        '''CREATE INDEX IF NOT EXISTS idx_subscriptions_user_next_active
+           ON subscriptions (user_id, next_charge_date)
+           WHERE is_active = 1''',
+        # Поиск подписок пользователя вне зависимости от статуса
+        '''CREATE INDEX IF NOT EXISTS idx_subscriptions_user
+           ON subscriptions (user_id)''',
+    ]),
+]
+
+# Месячный эквивалент суммы подписки в зависимости от периода
+def _monthly_factor_sql(column):
+    return (f"(CASE {column} WHEN 'weekly' THEN 52.0 / 12 "
+            f"WHEN 'yearly' THEN 1.0 / 12 ELSE 1.0 END)")
+
+SQL_REBUILD_USER_TOTALS = f'''
+    INSERT INTO user_totals (user_id, active_count, total_all, total_monthly)
+    SELECT user_id, COUNT(*), SUM(amount), SUM(amount * {_monthly_factor_sql('interval')})
+    FROM subscriptions
+    WHERE is_active = 1
+    GROUP BY user_id
+'''
+
+MIGRATIONS.append((2, [
+    # Агрегаты по активным подпискам пользователя, поддерживаются триггерами
+    '''CREATE TABLE IF NOT EXISTS user_totals (
+           user_id INTEGER PRIMARY KEY,
+           active_count INTEGER NOT NULL DEFAULT 0,
+           total_all REAL NOT NULL DEFAULT 0,
+           total_monthly REAL NOT NULL DEFAULT 0
+       )''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_subscriptions_totals_insert
+        AFTER INSERT ON subscriptions
+        WHEN NEW.is_active = 1
+        BEGIN
+            INSERT INTO user_totals (user_id, active_count, total_all, total_monthly)
+            VALUES (NEW.user_id, 1, NEW.amount, NEW.amount * {_monthly_factor_sql('NEW.interval')})
+            ON CONFLICT (user_id) DO UPDATE SET
+                active_count = active_count + 1,
+                total_all = total_all + excluded.total_all,
+                total_monthly = total_monthly + excluded.total_monthly;
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_subscriptions_totals_update
+        AFTER UPDATE OF user_id, amount, interval, is_active ON subscriptions
+        BEGIN
+            UPDATE user_totals SET
+                active_count = active_count - 1,
+                total_all = total_all - OLD.amount,
+                total_monthly = total_monthly - OLD.amount * {_monthly_factor_sql('OLD.interval')}
+            WHERE user_id = OLD.user_id AND OLD.is_active = 1;
+            INSERT INTO user_totals (user_id, active_count, total_all, total_monthly)
+            SELECT NEW.user_id, 1, NEW.amount, NEW.amount * {_monthly_factor_sql('NEW.interval')}
+            WHERE NEW.is_active = 1
+            ON CONFLICT (user_id) DO UPDATE SET
+                active_count = active_count + 1,
+                total_all = total_all + excluded.total_all,
+                total_monthly = total_monthly + excluded.total_monthly;
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_subscriptions_totals_delete
+        AFTER DELETE ON subscriptions
+        WHEN OLD.is_active = 1
+        BEGIN
+            UPDATE user_totals SET
+                active_count = active_count - 1,
+                total_all = total_all - OLD.amount,
+                total_monthly = total_monthly - OLD.amount * {_monthly_factor_sql('OLD.interval')}
+            WHERE user_id = OLD.user_id;
+        END''',
+    # Заполняем агрегаты для уже существующих подписок
+    'DELETE FROM user_totals',
+    SQL_REBUILD_USER_TOTALS,
+]))
+
+MIGRATIONS.append((3, [
+    # Поиск подписок к списанию для биллинга (billing.py)
+    '''CREATE INDEX IF NOT EXISTS idx_subscriptions_due
+       ON subscriptions (next_charge_date)
+       WHERE is_active = 1''',
+    # Контрольные точки запусков биллинга
+    '''CREATE TABLE IF NOT EXISTS billing_runs (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           as_of TEXT NOT NULL,
+           started_at REAL NOT NULL,
+           finished_at REAL,
+           last_date TEXT NOT NULL,
+           last_id INTEGER NOT NULL,
+           processed INTEGER NOT NULL DEFAULT 0
+       )''',
+]))
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate_db(conn):
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+# ====================================
+# SQL-ЗАПРОСЫ МАРШРУТОВ
+# ====================================
+
+# Запросы вынесены сюда, чтобы тест проверял их планы (EXPLAIN QUERY PLAN)
+SQL_USER_BY_USERNAME = 'SELECT * FROM users WHERE username = ?'
+SQL_ACTIVE_SUBSCRIPTIONS = ('SELECT * FROM subscriptions WHERE user_id = ? AND is_active = 1 '
+                            'ORDER BY next_charge_date, id')
+# Keyset-пагинация по (next_charge_date, id): страница не зависит от OFFSET
+SQL_ACTIVE_SUBSCRIPTIONS_PAGE = SQL_ACTIVE_SUBSCRIPTIONS + ' LIMIT ?'
+SQL_ACTIVE_SUBSCRIPTIONS_AFTER = ('SELECT * FROM subscriptions WHERE user_id = ? AND is_active = 1 '
+                                  'AND (next_charge_date, id) > (?, ?) '
+                                  'ORDER BY next_charge_date, id LIMIT ?')
+SQL_SUBSCRIPTION_BY_OWNER = 'SELECT * FROM subscriptions WHERE id = ? AND user_id = ?'
+SQL_UPDATE_SUBSCRIPTION = '''
+    UPDATE subscriptions 
+    SET name=?, amount=?, interval=?, start_date=?, next_charge_date=?
+    WHERE id=? AND user_id=?
+'''
+SQL_DEACTIVATE_SUBSCRIPTION = 'UPDATE subscriptions SET is_active=0 WHERE id=? AND user_id=?'
+SQL_USER_SUBSCRIPTIONS = 'SELECT * FROM subscriptions WHERE user_id = ? ORDER BY id'
+SQL_USER_TOTALS = 'SELECT active_count, total_all, total_monthly FROM user_totals WHERE user_id = ?'
+
+ROUTE_QUERIES = {
+    'get_user_by_username': SQL_USER_BY_USERNAME,
+    'view_subscriptions': SQL_ACTIVE_SUBSCRIPTIONS,
+    'view_subscriptions_page': SQL_ACTIVE_SUBSCRIPTIONS_PAGE,
+    'view_subscriptions_after': SQL_ACTIVE_SUBSCRIPTIONS_AFTER,
+    'edit_subscription': SQL_SUBSCRIPTION_BY_OWNER,
+    'edit_subscription_update': SQL_UPDATE_SUBSCRIPTION,
+    'delete_subscription': SQL_DEACTIVATE_SUBSCRIPTION,
+    'user_totals': SQL_USER_TOTALS,
+    'export_subscriptions': SQL_USER_SUBSCRIPTIONS,
+}
 
 def calculate_next_charge(start_date_str, interval):
-    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    
-    if interval == 'monthly':
-        next_date = start_date + timedelta(days=30)
-    elif interval == 'yearly':
-        next_date = start_date.replace(year=start_date.year + 1)
-    elif interval == 'weekly':
-        next_date = start_date + timedelta(days=7)
-    else:
-        next_date = start_date + timedelta(days=30)
-    
-    return next_date.strftime('%Y-%m-%d')
+    """Дата первого списания; ValueError для некорректной даты"""
+    return charge_dates.next_charge(start_date_str, interval)
 
 init_db()
 
@@ -66,18 +254,31 @@ init_db()
 # ====================================
 
 def get_user_by_username(username):
+    user = user_cache.get(username)
+    if user is not MISSING:
+        return user
+    
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute('SELECT * FROM users WHERE username = ?', (username,))
-    user = cur.fetchone()
+    cur.execute(SQL_USER_BY_USERNAME, (username,))
+    row = cur.fetchone()
     cur.close()
-    conn.close()
+    
+    user = dict(row) if row else None
+    user_cache.put(username, user)
     return user
 
 def create_user(username, password):
+    """Создать пользователя одним INSERT; занятое имя ловим по UNIQUE"""
+    # Занятое имя, уже лежащее в кеше, отсекаем до хеширования и без
+    # обращения к БД. Промах кеша не догружаем SELECT'ом: дубликат
+    # поймает UNIQUE на единственном INSERT
+    cached = user_cache.get(username)
+    if cached is not None and cached is not MISSING:
+        return False
     conn = get_db_connection()
     cur = conn.cursor()
-    hashed_password = generate_password_hash(password)
+    hashed_password = hasher.hash(password)
     
     try:
         cur.execute('INSERT INTO users (username, password) VALUES (?, ?)', 
@@ -88,10 +289,107 @@ def create_user(username, password):
         success = False
     finally:
         cur.close()
-        conn.close()
+        # Сбрасываем в том числе отрицательную запись для этого имени
+        user_cache.invalidate(username)
     
     return success
 
+def rehash_password(username, user_id, password):
+    """Пересчитать хеш со старыми параметрами после успешного входа"""
+    try:
+        hashed_password = hasher.hash(password)
+    except HashingBusy:
+        return False  # обновим при следующем входе
+    conn = get_db_connection()
+    conn.execute('UPDATE users SET password = ? WHERE id = ?', (hashed_password, user_id))
+    conn.commit()
+    user_cache.invalidate(username)
+    return True
+
+# ====================================
+# АГРЕГАТЫ ПО ПОДПИСКАМ
+# ====================================
+
+def get_user_totals(user_id):
+    """Итоги по активным подпискам пользователя (таблица user_totals)"""
+    conn = get_db_connection()
+    row = conn.execute(SQL_USER_TOTALS, (user_id,)).fetchone()
+    if row is None:
+        return {'active_count': 0, 'total_all': 0.0, 'total_monthly': 0.0}
+    return dict(row)
+
+def rebuild_user_totals(conn):
+    """Пересчитать user_totals с нуля по таблице subscriptions"""
+    with conn:
+        conn.execute('DELETE FROM user_totals')
+        conn.execute(SQL_REBUILD_USER_TOTALS)
+    return conn.execute('SELECT COUNT(*) FROM user_totals').fetchone()[0]
+
+@app.cli.command('rebuild-totals')
+def rebuild_totals_command():
+    """Сверка: пересобрать агрегаты user_totals"""
+    with db_pool.connection() as conn:
+        users = rebuild_user_totals(conn)
+    print(f'Агрегаты пересчитаны для {users} пользователей')
+
+# ====================================
+# БИЛЛИНГ
+# ====================================
+
+@app.cli.command('billing')
+@click.option('--as-of', default=None, help='Дата списания YYYY-MM-DD (по умолчанию сегодня)')
+@click.option('--chunk-size', default=5000, show_default=True)
+@click.option('--every', default=0, help='Повторять каждые N секунд (0 - один запуск)')
+def billing_command(as_of, chunk_size, every):
+    """Продлить next_charge_date у всех подписок к списанию"""
+    while True:
+        with db_pool.connection() as conn:
+            billing.run_billing(conn, as_of=as_of, chunk_size=chunk_size)
+        if not every:
+            break
+        time.sleep(every)
+
+# ====================================
+# ПАГИНАЦИЯ
+# ====================================
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+STREAM_FETCH_SIZE = 200
+
+def parse_page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE_DEFAULT
+    return max(1, min(size, PAGE_SIZE_MAX))
+
+def make_cursor(next_charge_date, subscription_id):
+    return f'{next_charge_date}:{subscription_id}'
+
+def parse_cursor(value):
+    """Курсор вида '<next_charge_date>:<id>' -> (дата, id) или None"""
+    if not value:
+        return None
+    date_part, _, id_part = value.rpartition(':')
+    try:
+        charge_dates.parse_date(date_part)
+        return date_part, int(id_part)
+    except ValueError:
+        return None
+
+def iter_rows(cur, size=STREAM_FETCH_SIZE):
+    """Генератор по курсору: в памяти не больше size строк одновременно"""
+    try:
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cur.close()
+
 # ====================================
 # ДЕКОРАТОР
 # ====================================
@@ -123,13 +421,11 @@ def register():
         if not username or not password:
             return render_template('register.html', error='Заполните все поля')
         
-        if get_user_by_username(username):
-            return render_template('register.html', error='Имя уже занято')
-        
+        # Занятое имя отсекается кешем пользователей, гонку ловит UNIQUE
         if create_user(username, password):
             return redirect('/login?success=1')
         else:
-            return render_template('register.html', error='Ошибка регистрации')
+            return render_template('register.html', error='Имя уже занято')
     
     return render_template('register.html')
 
@@ -146,7 +442,9 @@ def login():
         if not user:
             return render_template('login.html', error='Неверные данные')
         
-        if check_password_hash(user['password'], password):
+        if hasher.check(user['password'], password):
+            if hasher.needs_rehash(user['password']):
+                rehash_password(user['username'], user['id'], password)
             session['user_id'] = user['id']
             session['username'] = user['username']
             return redirect('/subscriptions')
@@ -169,24 +467,47 @@ def logout():
 @login_required
 def view_subscriptions():
     user_id = session['user_id']
+    totals = get_user_totals(user_id)
     
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute('SELECT * FROM subscriptions WHERE user_id = ? AND is_active = 1 ORDER BY next_charge_date', 
-                (user_id,))
-    subscriptions = [dict(row) for row in cur.fetchall()]
+    # Потоковый режим: строки отдаются по мере чтения курсора
+    if request.args.get('stream'):
+        cur.execute(SQL_ACTIVE_SUBSCRIPTIONS, (user_id,))
+        return app.response_class(stream_template('subscriptions.html',
+                         subscriptions=iter_rows(cur),
+                         total_monthly=totals['total_monthly'],
+                         total_all=totals['total_all'],
+                         active_count=totals['active_count'],
+                         is_first_page=True,
+                         username=session.get('username')))
     
-    total_monthly = sum(sub['amount'] for sub in subscriptions if sub['interval'] == 'monthly')
-    total_all = sum(sub['amount'] for sub in subscriptions)
+    limit = parse_page_size(request.args.get('limit'))
+    after = parse_cursor(request.args.get('after'))
     
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    if after:
+        cur.execute(SQL_ACTIVE_SUBSCRIPTIONS_AFTER, (user_id, after[0], after[1], limit + 1))
+    else:
+        cur.execute(SQL_ACTIVE_SUBSCRIPTIONS_PAGE, (user_id, limit + 1))
+    subscriptions = [dict(row) for row in cur.fetchmany(limit + 1)]
     cur.close()
-    conn.close()
+    
+    next_cursor = None
+    if len(subscriptions) > limit:
+        subscriptions = subscriptions[:limit]
+        last = subscriptions[-1]
+        next_cursor = make_cursor(last['next_charge_date'], last['id'])
     
     return render_template('subscriptions.html',
                          subscriptions=subscriptions,
-                         total_monthly=total_monthly,
-                         total_all=total_all,
+                         total_monthly=totals['total_monthly'],
+                         total_all=totals['total_all'],
+                         active_count=totals['active_count'],
+                         next_cursor=next_cursor,
+                         page_size=limit,
+                         is_first_page=after is None,
                          username=session.get('username'))
 
 @app.route('/subscriptions/add', methods=['GET', 'POST'])
@@ -204,7 +525,6 @@ def add_subscription():
         
         try:
             amount = float(amount)
-            datetime.strptime(start_date, '%Y-%m-%d')
             next_charge_date = calculate_next_charge(start_date, interval)
             
             conn = get_db_connection()
@@ -217,7 +537,7 @@ def add_subscription():
             
             conn.commit()
             cur.close()
-            conn.close()
+            timeline_index.invalidate(user_id)
             
             return redirect('/subscriptions')
             
@@ -234,12 +554,11 @@ def edit_subscription(subscription_id):
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute('SELECT * FROM subscriptions WHERE id = ? AND user_id = ?', (subscription_id, user_id))
+    cur.execute(SQL_SUBSCRIPTION_BY_OWNER, (subscription_id, user_id))
     subscription = cur.fetchone()
     
     if not subscription:
         cur.close()
-        conn.close()
         return redirect('/subscriptions')
     
     if request.method == 'POST':
@@ -250,37 +569,30 @@ def edit_subscription(subscription_id):
         
         if not all([name, amount, interval, start_date]):
             cur.close()
-            conn.close()
             return render_template('edit_subscription.html',
                                  error='Заполните все поля',
                                  subscription=dict(subscription))
         
         try:
             amount = float(amount)
-            datetime.strptime(start_date, '%Y-%m-%d')
             next_charge_date = calculate_next_charge(start_date, interval)
             
-            cur.execute('''
-                UPDATE subscriptions 
-                SET name=?, amount=?, interval=?, start_date=?, next_charge_date=?
-                WHERE id=? AND user_id=?
-            ''', (name, amount, interval, start_date, next_charge_date, subscription_id, user_id))
+            cur.execute(SQL_UPDATE_SUBSCRIPTION,
+                        (name, amount, interval, start_date, next_charge_date, subscription_id, user_id))
             
             conn.commit()
             cur.close()
-            conn.close()
+            timeline_index.invalidate(user_id)
             
             return redirect('/subscriptions')
             
         except:
             cur.close()
-            conn.close()
             return render_template('edit_subscription.html',
                                  error='Ошибка в данных',
                                  subscription=dict(subscription))
     
     cur.close()
-    conn.close()
     
     return render_template('edit_subscription.html', subscription=dict(subscription))
 
@@ -291,13 +603,151 @@ def delete_subscription(subscription_id):
     
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute('UPDATE subscriptions SET is_active=0 WHERE id=? AND user_id=?', 
-                (subscription_id, user_id))
+    cur.execute(SQL_DEACTIVATE_SUBSCRIPTION, (subscription_id, user_id))
     conn.commit()
     cur.close()
-    conn.close()
+    timeline_index.invalidate(user_id)
     
     return redirect('/subscriptions')
 
+# ====================================
+# ПРОГНОЗ СПИСАНИЙ
+# ====================================
+
+FORECAST_MONTHS_DEFAULT = 12
+FORECAST_MONTHS_MAX = 60
+
+def load_active_subscriptions(user_id):
+    cur = get_db_connection().cursor()
+    cur.execute(SQL_ACTIVE_SUBSCRIPTIONS, (user_id,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+timeline_index = forecast.TimelineIndex(load_active_subscriptions)
+
+@app.route('/subscriptions/forecast')
+@login_required
+def forecast_subscriptions():
+    """Прогноз списаний по месяцам (JSON для графиков)"""
+    try:
+        months = int(request.args.get('months', FORECAST_MONTHS_DEFAULT))
+    except ValueError:
+        months = FORECAST_MONTHS_DEFAULT
+    months = max(1, min(months, FORECAST_MONTHS_MAX))
+    
+    today = date.today()
+    horizon_start = date(today.year, today.month, 1)
+    horizon = date.fromordinal(
+        charge_dates.add_months(horizon_start, months).toordinal() - 1)
+    
+    timeline = timeline_index.get(session['user_id'], horizon, today)
+    buckets = forecast.month_buckets(timeline, months)
+    return jsonify({
+        'months': buckets,
+        'total': round(sum(bucket['total'] for bucket in buckets), 2),
+        'count': sum(bucket['count'] for bucket in buckets),
+    })
+
+# ====================================
+# МАССОВЫЙ ИМПОРТ И ЭКСПОРТ
+# ====================================
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+@app.route('/subscriptions/import', methods=['POST'])
+@login_required
+def import_subscriptions():
+    """Импорт CSV/NDJSON: файл в поле 'file' или тело запроса целиком"""
+    fmt = request.args.get('format', 'csv')
+    upload = request.files.get('file')
+    raw = upload.stream if upload else request.stream
+    text_stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    
+    try:
+        result = bulk_io.import_records(get_db_connection(),
+                                        bulk_io.iter_records(text_stream, fmt),
+                                        session['user_id'], calculate_next_charge)
+    except (bulk_io.ImportFormatError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        timeline_index.invalidate(session['user_id'])
+    return jsonify(result)
+
+@app.route('/subscriptions/export')
+@login_required
+def export_subscriptions():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk_io.FORMATS:
+        return jsonify({'error': f'Неизвестный формат: {fmt}'}), 400
+    
+    cur = get_db_connection().cursor()
+    cur.execute(SQL_USER_SUBSCRIPTIONS, (session['user_id'],))
+    return app.response_class(
+        stream_with_context(bulk_io.export_chunks(cur, fmt)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename=subscriptions.{fmt}'})
+
+def _cli_user_id(conn, username):
+    row = conn.execute(SQL_USER_BY_USERNAME, (username,)).fetchone()
+    if row is None:
+        raise click.ClickException(f'Пользователь {username} не найден')
+    return row['id']
+
+@app.cli.command('import-subscriptions')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk_io.FORMATS), default='csv')
+@click.option('--batch-size', default=1000, show_default=True)
+def import_subscriptions_command(username, path, fmt, batch_size):
+    """Импортировать подписки пользователя из файла"""
+    started = time.perf_counter()
+    with db_pool.connection() as conn, open(path, encoding='utf-8-sig', newline='') as f:
+        result = bulk_io.import_records(conn, bulk_io.iter_records(f, fmt),
+                                        _cli_user_id(conn, username), calculate_next_charge,
+                                        batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"Импортировано: {result['imported']}, ошибок: {result['failed']} за {elapsed:.2f} с")
+    for error in result['errors']:
+        print(f"  строка {error['line']}: {error['error']}")
+
+@app.cli.command('export-subscriptions')
+@click.argument('username')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(bulk_io.FORMATS), default='csv')
+def export_subscriptions_command(username, output, fmt):
+    """Выгрузить подписки пользователя (в stdout по умолчанию)"""
+    with db_pool.connection() as conn:
+        cur = conn.execute(SQL_USER_SUBSCRIPTIONS, (_cli_user_id(conn, username),))
+        for chunk in bulk_io.export_chunks(cur, fmt):
+            output.write(chunk)
+
+# ====================================
+# СЛУЖЕБНОЕ
+# ====================================
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout_handler(e):
+    return 'Сервер перегружен, попробуйте позже', 503
+
+@app.errorhandler(HashingBusy)
+def hashing_busy_handler(e):
+    return 'Слишком много попыток входа, попробуйте позже', 503, {'Retry-After': '1'}
+
+@app.route('/db_stats')
+def db_stats():
+    """Статистика пула соединений (для подбора DB_POOL_SIZE)"""
+    return jsonify(db_pool.stats())
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Счётчики попаданий кеша пользователей"""
+    return jsonify(user_cache.stats())
+
+@app.route('/hash_stats')
+def hash_stats():
+    """Состояние пула хеширования паролей"""
+    return jsonify(hasher.stats())
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
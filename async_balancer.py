@@ -0,0 +1,209 @@
+# async_balancer.py - асинхронный движок балансировщика на aiohttp
+#
+# Использует тот же пул серверов и выбор сервера, что и balancer.py
+# (server_pool, get_next_server, операции админки), но проксирует
+# запросы корутинами: медленный бэкенд держит сокет, а не поток, поэтому
+# один процесс выдерживает десятки тысяч одновременных соединений.
+#
+#   pip install aiohttp
+#   python async_balancer.py --port 5000
+import argparse
+import asyncio
+import logging
+import os
+
+# Проверки здоровья делает корутина ниже, поток balancer.py не нужен
+os.environ.setdefault('LB_HEALTH_CHECK', '0')
+
+import aiohttp
+from aiohttp import web
+
+import balancer
+from backend_pool import (filter_headers, STREAM_CHUNK_SIZE, MAX_CONNECTIONS, CONNECT_TIMEOUT,
+                          READ_TIMEOUT)
+
+
+# Предел одновременных соединений к одному бэкенду (0 - без ограничения)
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('LB_ASYNC_MAX_CONNECTIONS', MAX_CONNECTIONS * 10))
+
+CLIENT_SESSION = web.AppKey('client_session', aiohttp.ClientSession)
+STATS = web.AppKey('stats', dict)
+HEALTH_CHECK = web.AppKey('health_check', bool)
+HEALTH_TASK = web.AppKey('health_task', asyncio.Task)
+
+
+async def health_check(session, server):
+    try:
+        async with session.get(f"{server['url']}/health",
+                               timeout=aiohttp.ClientTimeout(total=balancer.HEALTH_TIMEOUT)) as response:
+            return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+async def background_health_check(app):
+    """Пробы параллельно корутинами, пороги и исключение - общий HealthChecker"""
+    session = app[CLIENT_SESSION]
+    checker = balancer.health_checker
+    while True:
+        servers = balancer.server_pool.snapshot()
+        results = await asyncio.gather(*(health_check(session, server) for server in servers))
+        for server, is_healthy in zip(servers, results):
+            if balancer.server_pool.find(server['url']) is not None:
+                checker.apply_probe(server, is_healthy)
+        await asyncio.sleep(checker.next_delay())
+
+
+async def proxy(request):
+    """Переслать запрос на следующий бэкенд, потоково в обе стороны"""
+    key = balancer.affinity_key(request.headers, request.cookies, request.remote)
+    target_server = balancer.get_next_server(key)
+    if not target_server:
+        balancer.errors.inc('no_backend')
+        return web.json_response({"error": "Нет доступных серверов"}, status=503)
+
+    stats = request.app[STATS]
+    stats['requests'] += 1
+    backend = balancer.backend_stats.get(target_server['url'])
+    started = backend.begin()
+    # Content-Length клиента сохраняется: тело уйдёт потоком, но без chunked
+    headers = dict(filter_headers(request.headers, drop=('Host',)))
+    body = request.content if request.body_exists else None
+
+    try:
+        upstream = await request.app[CLIENT_SESSION].request(
+            request.method,
+            f"{target_server['url']}{request.rel_url}",
+            headers=headers,
+            data=body,
+            allow_redirects=False,
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        stats['errors'] += 1
+        balancer.record_unreachable(target_server, backend)
+        return web.json_response({"error": f"Ошибка подключения к серверу: {str(e)}"}, status=502)
+    failed = balancer.record_response(target_server, backend, started, upstream.status)
+    try:
+        chunked = 'chunked' in upstream.headers.get('Transfer-Encoding', '').lower()
+        drop = ('Content-Length',) if chunked else ()
+        response = web.StreamResponse(status=upstream.status)
+        for key, value in filter_headers(upstream.headers, drop=drop):
+            response.headers.add(key, value)
+        await response.prepare(request)
+        async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        stats['errors'] += 1
+        failed = True
+        raise
+    finally:
+        upstream.release()
+        backend.end(error=failed)
+
+
+async def lb_health(request):
+    connector = request.app[CLIENT_SESSION].connector
+    return web.json_response({
+        "server_pool": balancer.pool_status(),
+        "engine": "asyncio",
+        "strategy": balancer.current_strategy,
+        "backend_stats": balancer.backend_stats.snapshot(),
+        "health": balancer.health_checker.snapshot(),
+        "circuit_breakers": balancer.breakers.snapshot(),
+        "requests": request.app[STATS]['requests'],
+        "errors": request.app[STATS]['errors'],
+        "connection_limit_per_host": connector.limit_per_host,
+    })
+
+
+async def lb_metrics(request):
+    return web.Response(text=balancer.metrics.render(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def web_ui(request):
+    html = balancer.app.jinja_env.get_template('admin.html').render(**balancer.admin_context())
+    return web.Response(text=html, content_type='text/html')
+
+
+async def add_instance(request):
+    form = await request.post()
+    new_server_url, error = balancer.validate_new_server(form.get('ip', 'localhost'),
+                                                         form.get('port', ''))
+    if error:
+        return web.Response(text=error, status=400)
+    is_healthy = await health_check(request.app[CLIENT_SESSION], {"url": new_server_url})
+    # Запись файла пула (flock, fsync) - в пуле потоков, не в event loop
+    await asyncio.get_running_loop().run_in_executor(
+        None, balancer.add_server, new_server_url, is_healthy, balancer.parse_weight(form.get('weight', 1)))
+    raise web.HTTPFound('/')
+
+
+async def change_strategy(request):
+    form = await request.post()
+    if not balancer.set_strategy(form.get('strategy')):
+        return web.Response(text="Ошибка: Неизвестная стратегия", status=400)
+    raise web.HTTPFound('/')
+
+
+async def remove_instance(request):
+    form = await request.post()
+    removed_server, error = await asyncio.get_running_loop().run_in_executor(
+        None, balancer.remove_server, form.get('index'))
+    if error:
+        return web.Response(text=error, status=400)
+    raise web.HTTPFound('/')
+
+
+async def on_startup(app):
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=ASYNC_MAX_CONNECTIONS,
+                                     keepalive_timeout=30, ttl_dns_cache=300)
+    app[CLIENT_SESSION] = aiohttp.ClientSession(
+        connector=connector,
+        auto_decompress=False,
+        timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+    )
+    if app[HEALTH_CHECK]:
+        app[HEALTH_TASK] = asyncio.create_task(background_health_check(app))
+
+
+async def on_cleanup(app):
+    task = app.get(HEALTH_TASK)
+    if task:
+        task.cancel()
+    await app[CLIENT_SESSION].close()
+
+
+def create_app(health_check=True):
+    app = web.Application()
+    app[STATS] = {'requests': 0, 'errors': 0}
+    app[HEALTH_CHECK] = health_check
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get('/', web_ui)
+    app.router.add_get('/health', lb_health)
+    app.router.add_get('/metrics', lb_metrics)
+    app.router.add_post('/add_instance', add_instance)
+    app.router.add_post('/remove_instance', remove_instance)
+    app.router.add_post('/set_strategy', change_strategy)
+    app.router.add_route('*', '/{path:.*}', proxy)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Асинхронный балансировщик нагрузки')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--backlog', type=int, default=4096)
+    parser.add_argument('--reuse-port', action='store_true', default=balancer.REUSE_PORT,
+                        help='SO_REUSEPORT: несколько процессов на одном порту')
+    args = parser.parse_args()
+
+    print(f"Асинхронный балансировщик запущен на http://{args.host}:{args.port}")
+    for i, server in enumerate(balancer.server_pool):
+        print(f"   {i+1}. {server['url']}")
+    web.run_app(create_app(), host=args.host, port=args.port, backlog=args.backlog,
+                reuse_port=args.reuse_port, access_log=None)
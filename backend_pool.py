@@ -0,0 +1,193 @@
+# backend_pool.py - пул HTTP-соединений балансировщика к бэкендам
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Параметры пула (переопределяются переменными окружения)
+MAX_CONNECTIONS = int(os.environ.get('LB_MAX_CONNECTIONS', 100))
+CONNECT_TIMEOUT = float(os.environ.get('LB_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('LB_READ_TIMEOUT', 30))
+RETRIES = int(os.environ.get('LB_RETRIES', 2))
+
+# Размер фрагмента при потоковой пересылке тел
+STREAM_CHUNK_SIZE = int(os.environ.get('LB_STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Заголовки одного соединения (RFC 7230, 6.1) - не пересылаются дальше
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade', 'proxy-connection',
+])
+
+# Повторять можно только идемпотентные запросы
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'])
+
+
+def filter_headers(headers, drop=()):
+    """Убрать hop-by-hop заголовки, в том числе перечисленные в Connection"""
+    connection_tokens = {token.strip().lower() for token in headers.get('Connection', '').split(',')}
+    excluded = HOP_BY_HOP_HEADERS | connection_tokens | {name.lower() for name in drop}
+    return [(key, value) for key, value in headers.items() if key.lower() not in excluded]
+
+
+class StreamBody:
+    """Тело запроса клиента, читаемое по частям при отправке на бэкенд.
+
+    Известная длина (__len__) позволяет requests выставить Content-Length
+    вместо chunked-кодирования. Перемотать можно только непрочитанное тело:
+    повтор запроса после частичной отправки невозможен.
+    """
+
+    def __init__(self, stream, length, chunk_size=STREAM_CHUNK_SIZE):
+        self.stream = stream
+        self.length = length
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self.position
+        chunk = self.stream.read(min(size, self.length - self.position))
+        self.position += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=0):
+        if whence != 0 or position != self.position:
+            raise OSError('Тело запроса уже отправлено и не может быть перечитано')
+        return self.position
+
+
+class ClosingBody:
+    """Тело ответа клиенту, вызывающее on_close при закрытии.
+
+    WSGI-сервер вызывает close() у тела всегда, даже если клиент ушёл до
+    первого фрагмента - в отличие от finally в ещё не запущенном генераторе.
+    """
+
+    def __init__(self, chunks, on_close):
+        self.chunks = chunks
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.chunks
+        self.close()  # дочитано - освобождаем, не дожидаясь сервера
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self.chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.on_close()
+
+
+class BackendClient:
+    """Сессия requests с keep-alive к одному бэкенду.
+
+    Соединения переиспользуются между запросами (до max_connections
+    одновременно). Ошибки подключения повторяются для любых методов
+    (запрос ещё не ушёл), ошибки чтения - только для идемпотентных.
+    """
+
+    def __init__(self, url, max_connections=MAX_CONNECTIONS, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, retries=RETRIES):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=0,
+            allowed_methods=IDEMPOTENT_METHODS,
+            backoff_factor=0.05,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections,
+                                   max_retries=retry, pool_block=False)
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('allow_redirects', False)
+        return self.session.request(method, f'{self.url}{path}', **kwargs)
+
+    def stats(self):
+        """Сколько запросов обслужено и сколько TCP-соединений открыто"""
+        requests_total = 0
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_total += pool.num_requests
+            connections += pool.num_connections
+        reuse = 1 - connections / requests_total if requests_total else 0.0
+        return {
+            'requests': requests_total,
+            'connections_opened': connections,
+            'reuse_rate': round(reuse, 4),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class BackendClients:
+    """Реестр BackendClient по URL бэкенда"""
+
+    def __init__(self, **options):
+        self.options = options
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        client = self._clients.get(url)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(url)
+                if client is None:
+                    client = BackendClient(url, **self.options)
+                    self._clients[url] = client
+        return client
+
+    def discard(self, url):
+        with self._lock:
+            client = self._clients.pop(url, None)
+        if client is not None:
+            client.close()
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        per_backend = {client.url: client.stats() for client in clients}
+        requests_total = sum(s['requests'] for s in per_backend.values())
+        connections = sum(s['connections_opened'] for s in per_backend.values())
+        return {
+            'backends': per_backend,
+            'requests': requests_total,
+            'connections_opened': connections,
+            'reuse_rate': round(1 - connections / requests_total, 4) if requests_total else 0.0,
+        }
@@ -1,171 +1,607 @@
-from flask import Flask, jsonify, request, redirect, render_template
+from flask import Flask, jsonify, request, redirect, render_template, Response
 import requests
+from requests.structures import CaseInsensitiveDict
+import urllib3
+import logging
+import os
+import queue
+import socket
 import threading
 import time
+from backend_pool import BackendClients, StreamBody, ClosingBody, filter_headers, STREAM_CHUNK_SIZE
+from lb_cache import ResponseCache, CacheEntry, freshness, request_bypasses, etag_matches
+from lb_strategies import STRATEGIES, StatsRegistry
+from lb_health import HealthChecker
+from lb_registry import ServerRegistry
+from lb_state import PoolStore, POOL_FILE, POOL_SYNC_INTERVAL
+from lb_metrics import MetricsRegistry, EventLog
+from lb_admission import (AdmissionController, BreakerRegistry, Overloaded, parse_priority, OPEN,
+                          PRIORITY_HEADER, BACKEND_MAX_IN_FLIGHT)
 
 app = Flask(__name__)
 
-# Начальный пул серверов
-server_pool = [
-    {"url": "http://localhost:5001", "weight": 1, "active": True},
-    {"url": "http://localhost:5002", "weight": 1, "active": True},
+# Сессии с keep-alive к бэкендам (по одной на URL)
+backend_clients = BackendClients()
+
+# Потоковая пересылка тел запросов и ответов
+STREAMING = os.environ.get('LB_STREAMING', '1') != '0'
+
+HEALTH_TIMEOUT = float(os.environ.get('LB_HEALTH_TIMEOUT', 3))
+
+# Очередь допуска запросов и автоматы защиты бэкендов (lb_admission.py)
+admission = AdmissionController()
+breakers = BreakerRegistry()
+BACKEND_WAIT_STEP = 0.02   # как часто ждущий запрос проверяет, не освободился ли бэкенд
+
+# Журнал событий: уровень LB_LOG_LEVEL, события каждого запроса - на DEBUG
+# с долей LB_LOG_SAMPLE (lb_metrics.py)
+events = EventLog('balancer')
+
+# Кеш GET-ответов с явным сроком свежести (LB_CACHE_BYTES=0 отключает, lb_cache.py)
+response_cache = ResponseCache()
+
+# Начальный пул серверов (LB_BACKENDS="http://host:port,..." заменяет список).
+# Изменения пула атомарны, выбор сервера читает снимок без блокировки (lb_registry.py)
+DEFAULT_BACKENDS = "http://localhost:5001,http://localhost:5002"
+initial_servers = [
+    {"url": url.strip(), "weight": 1, "active": True}
+    for url in os.environ.get('LB_BACKENDS', DEFAULT_BACKENDS).split(',') if url.strip()
 ]
 
-current_index = 0
+# С LB_POOL_FILE пул (вместе с активностью серверов) переживает перезапуск;
+# балансировщики одного хоста с общим файлом видят изменения друг друга (lb_state.py)
+pool_store = PoolStore(POOL_FILE) if POOL_FILE else None
+if pool_store:
+    initial_servers = pool_store.load(initial_servers)
+server_pool = ServerRegistry(
+    {"url": server['url'], "weight": server.get('weight', 1), "active": server.get('active', True)}
+    for server in initial_servers
+)
+
+# Запуск нескольких балансировщиков на одном порту (SO_REUSEPORT)
+REUSE_PORT = os.environ.get('LB_REUSE_PORT', '0') != '0'
+
+# Стратегии выбора бэкенда и статистика по бэкендам (lb_strategies.py)
+backend_stats = StatsRegistry()
+strategies = {name: cls(backend_stats) for name, cls in STRATEGIES.items()}
+current_strategy = os.environ.get('LB_STRATEGY', 'round_robin')
+if current_strategy not in strategies:
+    current_strategy = 'round_robin'
+
+# Откуда брать ключ сессии для консистентного хеширования
+HASH_HEADER = os.environ.get('LB_HASH_HEADER', 'X-Session-Id')
+HASH_COOKIE = os.environ.get('LB_HASH_COOKIE', 'session')
 
 def health_check(server):
     try:
-        response = requests.get(f"{server['url']}/health", timeout=3)
+        response = requests.get(f"{server['url']}/health", timeout=HEALTH_TIMEOUT)
         if response.status_code == 200:
             return True
     except requests.exceptions.RequestException:
         pass
     return False
 
-def background_health_check():
-    while True:
-        active_count = 0
-        for server in server_pool:
-            is_healthy = health_check(server)
-            server['active'] = is_healthy
-            status = "Доступен" if is_healthy else "Недоступен"
-            if is_healthy:
-                active_count += 1
-            print(f"{server['url']}: {status}")
-        print(f"Активных серверов: {active_count}/{len(server_pool)}")
-        time.sleep(5)
-
-def get_next_server():
-    global current_index
-    start_index = current_index
-    
-    for i in range(len(server_pool)):
-        server = server_pool[current_index]
-        current_index = (current_index + 1) % len(server_pool)
-        
-        if server['active']:
-            print(f"Выбран сервер: {server['url']}")
+# Проверки здоровья: параллельные активные пробы + пассивное исключение
+# серверов по ошибкам проксирования (lb_health.py)
+def set_server_active(server, active):
+    """Сменить активность сервера в пуле; в файл пула она попадёт из
+    фонового потока (вызывается под блокировкой HealthChecker)"""
+    if not server_pool.set_active(server, active):
+        return False
+    if pool_store:
+        pool_updates.put(('set_active', server['url'], active))
+    return True
+
+health_checker = HealthChecker(server_pool.snapshot, health_check,
+                               set_active=set_server_active, log=events.info)
+
+# Метрики для Prometheus (/metrics)
+metrics = MetricsRegistry()
+selections = metrics.counter('lb_selections_total', 'Выборы бэкенда стратегией',
+                             ('backend', 'strategy'))
+upstream_responses = metrics.counter('lb_backend_responses_total', 'Ответы бэкендов по классу статуса',
+                                     ('backend', 'status'))
+upstream_latency = metrics.histogram('lb_upstream_latency_seconds',
+                                     'Задержка до заголовков ответа бэкенда', ('backend',))
+errors = metrics.counter('lb_errors_total', 'Ошибки балансировщика по типу', ('type',))
+metrics.gauge('lb_backend_in_flight', 'Запросы к бэкенду в работе', ('backend',),
+              collect=lambda: [((url,), stats['in_flight']) for url, stats in backend_stats.snapshot().items()])
+metrics.gauge('lb_backend_up', 'Бэкенд в пуле активен', ('backend',),
+              collect=lambda: [((server['url'],), int(server['active'])) for server in server_pool.snapshot()])
+metrics.counter('lb_cache_requests_total', 'Обращения к кешу ответов', ('result',),
+                collect=lambda: [(('hit',), response_cache.hits), (('stale',), response_cache.stale_hits),
+                                 (('miss',), response_cache.misses),
+                                 (('coalesced',), response_cache.coalesced)])
+metrics.counter('lb_cache_saved_bytes_total', 'Байт тел ответов, отданных из кеша',
+                collect=lambda: [((), response_cache.bytes_saved)])
+metrics.gauge('lb_admission_active', 'Запросы, допущенные к проксированию',
+              collect=lambda: [((), admission.active)])
+metrics.gauge('lb_admission_queue', 'Запросы в очереди допуска',
+              collect=lambda: [((), admission.stats()['queued_now'])])
+metrics.gauge('lb_circuit_open', 'Автомат защиты бэкенда: 0 - закрыт, 1 - пробный режим, 2 - открыт',
+              ('backend',), collect=lambda: [((url,), CIRCUIT_LEVELS[breaker['state']])
+                                             for url, breaker in breakers.snapshot().items()])
+metrics.gauge('lb_cache_bytes', 'Размер кеша ответов', collect=lambda: [((), response_cache.bytes)])
+
+def record_response(target_server, stats, started, status):
+    """Учесть ответ бэкенда в статистике, метриках, автомате защиты и
+    пассивной проверке; True для 5xx"""
+    latency = stats.observe(started)
+    upstream_latency.observe(latency, target_server['url'])
+    upstream_responses.inc(target_server['url'], f'{status // 100}xx')
+    failed = status >= 500
+    if failed:
+        errors.inc('upstream_5xx')
+    breakers.get(target_server['url']).record(failed)
+    health_checker.record(target_server, error=failed)
+    return failed
+
+def record_unreachable(target_server, stats):
+    """Бэкенд не ответил (клиент получит 502)"""
+    stats.end(error=True)
+    errors.inc('bad_gateway')
+    breakers.get(target_server['url']).record(True)
+    health_checker.record(target_server, error=True)
+
+CIRCUIT_LEVELS = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def available(server):
+    """Автомат защиты не открыт и не исчерпан предел запросов в работе"""
+    if (BACKEND_MAX_IN_FLIGHT
+            and backend_stats.get(server['url']).in_flight >= BACKEND_MAX_IN_FLIGHT):
+        return False
+    return breakers.get(server['url']).current_state() != OPEN
+
+def get_next_server(key=None):
+    """Выбрать доступный сервер текущей стратегией (key - ключ сессии)"""
+    candidates = [server for server in server_pool.active() if available(server)]
+    strategy = current_strategy
+    while candidates:
+        server = strategies[strategy].select(candidates, key)
+        # В пробном режиме автомат пропускает лишь несколько запросов
+        if breakers.get(server['url']).try_acquire():
+            selections.inc(server['url'], strategy)
+            events.sampled('selected', backend=server['url'], strategy=strategy)
             return server
-            
-        if current_index == start_index:
-            break
-            
+        candidates = [candidate for candidate in candidates if candidate is not server]
     return None
 
-# Запускаем поток с проверкой здоровья
-health_thread = threading.Thread(target=background_health_check, daemon=True)
-health_thread.start()
+def set_strategy(name):
+    global current_strategy
+    if name not in strategies:
+        return False
+    current_strategy = name
+    events.info('strategy_changed', strategy=name)
+    return True
 
-@app.route('/health', methods=['GET'])
-def lb_health():
+def affinity_key(headers, cookies, remote_addr):
+    """Ключ привязки сессии: заголовок, затем cookie, затем адрес клиента"""
+    return headers.get(HASH_HEADER) or cookies.get(HASH_COOKIE) or remote_addr
+
+# Запускаем поток с проверкой здоровья (LB_HEALTH_CHECK=0 отключает, например в тестах)
+if os.environ.get('LB_HEALTH_CHECK', '1') != '0':
+    health_thread = health_checker.start()
+
+def pool_status():
     server_statuses = []
-    for server in server_pool:
+    for server in server_pool.snapshot():
         server_statuses.append({
             "url": server['url'],
+            "weight": server.get('weight', 1),
             "active": server['active']
         })
-    return jsonify({"server_pool": server_statuses})
+    return server_statuses
 
-@app.route('/process', methods=['GET', 'POST'])
-def lb_process():
-    target_server = get_next_server()
-    if not target_server:
-        return jsonify({"error": "Нет доступных серверов"}), 503
+@app.route('/health', methods=['GET'])
+def lb_health():
+    return jsonify({
+        "server_pool": pool_status(),
+        "strategy": current_strategy,
+        "backend_stats": backend_stats.snapshot(),
+        "health": health_checker.snapshot(),
+        "cache": response_cache.stats(),
+        "admission": admission.stats(),
+        "circuit_breakers": breakers.snapshot(),
+        "connection_pool": backend_clients.stats(),
+    })
 
+def cache_key(path):
+    return f"{path}?{request.query_string.decode('latin-1')}|{request.headers.get('Accept-Encoding', '')}"
+
+def cached_response(entry, cache_status, now):
+    """Ответ клиенту из кеша; 304, если у клиента та же версия"""
+    headers = entry.headers + [('Age', str(entry.age(now))), ('X-Cache', cache_status)]
+    if etag_matches(request.headers.get('If-None-Match'), entry.etag):
+        return Response(status=304, headers=[(key, value) for key, value in headers
+                                             if key.lower() not in ('content-type', 'content-encoding')])
+    return Response(entry.body, status=entry.status, headers=headers)
+
+def store_response(key, response, stale=None):
+    """Положить ответ бэкенда в кеш и закрыть его.
+
+    Возвращает запись кеша или None - тогда ответ не прочитан и его нужно
+    переслать клиенту как есть, а ключ помечается как pass. На 304
+    обновляется срок устаревшей записи - stale передаётся, только если
+    запрос был условным именно по её ETag.
+    """
+    if response.status_code == 304:
+        if stale is None:
+            return None  # ответ на условный запрос самого клиента
+        limits = (freshness(stale.status, response.headers)
+                  or freshness(stale.status, CaseInsensitiveDict(stale.headers)))
+        response.close()
+        if limits:
+            stale.refresh(*limits)
+        response_cache.record('not_modified', stale)
+        return stale
+    limits = freshness(response.status_code, response.headers)
+    length = response.headers.get('Content-Length')
+    if (limits is None or not length or not length.isdigit()
+            or int(length) > response_cache.max_entry_bytes
+            or 'chunked' in response.headers.get('Transfer-Encoding', '').lower()):
+        response_cache.mark_pass(key)
+        return None
     try:
-        response = requests.request(
-            method=request.method,
-            url=f"{target_server['url']}/process",
-            headers={key: value for (key, value) in request.headers if key != 'Host'},
-            data=request.get_data(),
+        body = response.raw.read(decode_content=False)
+    finally:
+        response.close()
+    entry = CacheEntry(response.status_code, filter_headers(response.raw.headers), body, *limits)
+    response_cache.put(key, entry)
+    return entry
+
+def revalidate(key, path, params, headers, entry):
+    """Фоновое обновление устаревшей записи (stale-while-revalidate)"""
+    try:
+        target_server = get_next_server(key)
+        if not target_server:
+            return
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        stats = backend_stats.get(target_server['url'])
+        started = stats.begin()
+        try:
+            response = backend_clients.get(target_server['url']).request(
+                'GET', path, headers=headers, params=params, stream=True)
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError):
+            record_unreachable(target_server, stats)
+            return
+        failed = record_response(target_server, stats, started, response.status_code)
+        try:
+            store_response(key, response, entry)
+        finally:
+            response.close()
+            stats.end(error=failed)
+        response_cache.record('revalidation')
+    finally:
+        response_cache.end_fetch(key)
+
+def proxy_cached(path):
+    """GET через кеш ответов, остальные запросы - сразу на бэкенд.
+
+    Одновременные промахи по одному ключу идут на бэкенд одним запросом,
+    устаревшая запись в окне stale-while-revalidate отдаётся сразу.
+    Ключи с недавним некешируемым ответом (pass) не склеиваются.
+    """
+    if not response_cache.enabled or request.method != 'GET' or request_bypasses(request.headers):
+        return proxy_to_next(path)
+    key = cache_key(path)
+    now = time.monotonic()
+    entry = response_cache.get(key, now)
+    if entry is not None and entry.is_fresh(now):
+        response_cache.record('hit', entry)
+        return cached_response(entry, 'HIT', now)
+    if entry is not None and entry.can_serve_stale(now):
+        response_cache.record('stale', entry)
+        leader, _ = response_cache.begin_fetch(key)
+        if leader:
+            headers = dict(filter_headers(request.headers, drop=('Host', 'If-None-Match')))
+            threading.Thread(target=revalidate, args=(key, path, request.args.copy(), headers, entry),
+                             daemon=True).start()
+        return cached_response(entry, 'STALE', now)
+    if response_cache.is_pass(key, now):
+        # Ответ всё равно пойдёт мимо кеша - ждать первый запрос незачем;
+        # кешируемый ответ снимет пометку
+        response_cache.record('pass')
+        return proxy_to_next(path, cache_key=key, stale=entry)
+
+    leader, done = response_cache.begin_fetch(key)
+    if not leader:
+        response_cache.record('coalesced')
+        # Ждём ведущего в очереди допуска: не дольше max_wait и с учётом
+        # её размера, иначе склеенные запросы копятся мимо ограничений
+        admission.wait_for(done, parse_priority(request.headers.get(PRIORITY_HEADER)))
+        now = time.monotonic()
+        entry = response_cache.get(key, now)
+        if entry is not None and entry.is_fresh(now):
+            response_cache.record('hit', entry)
+            return cached_response(entry, 'HIT', now)
+        return proxy_to_next(path)
+    response_cache.record('miss')
+    try:
+        return proxy_to_next(path, cache_key=key, stale=entry)
+    finally:
+        response_cache.end_fetch(key)
+
+def proxy_to_next(path, cache_key=None, stale=None):
+    """Допустить запрос через очередь (с учётом приоритета) и переслать.
+
+    Слот допуска держится до конца отдачи ответа клиенту. Если свободного
+    бэкенда нет, запрос ждёт его до истечения своего срока в очереди.
+    """
+    deadline = time.monotonic() + admission.max_wait
+    admission.acquire(parse_priority(request.headers.get(PRIORITY_HEADER)))
+    try:
+        key = affinity_key(request.headers, request.cookies, request.remote_addr)
+        target_server = get_next_server(key)
+        while not target_server and time.monotonic() < deadline:
+            time.sleep(BACKEND_WAIT_STEP)
+            target_server = get_next_server(key)
+        if not target_server:
+            errors.inc('no_backend')
+            response = app.make_response((jsonify({"error": "Нет доступных серверов"}), 503))
+        else:
+            response = app.make_response(proxy_request(target_server, path, cache_key, stale))
+    except BaseException:
+        admission.release()
+        raise
+    if response.direct_passthrough:
+        # Werkzeug не оборачивает такое тело, call_on_close не сработает
+        response.response = ClosingBody(response.response, admission.release)
+    else:
+        response.call_on_close(admission.release)
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    errors.inc(error.reason)
+    return jsonify({"error": "Балансировщик перегружен, повторите запрос позже"}), 503, {'Retry-After': '1'}
+
+@app.route('/metrics', methods=['GET'])
+def lb_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def proxy_request(target_server, path, cache_key=None, stale=None):
+    """Переслать текущий запрос на бэкенд через его пул соединений.
+
+    В потоковом режиме (LB_STREAMING, по умолчанию включён) тело запроса
+    передаётся бэкенду по частям, а ответ отдаётся клиенту по мере
+    получения - ни то, ни другое целиком в памяти не держится.
+    С cache_key кешируемый ответ сохраняется (stale - запись для
+    перепроверки по ETag).
+    """
+    headers = dict(filter_headers(request.headers, drop=('Host', 'Content-Length')))
+    if stale is not None and stale.etag:
+        headers.setdefault('If-None-Match', stale.etag)
+    if stale is not None and (not stale.etag or headers['If-None-Match'] != stale.etag):
+        stale = None  # 304 на чужой валидатор не подтверждает запись кеша
+    if STREAMING:
+        if request.content_length:
+            body = StreamBody(request.stream, request.content_length)
+        elif request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = iter(lambda: request.stream.read(STREAM_CHUNK_SIZE), b'')
+        else:
+            body = None
+    else:
+        body = request.get_data()
+    
+    stats = backend_stats.get(target_server['url'])
+    started = stats.begin()
+    try:
+        response = backend_clients.get(target_server['url']).request(
+            request.method,
+            path,
+            headers=headers,
+            data=body,
             params=request.args,
-            cookies=request.cookies,
-            allow_redirects=False
+            stream=True,
         )
-        return (response.content, response.status_code, response.headers.items())
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+        record_unreachable(target_server, stats)
         return jsonify({"error": f"Ошибка подключения к серверу: {str(e)}"}), 502
+    failed = record_response(target_server, stats, started, response.status_code)
+    
+    if cache_key is not None:
+        entry = store_response(cache_key, response, stale)
+        if entry is not None:
+            stats.end(error=failed)
+            return cached_response(entry, 'MISS', time.monotonic())
+    
+    # Тело пересылается как есть (без распаковки), поэтому Content-Length
+    # бэкенда верен, только если сам бэкенд не использовал chunked
+    drop = ('Content-Length',) if 'chunked' in response.headers.get('Transfer-Encoding', '').lower() else ()
+    response_headers = filter_headers(response.raw.headers, drop=drop)
+    
+    if not STREAMING:
+        try:
+            content = response.raw.read(decode_content=False)
+        finally:
+            response.close()
+            stats.end(error=failed)
+        return (content, response.status_code, response_headers)
+    
+    def finish():
+        response.close()
+        stats.end(error=failed)
+    
+    # Соединение вернётся в пул и при обрыве клиента до первого фрагмента
+    body = ClosingBody(response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False), finish)
+    return Response(body, status=response.status_code, headers=response_headers,
+                    direct_passthrough=True)
 
-# Web UI для управления пулом инстансов
-@app.route('/', methods=['GET'])
-def web_ui():
-    active_count = sum(1 for server in server_pool if server['active'])
-    return render_template(
-        'admin.html', 
-        servers=server_pool,
-        active_count=active_count,
-        total_count=len(server_pool),
-        current_index=current_index
-    )
+@app.route('/process', methods=['GET', 'POST'])
+def lb_process():
+    return proxy_cached('/process')
 
-# Добавление нового инстанса в пул
-@app.route('/add_instance', methods=['POST'])
-def add_instance():
-    ip = request.form.get('ip', 'localhost').strip()
-    port = request.form.get('port', '').strip()
+# Операции с пулом (общие для Flask- и asyncio-движка, см. async_balancer.py)
+def admin_context():
+    servers = server_pool.snapshot()
+    return {
+        "servers": servers,
+        "active_count": sum(1 for server in servers if server['active']),
+        "total_count": len(servers),
+        "current_index": strategies['round_robin'].index,
+        "strategies": [(name, strategy.title) for name, strategy in strategies.items()],
+        "current_strategy": current_strategy,
+        "stats": backend_stats.snapshot(),
+    }
+
+def validate_new_server(ip, port):
+    """URL нового инстанса или текст ошибки"""
+    ip = (ip or 'localhost').strip()
+    port = (port or '').strip()
     
     if not port:
-        return "Ошибка: Порт обязателен для заполнения", 400
+        return None, "Ошибка: Порт обязателен для заполнения"
     
     new_server_url = f"http://{ip}:{port}"
     
-    for server in server_pool:
-        if server['url'] == new_server_url:
-            return "Ошибка: Сервер уже существует в пуле", 400
-    
-    is_healthy = health_check({"url": new_server_url})
-    
+    if server_pool.find(new_server_url):
+        return None, "Ошибка: Сервер уже существует в пуле"
+    return new_server_url, None
+
+def parse_weight(value):
+    try:
+        return max(1, min(int(value), 100))
+    except (TypeError, ValueError):
+        return 1
+
+def add_server(new_server_url, is_healthy, weight=1):
     new_server = {
         "url": new_server_url,
-        "weight": 1,
+        "weight": weight,
         "active": is_healthy
     }
-    server_pool.append(new_server)
+    if server_pool.add(new_server) is None:
+        return None  # тот же URL успели добавить параллельно
+    persist_pool('add', new_server)
     
-    print(f"Добавлен новый сервер: {new_server_url} (Активен: {is_healthy})")
+    events.info('server_added', backend=new_server_url, active=is_healthy, weight=weight)
+    return new_server
+
+def remove_server(index_value):
+    """Удалённый сервер или текст ошибки"""
+    try:
+        index = int(index_value)
+    except (TypeError, ValueError):
+        return None, "Ошибка: Неверный формат индекса"
+    
+    removed_server = server_pool.remove(index)
+    if removed_server is None:
+        return None, "Ошибка: Неверный индекс сервера"
+    forget_backend(removed_server['url'])
+    persist_pool('remove', removed_server['url'])
+    
+    events.info('server_removed', backend=removed_server['url'])
+    return removed_server, None
+
+def forget_backend(url):
+    """Освободить соединения и статистику сервера, ушедшего из пула"""
+    backend_clients.discard(url)
+    backend_stats.discard(url)
+    health_checker.discard(url)
+    breakers.discard(url)
+    metrics.forget('backend', url)
+
+def persist_pool(operation, *args):
+    """Записать изменение пула на диск; ошибка записи не отменяет изменения в памяти"""
+    if not pool_store:
+        return
+    try:
+        getattr(pool_store, operation)(*args)
+    except (OSError, ValueError) as e:
+        events.warning('pool_persist_failed', operation=operation, error=str(e))
+
+# Изменения пула от проверок здоровья пишутся на диск отдельным потоком:
+# flock и fsync не должны держать блокировки горячего пути и event loop
+pool_updates = queue.Queue()
+
+def pool_writer():
+    while True:
+        operation, *args = pool_updates.get()
+        try:
+            persist_pool(operation, *args)
+        finally:
+            pool_updates.task_done()
+
+pool_writer_thread = threading.Thread(target=pool_writer, daemon=True, name='pool-writer')
+pool_writer_thread.start()
+
+def sync_pool():
+    """Применить изменения пула, сделанные другими балансировщиками.
+
+    Для уже известных URL сохраняется своё состояние (активность по
+    проверкам здоровья), новые добавляются, исчезнувшие удаляются.
+    """
+    records = pool_store.poll() if pool_store else None
+    if records is None:
+        return False
+    for server in server_pool.merge(records):
+        forget_backend(server['url'])
+    events.info('pool_synced', version=pool_store.version, servers=len(records))
+    return True
+
+def background_pool_sync():
+    while True:
+        time.sleep(POOL_SYNC_INTERVAL)
+        try:
+            sync_pool()
+        except (OSError, ValueError) as e:
+            events.warning('pool_sync_failed', error=str(e))
+
+# Следим за общим файлом пула (LB_POOL_SYNC=0 отключает, например в тестах)
+if pool_store and os.environ.get('LB_POOL_SYNC', '1') != '0':
+    pool_sync_thread = threading.Thread(target=background_pool_sync, daemon=True, name='pool-sync')
+    pool_sync_thread.start()
+
+def reuse_port_socket(host, port):
+    """Слушающий сокет с SO_REUSEPORT: ядро распределяет соединения
+    между всеми процессами, открывшими тот же порт"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+# Web UI для управления пулом инстансов
+@app.route('/', methods=['GET'])
+def web_ui():
+    return render_template('admin.html', **admin_context())
+
+# Добавление нового инстанса в пул
+@app.route('/add_instance', methods=['POST'])
+def add_instance():
+    new_server_url, error = validate_new_server(request.form.get('ip', 'localhost'),
+                                                request.form.get('port', ''))
+    if error:
+        return error, 400
+    
+    add_server(new_server_url, health_check({"url": new_server_url}),
+               parse_weight(request.form.get('weight', 1)))
+    return redirect('/')
+
+# Смена стратегии балансировки
+@app.route('/set_strategy', methods=['POST'])
+def change_strategy():
+    if not set_strategy(request.form.get('strategy')):
+        return "Ошибка: Неизвестная стратегия", 400
     return redirect('/')
 
 # Удаление инстанса из пула
 @app.route('/remove_instance', methods=['POST'])
 def remove_instance():
-    try:
-        index = int(request.form.get('index'))
-        if 0 <= index < len(server_pool):
-            removed_server = server_pool.pop(index)
-            
-            global current_index
-            if current_index >= len(server_pool) and len(server_pool) > 0:
-                current_index = current_index % len(server_pool)
-            
-            print(f"Удален сервер: {removed_server['url']}")
-            return redirect('/')
-        else:
-            return "Ошибка: Неверный индекс сервера", 400
-    except ValueError:
-        return "Ошибка: Неверный формат индекса", 400
+    removed_server, error = remove_server(request.form.get('index'))
+    if error:
+        return error, 400
+    return redirect('/')
 
 # Универсальный обработчик для перехвата всех других запросов
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
 def catch_all(path):
-    target_server = get_next_server()
-    if not target_server:
-        return jsonify({"error": "Нет доступных серверов"}), 503
-    
-    try:
-        response = requests.request(
-            method=request.method,
-            url=f"{target_server['url']}/{path}",
-            headers={key: value for (key, value) in request.headers if key != 'Host'},
-            data=request.get_data(),
-            params=request.args,
-            cookies=request.cookies,
-            allow_redirects=False
-        )
-        return (response.content, response.status_code, response.headers.items())
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Ошибка подключения к серверу: {str(e)}"}), 502
+    return proxy_cached(f'/{path}')
 
 if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
     print("Балансировщик нагрузки запущен на http://localhost:5000")
     print("Доступные эндпоинты:")
     print("   - http://localhost:5000/ (Web интерфейс)")
@@ -174,4 +610,9 @@ if __name__ == '__main__':
     print("\nНачальный пул серверов:")
     for i, server in enumerate(server_pool):
         print(f"   {i+1}. {server['url']}")
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    if REUSE_PORT:
+        from werkzeug.serving import make_server
+        sock = reuse_port_socket('localhost', 5000)
+        make_server('localhost', 5000, app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,116 @@
+# bench_balancer.py - сравнение Flask- и asyncio-движков балансировщика
+#
+# Поднимает бэкенды lab7/serv.py, оба балансировщика и нагружает каждый
+# одинаковым числом одновременных клиентов (aiohttp).
+#
+#   python bench_balancer.py --concurrency 200 --seconds 10
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+FLASK_ENGINE = (
+    "import balancer; "
+    "balancer.app.run(port={port}, threaded=True)"
+)
+
+
+def start(args, env=None):
+    return subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return True
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} не запустился')
+
+
+async def load(url, concurrency, seconds):
+    latencies = []
+    errors = 0
+    stop = time.perf_counter() + seconds
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                try:
+                    async with session.get(url) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                            continue
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def report(name, latencies, errors, seconds):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    median = statistics.median(latencies) if latencies else 0.0
+    print(f"{name:8} {len(latencies) / seconds:9.1f} rps  "
+          f"p50={median * 1000:7.1f} мс  p99={p99 * 1000:7.1f} мс  ошибок: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк движков балансировщика')
+    parser.add_argument('--backends', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--backend-port', type=int, default=5101)
+    parser.add_argument('--flask-port', type=int, default=5090)
+    parser.add_argument('--async-port', type=int, default=5091)
+    args = parser.parse_args()
+
+    backend_urls = [f"http://127.0.0.1:{args.backend_port + i}" for i in range(args.backends)]
+    env = dict(os.environ, LB_BACKENDS=','.join(backend_urls), LB_HEALTH_CHECK='0',
+               LB_POOL_FILE='')
+
+    processes = [start(['lab7/serv.py', str(args.backend_port + i)]) for i in range(args.backends)]
+    try:
+        for url in backend_urls:
+            wait_ready(f"{url}/health")
+
+        engines = [
+            ('flask', start(['-c', FLASK_ENGINE.format(port=args.flask_port)], env), args.flask_port),
+            ('asyncio', start(['async_balancer.py', '--host', '127.0.0.1',
+                               '--port', str(args.async_port)], env), args.async_port),
+        ]
+        processes += [process for _, process, _ in engines]
+
+        print(f"Бэкендов: {args.backends}, клиентов: {args.concurrency}, {args.seconds:.0f} с на движок")
+        for name, _, port in engines:
+            url = f"http://127.0.0.1:{port}/process"
+            wait_ready(url)
+            latencies, errors = asyncio.run(load(url, args.concurrency, args.seconds))
+            report(name, latencies, errors, args.seconds)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# bench_kv.py - пропускная способность записи key-value хранилища (lab7)
+#
+# Сравнивает запись с fsync в потоке запроса (LogStore.set) и групповую
+# фиксацию (GroupCommitter) при росте числа одновременно пишущих потоков.
+# Хранилище создаётся во временном каталоге, HTTP не участвует.
+#
+#   python bench_kv.py --seconds 2 --concurrency 1 2 4 8 16 32
+#   python bench_kv.py --window-ms 5
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lab7'))
+
+from kv_wal import GroupCommitter, LogStore
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(writer, threads, seconds):
+    """Записей в секунду и задержки одной записи"""
+    stop = time.perf_counter() + seconds
+    latencies = [[] for _ in range(threads)]
+
+    def worker(n):
+        i = 0
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            writer.set(f'w{n}-{i % 1000}', i)
+            latencies[n].append(time.perf_counter() - started)
+            i += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    merged = [value for values in latencies for value in values]
+    return len(merged) / elapsed, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк записи key-value хранилища')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Длительность каждого замера')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='Числа пишущих потоков')
+    parser.add_argument('--window-ms', type=float, default=2.0, help='Окно групповой фиксации')
+    args = parser.parse_args()
+
+    print(f"{'потоков':>8} {'режим':>8} {'записей/с':>10} {'fsync':>7} {'p50, мс':>8} {'p99, мс':>8}")
+    for threads in args.concurrency:
+        for mode in ('direct', 'group'):
+            store = LogStore(os.path.join(tempfile.mkdtemp(), 'data.json'), fsync='always')
+            writer = GroupCommitter(store, window=args.window_ms / 1000) if mode == 'group' else store
+            rate, latencies = run(writer, threads, args.seconds)
+            if mode == 'group':
+                writer.close()
+            store.close()
+            print(f"{threads:>8} {mode:>8} {rate:>10.0f} {store.fsyncs:>7} "
+                  f"{statistics.median(latencies) * 1000:>8.2f} {percentile(latencies, 99) * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
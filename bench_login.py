@@ -0,0 +1,93 @@
+# bench_login.py - нагрузочный тест входа в систему
+#
+# Запускает app.py во встроенном многопоточном сервере, нагружает /login
+# параллельными попытками входа и одновременно замеряет задержку обычной
+# страницы ('/'), которая не хеширует пароли.
+#
+#   python bench_login.py --threads 16 --seconds 10
+#   HASH_WORKERS=0 python bench_login.py   # хеширование в потоках запросов
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк /login')
+    parser.add_argument('--threads', type=int, default=16, help='Параллельных клиентов входа')
+    parser.add_argument('--seconds', type=float, default=10.0, help='Длительность замера')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    os.environ.setdefault('SUBSCRIPTIONS_DB', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    from app import app, hasher
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{args.port}'
+
+    requests.post(f'{base}/register', data={'username': 'bench', 'password': 'bench'})
+
+    stop = time.perf_counter() + args.seconds
+    login_latencies = []
+    page_latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+
+    def login_worker():
+        http = requests.Session()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            response = http.post(f'{base}/login', data={'username': 'bench', 'password': 'bench'},
+                                 allow_redirects=False)
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 503:
+                    rejected[0] += 1
+                else:
+                    login_latencies.append(elapsed)
+
+    def page_worker():
+        http = requests.Session()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            http.get(f'{base}/')
+            page_latencies.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=login_worker) for _ in range(args.threads)]
+    workers.append(threading.Thread(target=page_worker))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    server.shutdown()
+    hasher.shutdown()
+
+    print(f"Хеширование: {hasher.stats()['method']}, процессов: {hasher.workers}")
+    print(f"Входов: {len(login_latencies)} за {args.seconds:.0f} с "
+          f"({len(login_latencies) / args.seconds:.1f} входов/с), отказов 503: {rejected[0]}")
+    if login_latencies:
+        print(f"  /login  p50={statistics.median(login_latencies) * 1000:.1f} мс "
+              f"p99={percentile(login_latencies, 99) * 1000:.1f} мс")
+    if page_latencies:
+        print(f"  /       p50={statistics.median(page_latencies) * 1000:.1f} мс "
+              f"p99={percentile(page_latencies, 99) * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
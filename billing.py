@@ -0,0 +1,113 @@
+# billing.py - фоновое продление next_charge_date для подписок
+import time
+from datetime import date
+
+import charge_dates
+
+# Подписки к списанию в порядке (next_charge_date, id): использует
+# частичный индекс idx_subscriptions_due
+SQL_DUE_CHUNK = '''
+    SELECT id, interval, next_charge_date, start_date FROM subscriptions
+    WHERE is_active = 1 AND next_charge_date <= ?
+      AND (next_charge_date, id) > (?, ?)
+    ORDER BY next_charge_date, id
+    LIMIT ?
+'''
+SQL_ADVANCE = 'UPDATE subscriptions SET next_charge_date = ? WHERE id = ? AND next_charge_date = ?'
+
+SQL_UNFINISHED_RUN = '''
+    SELECT id, last_date, last_id, processed FROM billing_runs
+    WHERE as_of = ? AND finished_at IS NULL
+    ORDER BY id DESC LIMIT 1
+'''
+
+
+def advance_batch(rows, as_of):
+    """Новые даты списания для пачки строк (id, interval, next_charge_date, start_date).
+
+    Дата считается от даты начала подписки как первая дата списания
+    позже as_of - сразу, без пошагового продления. Расчёт кешируется в
+    charge_dates по уникальной паре (дата начала, период). Возвращает
+    (обновления, id строк с некорректной датой начала) - такие строки
+    пропускаются, а не прерывают запуск.
+    """
+    updates = []
+    skipped = []
+    for row in rows:
+        try:
+            new_date = charge_dates.next_charge_after(row[3], row[1], as_of)
+        except ValueError:
+            skipped.append(row[0])
+            continue
+        updates.append((new_date, row[0], row[2]))
+    return updates, skipped
+
+
+def _start_run(conn, as_of):
+    run = conn.execute(SQL_UNFINISHED_RUN, (as_of,)).fetchone()
+    if run is not None:
+        return run[0], run[1], run[2], run[3]
+    with conn:
+        cur = conn.execute(
+            'INSERT INTO billing_runs (as_of, started_at, last_date, last_id, processed) '
+            'VALUES (?, ?, ?, ?, 0)',
+            (as_of, time.time(), '', 0))
+    return cur.lastrowid, '', 0, 0
+
+
+def run_billing(conn, as_of=None, chunk_size=5000, max_chunks=None, log=print):
+    """Продлить все подписки с next_charge_date <= as_of.
+
+    Каждая пачка обновляется через executemany в отдельной короткой
+    транзакции вместе с контрольной точкой в billing_runs, поэтому
+    прерванный запуск продолжается с того же места.
+    """
+    if as_of is None:
+        as_of = date.today().isoformat()
+
+    run_id, last_date, last_id, processed = _start_run(conn, as_of)
+    started = time.perf_counter()
+    run_processed = 0
+    skipped = []
+    chunks = 0
+
+    while max_chunks is None or chunks < max_chunks:
+        rows = conn.execute(SQL_DUE_CHUNK, (as_of, last_date, last_id, chunk_size)).fetchall()
+        if not rows:
+            with conn:
+                conn.execute('UPDATE billing_runs SET finished_at = ? WHERE id = ?',
+                             (time.time(), run_id))
+            break
+
+        updates, bad_ids = advance_batch(rows, as_of)
+        skipped.extend(bad_ids)
+        last_id, _, last_date, _ = rows[-1]
+        processed += len(updates)
+
+        with conn:
+            conn.executemany(SQL_ADVANCE, updates)
+            conn.execute(
+                'UPDATE billing_runs SET last_date = ?, last_id = ?, processed = ? WHERE id = ?',
+                (last_date, last_id, processed, run_id))
+
+        run_processed += len(updates)
+        chunks += 1
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        'run_id': run_id,
+        'as_of': as_of,
+        'processed': run_processed,
+        'processed_total': processed,
+        'skipped': len(skipped),
+        'chunks': chunks,
+        'elapsed': round(elapsed, 3),
+        'rows_per_sec': round(run_processed / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    if log:
+        log(f"Биллинг {as_of}: продлено {run_processed} подписок за {stats['elapsed']} с "
+            f"({stats['rows_per_sec']} строк/с, пачек: {chunks})")
+        if skipped:
+            log(f"Пропущено подписок с некорректной датой начала: {len(skipped)} "
+                f"(id: {', '.join(map(str, skipped))})")
+    return stats
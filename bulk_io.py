@@ -0,0 +1,168 @@
+# bulk_io.py - массовый импорт и экспорт подписок (CSV / NDJSON)
+import csv
+import io
+import json
+
+from charge_dates import parse_date
+
+FORMATS = ('csv', 'ndjson')
+INTERVALS = ('monthly', 'yearly', 'weekly')
+EXPORT_FIELDS = ('id', 'name', 'amount', 'interval', 'start_date', 'next_charge_date', 'is_active')
+MAX_REPORTED_ERRORS = 100
+
+SQL_INSERT = '''
+    INSERT INTO subscriptions (user_id, name, amount, interval, start_date, next_charge_date, is_active)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class ImportFormatError(ValueError):
+    """Неизвестный формат или нечитаемый заголовок файла"""
+
+
+def iter_records(text_stream, fmt):
+    """Читать записи по одной: (номер строки, dict). Файл целиком не грузится."""
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        if reader.fieldnames is None:
+            return
+        missing = {'name', 'amount', 'interval', 'start_date'} - set(reader.fieldnames)
+        if missing:
+            raise ImportFormatError(f"Нет колонок: {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_num, line in enumerate(text_stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_num, None
+                continue
+            yield line_num, record
+    else:
+        raise ImportFormatError(f'Неизвестный формат: {fmt}')
+
+
+def _text(record, field):
+    """Строковое поле без пробелов по краям; None, если в NDJSON не строка"""
+    value = record.get(field)
+    if value is None:
+        return ''
+    return value.strip() if isinstance(value, str) else None
+
+
+def validate_record(record, user_id, next_charge):
+    """Кортеж для INSERT или текст ошибки"""
+    if not isinstance(record, dict):
+        return None, 'Некорректная запись'
+    name = _text(record, 'name')
+    interval = _text(record, 'interval')
+    start_date = _text(record, 'start_date')
+    if name is None:
+        return None, 'Название должно быть строкой'
+    if interval is None:
+        return None, 'Период должен быть строкой'
+    if start_date is None:
+        return None, 'Некорректная дата начала'
+    if not name:
+        return None, 'Пустое название'
+    if interval not in INTERVALS:
+        return None, f'Неизвестный период: {interval}'
+    try:
+        amount = float(record.get('amount'))
+    except (TypeError, ValueError):
+        return None, 'Некорректная сумма'
+    if amount < 0:
+        return None, 'Отрицательная сумма'
+    try:
+        # next_charge заодно проверяет формат даты начала
+        next_charge_date = next_charge(start_date, interval)
+    except ValueError:
+        return None, 'Некорректная дата начала'
+    given_next_charge = _text(record, 'next_charge_date')
+    if given_next_charge:
+        try:
+            parse_date(given_next_charge)
+        except ValueError:
+            return None, 'Некорректная дата следующего списания'
+        next_charge_date = given_next_charge
+    elif given_next_charge is None:
+        return None, 'Некорректная дата следующего списания'
+    is_active = 0 if str(record.get('is_active', 1)).strip() in ('0', 'false', 'False') else 1
+    return (user_id, name, amount, interval, start_date, next_charge_date, is_active), None
+
+
+def import_records(conn, records, user_id, next_charge, batch_size=1000, commit_every=50000):
+    """Вставить записи пачками через executemany.
+
+    Проверка идёт пачками по batch_size, фиксация - раз в commit_every
+    строк, так что транзакции крупные, но не бесконечные. Некорректные
+    строки пропускаются и попадают в отчёт (первые MAX_REPORTED_ERRORS).
+    """
+    imported = 0
+    uncommitted = 0
+    failed = 0
+    errors = []
+    batch = []
+
+    def flush():
+        nonlocal imported, uncommitted
+        conn.executemany(SQL_INSERT, batch)
+        imported += len(batch)
+        uncommitted += len(batch)
+        batch.clear()
+        if uncommitted >= commit_every:
+            conn.commit()
+            uncommitted = 0
+
+    try:
+        for line_num, record in records:
+            row, error = validate_record(record, user_id, next_charge)
+            if error:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': line_num, 'error': error})
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {'imported': imported, 'failed': failed, 'errors': errors}
+
+
+def export_chunks(cur, fmt, fetch_size=1000):
+    """Генератор фрагментов CSV/NDJSON прямо из курсора"""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f'Неизвестный формат: {fmt}')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        if fmt == 'csv':
+            writer.writerow(EXPORT_FIELDS)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                values = [row[field] for field in EXPORT_FIELDS]
+                if fmt == 'csv':
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        cur.close()
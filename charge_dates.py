@@ -0,0 +1,113 @@
+# charge_dates.py - расчёт дат списания по периодам подписки
+#
+# Даты обрабатываются как порядковые номера дней (date.toordinal), месяцы
+# прибавляются календарно: день обрезается до длины месяца (31 января +
+# месяц = 29 февраля в високосный год), годовая подписка от 29 февраля
+# продлевается на 28 февраля. Все даты считаются от даты начала, поэтому
+# при многократном продлении день месяца не "уплывает".
+from calendar import monthrange
+from datetime import date
+from functools import lru_cache
+
+# Период -> (месяцев, дней) в одном шаге
+INTERVAL_STEPS = {
+    'weekly': (0, 7),
+    'monthly': (1, 0),
+    'yearly': (12, 0),
+}
+DEFAULT_INTERVAL = 'monthly'
+
+CACHE_SIZE = 65536
+
+
+def parse_date(value):
+    """Строго 'YYYY-MM-DD' -> date (ValueError для остального)"""
+    if not isinstance(value, str) or len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError(f'Некорректная дата: {value!r}')
+    return date.fromisoformat(value)
+
+
+def add_months(d, months):
+    year, month = divmod(d.month - 1 + months, 12)
+    year += d.year
+    month += 1
+    return date(year, month, min(d.day, monthrange(year, month)[1]))
+
+
+def _step(interval):
+    return INTERVAL_STEPS.get(interval, INTERVAL_STEPS[DEFAULT_INTERVAL])
+
+
+def nth_charge(start, interval, n):
+    """Дата n-го списания (n=0 - сама дата начала)"""
+    months, days = _step(interval)
+    if months:
+        return add_months(start, months * n)
+    return date.fromordinal(start.toordinal() + days * n)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def next_charge(start_date, interval):
+    """Первая дата списания после даты начала (строки 'YYYY-MM-DD')"""
+    return nth_charge(parse_date(start_date), interval, 1).isoformat()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def next_charge_after(start_date, interval, after_date):
+    """Ближайшая дата списания строго позже after_date"""
+    start = parse_date(start_date)
+    after = parse_date(after_date)
+    if after < start:
+        return nth_charge(start, interval, 1).isoformat()
+
+    months, days = _step(interval)
+    if months:
+        elapsed = (after.year - start.year) * 12 + after.month - start.month
+        n = max(1, elapsed // months)
+    else:
+        n = max(1, (after.toordinal() - start.toordinal()) // days)
+    charge = nth_charge(start, interval, n)
+    while charge <= after:
+        n += 1
+        charge = nth_charge(start, interval, n)
+    return charge.isoformat()
+
+
+def charges_between(start_date, interval, first, last):
+    """Порядковые номера всех дат списания в отрезке [first, last] (date)"""
+    start = parse_date(start_date)
+    if last < first:
+        return []
+    months, days = _step(interval)
+    if first <= start:
+        n = 1
+    elif months:
+        n = max(1, ((first.year - start.year) * 12 + first.month - start.month) // months)
+    else:
+        n = max(1, (first.toordinal() - start.toordinal()) // days)
+    ordinals = []
+    charge = nth_charge(start, interval, n)
+    while charge <= last:
+        if charge >= first:
+            ordinals.append(charge.toordinal())
+        n += 1
+        charge = nth_charge(start, interval, n)
+    return ordinals
+
+
+def next_charges(start_dates, intervals):
+    """Пакетный вариант next_charge для параллельных последовательностей"""
+    return [next_charge(start_date, interval) for start_date, interval in zip(start_dates, intervals)]
+
+
+def next_charges_after(start_dates, intervals, after_date):
+    """Пакетный вариант next_charge_after с общей датой after_date"""
+    return [next_charge_after(start_date, interval, after_date)
+            for start_date, interval in zip(start_dates, intervals)]
+
+
+def cache_info():
+    return {
+        'next_charge': next_charge.cache_info()._asdict(),
+        'next_charge_after': next_charge_after.cache_info()._asdict(),
+    }
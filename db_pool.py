@@ -0,0 +1,137 @@
+# db_pool.py - пул соединений SQLite для приложения подписок
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class SQLitePool:
+    """Ограниченный пул соединений SQLite.
+
+    Соединения создаются лениво (не больше max_size), настраиваются
+    один раз при создании (WAL, synchronous, busy_timeout) и затем
+    переиспользуются между запросами.
+    """
+
+    def __init__(self, database, max_size=8, timeout=5.0,
+                 journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+
+        self._idle = []
+        self._live = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Статистика для подбора размера пула
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def acquire(self):
+        """Взять соединение из пула (или создать новое, если есть место)"""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('Пул соединений закрыт')
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._live < self.max_size:
+                    self._live += 1
+                    conn = None
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise PoolTimeout('Нет свободных соединений в пуле')
+                waited = True
+                self._cond.wait(remaining)
+
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += time.perf_counter() - started
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._live -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+        return conn
+
+    def release(self, conn):
+        """Вернуть соединение в пул, откатив незавершённую транзакцию"""
+        broken = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            broken = True
+
+        with self._cond:
+            if broken or self._closed:
+                self._live -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер для кода вне запроса (init_db, CLI)"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Закрыть все простаивающие соединения"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._live -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'live_connections': self._live,
+                'idle_connections': len(self._idle),
+                'in_use': self._live - len(self._idle),
+                'created': self._created,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_avg': round(self._wait_time / self._waits, 6) if self._waits else 0.0,
+            }
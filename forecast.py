@@ -0,0 +1,115 @@
+# forecast.py - прогноз будущих списаний по подпискам пользователя
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date
+from itertools import accumulate
+
+import charge_dates
+
+
+class Timeline:
+    """Все будущие списания пользователя до горизонта.
+
+    ordinals - отсортированные даты списаний (date.toordinal), prefix -
+    накопленные суммы, поэтому сумма и число списаний в любом интервале
+    дат считаются двумя бинарными поисками.
+    """
+
+    def __init__(self, charges, today, horizon):
+        charges.sort()
+        self.today = today
+        self.horizon = horizon
+        self.ordinals = [ordinal for ordinal, _ in charges]
+        self.prefix = [0.0] + list(accumulate(amount for _, amount in charges))
+        self.built_at = time.monotonic()
+
+    def range_sum(self, first, last):
+        """(сумма, число списаний) в отрезке дат [first, last]"""
+        lo = bisect_left(self.ordinals, first.toordinal())
+        hi = bisect_right(self.ordinals, last.toordinal())
+        if hi <= lo:
+            return 0.0, 0
+        return self.prefix[hi] - self.prefix[lo], hi - lo
+
+
+def build_timeline(rows, today, horizon):
+    """Развернуть активные подписки (строки subscriptions) до даты horizon.
+
+    Подписки с некорректными датами в прогноз не попадают.
+    """
+    charges = []
+    for row in rows:
+        try:
+            first = max(today, charge_dates.parse_date(row['next_charge_date']))
+            ordinals = charge_dates.charges_between(row['start_date'], row['interval'], first, horizon)
+        except ValueError:
+            continue
+        for ordinal in ordinals:
+            charges.append((ordinal, row['amount']))
+    return Timeline(charges, today, horizon)
+
+
+def month_buckets(timeline, months):
+    """Суммы по календарным месяцам, начиная с текущего"""
+    start = date(timeline.today.year, timeline.today.month, 1)
+    buckets = []
+    for i in range(months):
+        first = charge_dates.add_months(start, i)
+        last = date.fromordinal(charge_dates.add_months(start, i + 1).toordinal() - 1)
+        total, count = timeline.range_sum(max(first, timeline.today), last)
+        buckets.append({'month': first.strftime('%Y-%m'), 'total': round(total, 2), 'count': count})
+    return buckets
+
+
+class TimelineIndex:
+    """Кеш построенных Timeline по user_id.
+
+    Изменение подписок сбрасывает только временную шкалу этого
+    пользователя (invalidate). Шкала перестраивается, если сменился день,
+    не хватает горизонта или истёк ttl (изменения из других процессов).
+    """
+
+    def __init__(self, loader, max_users=10000, ttl=300.0):
+        self.loader = loader
+        self.max_users = max_users
+        self.ttl = ttl
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.builds = 0
+        self.hits = 0
+
+    def get(self, user_id, horizon, today=None):
+        today = today or date.today()
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if (timeline is not None and timeline.today == today
+                    and timeline.horizon >= horizon
+                    and time.monotonic() - timeline.built_at < self.ttl):
+                self._timelines.move_to_end(user_id)
+                self.hits += 1
+                return timeline
+            invalidations = self._invalidations
+
+        timeline = build_timeline(self.loader(user_id), today, horizon)
+        with self._lock:
+            self.builds += 1
+            # Пока строили, данные могли измениться - такую шкалу не кешируем
+            if invalidations != self._invalidations:
+                return timeline
+            self._timelines[user_id] = timeline
+            self._timelines.move_to_end(user_id)
+            while len(self._timelines) > self.max_users:
+                self._timelines.popitem(last=False)
+        return timeline
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._invalidations += 1
+            self._timelines.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._timelines), 'builds': self.builds, 'hits': self.hits}
@@ -1,8 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import json
 import os
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from kv_wal import LogStore, GroupCommitter
 
 app = Flask(__name__)
 
@@ -15,26 +16,57 @@ limiter = Limiter(
     storage_uri="memory://"
 )
 
-# Путь к файлу данных
-DATA_FILE = 'data.json'
+# Путь к файлу данных (снимок) и журналу изменений рядом с ним (data.wal)
+DATA_FILE = os.environ.get('KV_DATA_FILE', 'data.json')
 
-# Загрузка данных при старте приложения
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
+# Когда журнал сбрасывается на диск: always - на каждой записи, batch - раз
+# в KV_FSYNC_BATCH записей, interval - раз в KV_FSYNC_INTERVAL секунд
+KV_FSYNC = os.environ.get('KV_FSYNC', 'always')
+KV_FSYNC_BATCH = int(os.environ.get('KV_FSYNC_BATCH', 64))
+KV_FSYNC_INTERVAL = float(os.environ.get('KV_FSYNC_INTERVAL', 1.0))
+# Групповая фиксация: записи, пришедшие за окно (мс), сбрасываются одним
+# fsync (KV_GROUP_COMMIT=0 - каждая запись пишется в потоке запроса)
+KV_GROUP_COMMIT = os.environ.get('KV_GROUP_COMMIT', '1') != '0'
+KV_GROUP_COMMIT_WINDOW_MS = float(os.environ.get('KV_GROUP_COMMIT_WINDOW_MS', 2))
+# Сколько ключей можно передать в одном запросе /mset, /mget, /mdelete
+KV_BATCH_MAX_KEYS = int(os.environ.get('KV_BATCH_MAX_KEYS', 10000))
+# Размер страницы /keys по умолчанию и наибольший допустимый
+KV_KEYS_PAGE_SIZE = int(os.environ.get('KV_KEYS_PAGE_SIZE', 1000))
+KV_KEYS_MAX_PAGE_SIZE = int(os.environ.get('KV_KEYS_MAX_PAGE_SIZE', 10000))
+# Предел памяти под данные (0 - без предела) и политика вытеснения: lru или lfu
+KV_MAX_MEMORY_BYTES = int(os.environ.get('KV_MAX_MEMORY_BYTES', 0))
+KV_EVICTION = os.environ.get('KV_EVICTION', 'lru')
+# Фоновый сборщик истёкших ключей: период и наибольшая длина одного шага (мс)
+KV_REAP_INTERVAL_MS = float(os.environ.get('KV_REAP_INTERVAL_MS', 100))
+KV_REAP_SLICE_MS = float(os.environ.get('KV_REAP_SLICE_MS', 1))
+# Уплотнение в снимок, когда журнал больше снимка и не меньше порога
+KV_COMPACT_MIN_BYTES = int(os.environ.get('KV_COMPACT_MIN_BYTES', 4 * 1024 * 1024))
 
-data = load_data()
+# Загрузка данных при старте приложения: снимок + проигрывание журнала
+store = LogStore(DATA_FILE, fsync=KV_FSYNC, batch_size=KV_FSYNC_BATCH, interval=KV_FSYNC_INTERVAL,
+                 compact_min_bytes=KV_COMPACT_MIN_BYTES, max_bytes=KV_MAX_MEMORY_BYTES, eviction=KV_EVICTION,
+                 reap_interval=KV_REAP_INTERVAL_MS / 1000, reap_budget=KV_REAP_SLICE_MS / 1000)
+data = store.data
+MISSING = object()
+if os.environ.get('KV_BACKGROUND', '1') != '0':
+    store.start()
+writer = GroupCommitter(store, window=KV_GROUP_COMMIT_WINDOW_MS / 1000) if KV_GROUP_COMMIT else store
+# Пачка операций одной записью журнала (одним fsync)
+commit = writer.submit if KV_GROUP_COMMIT else store.write
 
-def save_data():
-    """Сохранить данные в файл"""
+def parse_ttl(request_data):
+    """Срок жизни из поля 'ttl' (секунды): (ttl или None, ошибка или None)"""
+    ttl = request_data.get('ttl')
+    if ttl is None:
+        return None, None
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+        return None, "Поле 'ttl' должно быть положительным числом секунд"
+    return ttl, None
+
+def save_data(write, *args):
+    """Дописать изменение в журнал (O(размер записи), а не всего хранилища)"""
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        write(*args)
         return True
     except Exception as e:
         print(f"Ошибка при сохранении данных: {e}")
@@ -61,14 +93,18 @@ def set_key():
                 "status": "error"
             }), 400
         
-        key = request_data['key']
+        # Ключи в JSON-снимке - строки, в журнале должны быть такими же
+        key = str(request_data['key'])
         value = request_data.get('value')
+        ttl, error = parse_ttl(request_data)
+        if error:
+            return jsonify({
+                "error": error,
+                "status": "error"
+            }), 400
         
-        # Сохраняем в словарь
-        data[key] = value
-        
-        # Сохраняем в файл
-        if save_data():
+        # Сохраняем в журнал и словарь
+        if save_data(writer.set, key, value, ttl):
             return jsonify({
                 "message": f"Ключ '{key}' сохранен",
                 "status": "success"
@@ -89,10 +125,13 @@ def set_key():
 def get_key(key):
     """Получить значение по ключу"""
     try:
-        if key in data:
+        # Истёкший ключ удаляется здесь же, не дожидаясь фонового сборщика
+        value = store.get(key, MISSING)
+        if value is not MISSING:
             return jsonify({
                 "key": key,
-                "value": data[key],
+                "value": value,
+                "ttl": store.ttl(key),
                 "status": "success"
             }), 200
         else:
@@ -111,12 +150,9 @@ def get_key(key):
 def delete_key(key):
     """Удалить ключ"""
     try:
-        if key in data:
-            # Удаляем ключ
-            del data[key]
-            
-            # Сохраняем в файл
-            if save_data():
+        if store.contains(key):
+            # Удаляем ключ (запись в журнал и из словаря)
+            if save_data(writer.delete, key):
                 return jsonify({
                     "message": f"Ключ '{key}' удален",
                     "status": "success"
@@ -141,7 +177,7 @@ def delete_key(key):
 def exists_key(key):
     """Проверить наличие ключа"""
     try:
-        exists = key in data
+        exists = store.contains(key)
         return jsonify({
             "key": key,
             "exists": exists,
@@ -153,6 +189,87 @@ def exists_key(key):
             "status": "error"
         }), 500
 
+# ==================== ПАКЕТНЫЕ ОПЕРАЦИИ ====================
+
+def batch_error(message, code=400):
+    return jsonify({"error": message, "status": "error"}), code
+
+def batch_keys(request_data):
+    """Список ключей из {"keys": [...]} или (None, ответ с ошибкой)"""
+    keys = (request_data or {}).get('keys')
+    if not isinstance(keys, list):
+        return None, batch_error("Требуется JSON со списком 'keys'")
+    if len(keys) > KV_BATCH_MAX_KEYS:
+        return None, batch_error(f"Не более {KV_BATCH_MAX_KEYS} ключей в запросе", 413)
+    if any(key is None or isinstance(key, (dict, list)) for key in keys):
+        return None, batch_error("Ключ должен быть строкой или числом")
+    return list(dict.fromkeys(str(key) for key in keys)), None
+
+@app.route('/mset', methods=['POST'])
+@limiter.limit("10 per minute")
+def mset_keys():
+    """Сохранить несколько пар {"items": {ключ: значение}, "ttl": секунды}
+    одной записью журнала"""
+    try:
+        request_data = request.get_json(silent=True)
+        items = (request_data or {}).get('items')
+        if not isinstance(items, dict) or not items:
+            return batch_error("Требуется JSON с непустым объектом 'items'")
+        if len(items) > KV_BATCH_MAX_KEYS:
+            return batch_error(f"Не более {KV_BATCH_MAX_KEYS} ключей в запросе", 413)
+        ttl, error = parse_ttl(request_data)
+        if error:
+            return batch_error(error)
+
+        created = [key for key in items if not store.contains(key)]
+        # Все пары - одна запись журнала: после сбоя применятся все или ни одной
+        if save_data(commit, [store.set_op(key, value, ttl) for key, value in items.items()]):
+            return jsonify({
+                "stored": len(items),
+                "created": created,
+                "status": "success"
+            }), 200
+        return batch_error("Ошибка при сохранении данных", 500)
+    except Exception as e:
+        return batch_error(f"Внутренняя ошибка сервера: {str(e)}", 500)
+
+@app.route('/mget', methods=['POST'])
+def mget_keys():
+    """Значения нескольких ключей; отсутствующие перечислены в 'missing'"""
+    try:
+        keys, error = batch_keys(request.get_json(silent=True))
+        if error:
+            return error
+        values = store.get_many(keys)
+        return jsonify({
+            "values": values,
+            "missing": [key for key in keys if key not in values],
+            "status": "success"
+        }), 200
+    except Exception as e:
+        return batch_error(f"Внутренняя ошибка сервера: {str(e)}", 500)
+
+@app.route('/mdelete', methods=['POST'])
+@limiter.limit("10 per minute")
+def mdelete_keys():
+    """Удалить несколько ключей одной записью журнала"""
+    try:
+        keys, error = batch_keys(request.get_json(silent=True))
+        if error:
+            return error
+        deleted = [key for key in keys if store.contains(key)]
+        found = set(deleted)
+        missing = [key for key in keys if key not in found]
+        if deleted and not save_data(commit, [['del', key] for key in deleted]):
+            return batch_error("Ошибка при сохранении данных", 500)
+        return jsonify({
+            "deleted": deleted,
+            "missing": missing,
+            "status": "success"
+        }), 200
+    except Exception as e:
+        return batch_error(f"Внутренняя ошибка сервера: {str(e)}", 500)
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
     """Обработчик превышения лимита запросов"""
@@ -164,12 +281,49 @@ def ratelimit_handler(e):
 
 @app.route('/keys', methods=['GET'])
 def get_all_keys():
-    """Возвращает все ключи из хранилища"""
+    """Ключи по возрастанию, постранично: ?prefix=&after=&end=&limit=
+
+    after - курсор (поле 'next' предыдущей страницы), end - верхняя
+    граница диапазона (не включается). Следующая страница запрашивается
+    с after=next, пока next не станет null.
+    """
+    try:
+        limit = int(request.args.get('limit', KV_KEYS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'error': "limit должен быть числом"}), 400
+    if not 0 < limit <= KV_KEYS_MAX_PAGE_SIZE:
+        return jsonify({'success': False,
+                        'error': f"limit должен быть от 1 до {KV_KEYS_MAX_PAGE_SIZE}"}), 400
+
+    keys, more = store.scan(request.args.get('prefix', ''), request.args.get('after'),
+                            request.args.get('end'), limit)
     return jsonify({
         'success': True,
-        'keys': list(data.keys()),
-        'count': len(data)
+        'keys': keys,
+        'count': len(keys),
+        'next': keys[-1] if more else None,
+        'total': len(data)
         }), 200
+
+@app.route('/dump', methods=['GET'])
+def dump_keys():
+    """Все пары (или с префиксом ?prefix=) потоком NDJSON: по строке
+    {"key": ..., "value": ...}; хранилище блокируется только на время
+    чтения очередной страницы"""
+    prefix = request.args.get('prefix', '')
+
+    def generate():
+        after = None
+        while True:
+            page, more = store.scan(prefix, after, limit=KV_KEYS_PAGE_SIZE, values=True)
+            if page:
+                yield ''.join(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n'
+                              for key, value in page)
+            if not more:
+                return
+            after = page[-1][0]
+
+    return Response(generate(), mimetype='application/x-ndjson')
 # Корневой маршрут
 
 @app.route('/')
@@ -177,22 +331,29 @@ def index():
     return jsonify({
         'message': 'Key-Value Storage API',
         'endpoints': {
-            'POST /set': 'Save key-value pair',
+            'POST /set': 'Save key-value pair (optional "ttl" in seconds)',
             'GET /get/<key>': 'Get value by key',
             'DELETE /delete/<key>': 'Delete key',
             'GET /exists/<key>': 'Check if key exists',
-            'GET /keys': 'Get all keys'
+            'GET /keys': 'List keys page by page: ?prefix=&after=&end=&limit=',
+            'GET /dump': 'Stream all pairs as NDJSON: ?prefix=',
+            'POST /mset': 'Save many pairs atomically: {"items": {key: value}}',
+            'POST /mget': 'Get many values: {"keys": [...]}',
+            'POST /mdelete': 'Delete many keys atomically: {"keys": [...]}'
         },
-        'total_keys': len(data)
+        'total_keys': len(data),
+        'storage': store.stats(),
+        'group_commit': writer.stats() if KV_GROUP_COMMIT else None
     })
 
 if __name__ == '__main__':
     print(f"Key-Value хранилище запущено")
-    print(f"Данные загружены из {DATA_FILE}: {len(data)} записей")
+    print(f"Данные загружены из {DATA_FILE} и журнала {store.log_path}: {len(data)} записей")
     print(f"Общий лимит: 100 запросов в сутки")
     print(f"Лимиты для /set и /delete: 10 запросов в минуту")
     print(f"  Главная страница: http://127.0.0.1:5000/")
     print(f"  Получить значение: http://127.0.0.1:5000/get/<ключ>")
     print(f"  Проверить ключ:   http://127.0.0.1:5000/exists/<ключ>")
     print(f"  Все ключи:        http://127.0.0.1:5000/keys")
+    print(f"  Выгрузка NDJSON:  http://127.0.0.1:5000/dump")
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,90 @@
+# kv_index.py - упорядоченный индекс ключей для постраничного обхода и поиска по префиксу
+from bisect import bisect_left, bisect_right
+
+
+class SortedKeys:
+    """Отсортированный набор ключей: список отсортированных блоков.
+
+    Вставка и удаление сдвигают элементы только внутри одного блока
+    (не больше 2 * load), нужный блок находится бинарным поиском по
+    максимумам блоков, поэтому обе операции дёшевы и на миллионах ключей,
+    а обход с любого места стоит O(log n) плюс число выданных ключей.
+    """
+
+    def __init__(self, keys=(), load=512):
+        self.load = load
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        return block[bisect_left(block, key)] == key
+
+    def add(self, key):
+        """Добавить ключ; False, если он уже есть"""
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return True
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            block = self._blocks[i]
+            block.append(key)
+            self._maxes[i] = key
+        else:
+            block = self._blocks[i]
+            j = bisect_left(block, key)
+            if block[j] == key:
+                return False
+            block.insert(j, key)
+        self._len += 1
+        if len(block) > 2 * self.load:
+            self._blocks[i:i + 1] = [block[:self.load], block[self.load:]]
+            self._maxes[i:i + 1] = [block[self.load - 1], block[-1]]
+        return True
+
+    def discard(self, key):
+        """Удалить ключ; False, если его не было"""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if block[j] != key:
+            return False
+        del block[j]
+        self._len -= 1
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        elif j == len(block):
+            self._maxes[i] = block[-1]
+        return True
+
+    def random_key(self, rng):
+        """Случайный ключ (для выборки кандидатов на вытеснение)"""
+        return rng.choice(rng.choice(self._blocks))
+
+    def iter_from(self, start=None, inclusive=True):
+        """Ключи по возрастанию, начиная со start (или сразу после него)"""
+        if start is None:
+            i = j = 0
+        else:
+            find = bisect_left if inclusive else bisect_right
+            i = find(self._maxes, start)
+            if i == len(self._maxes):
+                return
+            j = find(self._blocks[i], start)
+        for block in self._blocks[i:]:
+            yield from block[j:] if j else block
+            j = 0
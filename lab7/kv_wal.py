@@ -0,0 +1,540 @@
+# kv_wal.py - журнал изменений (WAL) и снимки для key-value хранилища
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+from kv_index import SortedKeys
+
+FSYNC_POLICIES = ('always', 'batch', 'interval')
+EVICTION_POLICIES = ('lru', 'lfu')
+EVICTION_SAMPLES = 16       # кандидатов на вытеснение за один выбор
+ENTRY_OVERHEAD = 100        # примерные накладные расходы на ключ (словарь, индекс, учёт), байт
+_MISSING = object()
+
+
+def encode_record(ops):
+    """Строка журнала: CRC32 (hex), пробел, JSON со списком операций"""
+    payload = json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b'%08x ' % zlib.crc32(payload) + payload + b'\n'
+
+
+def decode_record(line):
+    """Список операций или None для оборванной/повреждённой строки"""
+    if not line.endswith(b'\n') or len(line) < 10 or line[8:9] != b' ':
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def write_atomic(path, payload):
+    """Записать файл целиком: временный файл + fsync + os.replace"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def fsync_dir(path):
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class LogStore:
+    """Данные в памяти, снимок на диске и журнал изменений после него.
+
+    Каждая пачка изменений дописывается в журнал одной строкой, поэтому
+    запись стоит O(размер записи), а не O(размер хранилища), и пачка
+    восстанавливается после сбоя целиком или не восстанавливается вовсе.
+    fsync журнала: always - после каждой записи, batch - раз в batch_size
+    записей, interval - фоновым потоком раз в interval секунд.
+
+    Уплотнение (compact) откладывает текущий журнал в <журнал>.1, пишет
+    снимок атомарно и удаляет отложенный журнал. При запуске загружается
+    снимок и проигрываются оба журнала; оборванная последняя строка
+    отбрасывается. Повторное проигрывание безопасно: операции set и del
+    дают тот же итог.
+
+    Рядом с данными поддерживается упорядоченный индекс ключей (index),
+    по которому scan выдаёт ключи постранично и по префиксу.
+
+    Срок жизни ключа хранится в самой операции set (абсолютное время
+    истечения), поэтому истёкшие ключи не воскресают при проигрывании.
+    Истёкший ключ удаляется при обращении (get, contains) или фоновым
+    сборщиком, который берёт ключи из кучи сроков шагами не дольше
+    reap_budget секунд. При max_bytes > 0 после записи, превысившей
+    предел, вытесняются ключи по приближённому LRU или LFU: из
+    EVICTION_SAMPLES случайных ключей - давно не читанный или редко читаемый.
+    """
+
+    def __init__(self, snapshot_path, log_path=None, fsync='batch', batch_size=64, interval=1.0,
+                 compact_min_bytes=4 * 1024 * 1024, compact_ratio=1.0, max_bytes=0, eviction='lru',
+                 reap_interval=0.1, reap_budget=0.001, clock=time.time):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Неизвестная политика fsync: {fsync}')
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f'Неизвестная политика вытеснения: {eviction}')
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path or os.path.splitext(snapshot_path)[0] + '.wal'
+        self.frozen_path = self.log_path + '.1'
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.interval = interval
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.reap_interval = reap_interval
+        self.reap_budget = reap_budget
+        self.clock = clock
+        self.data = {}
+        self.index = SortedKeys()
+        self.expires = {}           # ключ -> время истечения
+        self._heap = []             # (время истечения, ключ); устаревшие пары пропускаются
+        self.memory_bytes = 0
+        self._sizes = {}
+        self._usage = {}            # ключ -> [номер последнего обращения, число обращений]
+        self._ticks = itertools.count()
+        self._random = random.Random()
+        self.expired = 0
+        self.evictions = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        self.replayed = 0
+        self.truncated_bytes = 0
+        self.snapshot_bytes = 0
+        self.log_bytes = 0
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+        self._load()
+        if os.path.exists(self.frozen_path):
+            # Прошлое уплотнение прервалось: данные уже проиграны, допишем снимок
+            self._write_snapshot(dict(self.data))
+            os.remove(self.frozen_path)
+        self._log = open(self.log_path, 'ab')
+
+    # ==================== ЗАГРУЗКА ====================
+
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                payload = f.read()
+            try:
+                self.data = json.loads(payload) if payload.strip() else {}
+            except ValueError as e:
+                # Снимок пишется атомарно - молча начинать с пустого нельзя
+                raise ValueError(f'{self.snapshot_path}: повреждённый снимок ({e})') from e
+            self.snapshot_bytes = len(payload)
+            self.index = SortedKeys(self.data)
+            if self.max_bytes:
+                for key, value in self.data.items():
+                    self._account(key, value)
+        self._replay(self.frozen_path)
+        self.log_bytes = self._replay(self.log_path, truncate=True)
+
+    def _replay(self, path, truncate=False):
+        """Применить записи журнала; вернуть длину его целой части"""
+        good = 0
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    ops = decode_record(line)
+                    if ops is None:
+                        break
+                    self._apply(ops)
+                    self.replayed += 1
+                    good += len(line)
+                size = f.seek(0, os.SEEK_END)
+        except FileNotFoundError:
+            return 0
+        if truncate and good < size:
+            self.truncated_bytes += size - good
+            os.truncate(path, good)
+        return good
+
+    def _apply(self, ops):
+        now = self.clock()
+        for op in ops:
+            if op[0] == 'set':
+                expires_at = op[3] if len(op) > 3 else None
+                if expires_at is not None and expires_at <= now:
+                    self._remove(op[1])  # истёк ещё до проигрывания
+                    continue
+                if op[1] not in self.data:
+                    self.index.add(op[1])
+                self.data[op[1]] = op[2]
+                self._expire_at(op[1], expires_at)
+                if self.max_bytes:
+                    self._account(op[1], op[2])
+            elif op[0] == 'del':
+                self._remove(op[1])
+            elif op[0] == 'expire' and op[1] in self.data:
+                if op[2] <= now:
+                    self._remove(op[1])
+                else:
+                    self._expire_at(op[1], op[2])
+
+    def _remove(self, key):
+        if key in self.data:
+            del self.data[key]
+            self.index.discard(key)
+            self.expires.pop(key, None)
+            self.memory_bytes -= self._sizes.pop(key, 0)
+            self._usage.pop(key, None)
+
+    def _expire_at(self, key, expires_at):
+        if expires_at is None:
+            self.expires.pop(key, None)
+        elif self.expires.get(key) != expires_at:
+            self.expires[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+
+    def _account(self, key, value):
+        size = len(key) + len(json.dumps(value, ensure_ascii=False)) + ENTRY_OVERHEAD
+        self.memory_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._touch(key)
+
+    def _touch(self, key):
+        usage = self._usage.get(key)
+        if usage is None:
+            self._usage[key] = [next(self._ticks), 1]
+        else:
+            usage[0] = next(self._ticks)
+            usage[1] += 1
+
+    # ==================== ЗАПИСЬ ====================
+
+    def write(self, ops):
+        """Записать пачку операций в журнал и применить её к данным"""
+        self.write_many([ops])
+
+    def write_many(self, batches):
+        """Несколько пачек одним write и не более чем одним fsync;
+        каждая пачка остаётся отдельной (атомарной) записью журнала"""
+        payload = b''.join(encode_record(ops) for ops in batches)
+        with self._lock:
+            self._log.write(payload)
+            self._log.flush()
+            self.writes += len(batches)
+            self.log_bytes += len(payload)
+            self._unsynced += len(batches)
+            if self.fsync == 'always' or (self.fsync == 'batch' and self._unsynced >= self.batch_size):
+                self._sync()
+            for ops in batches:
+                self._apply(ops)
+            if self.max_bytes and self.memory_bytes > self.max_bytes:
+                self._evict()
+
+    def set_op(self, key, value, ttl=None):
+        """Операция set; ttl (секунды) превращается в абсолютное время истечения"""
+        if ttl is None:
+            return ['set', key, value]
+        return ['set', key, value, self.clock() + ttl]
+
+    def set(self, key, value, ttl=None):
+        self.write([self.set_op(key, value, ttl)])
+
+    def delete(self, key):
+        self.write([['del', key]])
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def _is_expired(self, key, now):
+        expires_at = self.expires.get(key)
+        return expires_at is not None and expires_at <= now
+
+    def _expire_lazily(self, key):
+        """True, если срок ключа истёк (тогда ключ удаляется сразу)"""
+        if not self._is_expired(key, self.clock()):
+            return False
+        with self._lock:
+            if key in self.data and self._is_expired(key, self.clock()):
+                self._remove(key)
+                self.expired += 1
+        return True
+
+    def get(self, key, default=None):
+        value = self.data.get(key, _MISSING)
+        if value is _MISSING or self._expire_lazily(key):
+            return default
+        if self.max_bytes:
+            self._touch(key)
+        return value
+
+    def contains(self, key):
+        return key in self.data and not self._expire_lazily(key)
+
+    def ttl(self, key):
+        """Сколько секунд осталось жить ключу (None - бессрочный)"""
+        expires_at = self.expires.get(key)
+        return None if expires_at is None else max(0.0, expires_at - self.clock())
+
+    def get_many(self, keys):
+        """Значения найденных ключей; пачка изменений не видна наполовину"""
+        now = self.clock()
+        with self._lock:
+            return {key: self.data[key] for key in keys
+                    if key in self.data and not self._is_expired(key, now)}
+
+    def scan(self, prefix='', after=None, end=None, limit=1000, values=False):
+        """Ключи по возрастанию: с префиксом prefix, строго после after
+        (курсор предыдущей страницы) и строго меньше end. Возвращает не
+        больше limit ключей (или пар ключ-значение) и флаг продолжения"""
+        if after is not None and after >= prefix:
+            keys = self.index.iter_from(after, inclusive=False)
+        else:
+            keys = self.index.iter_from(prefix)
+        page = []
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                if not key.startswith(prefix) or (end is not None and key >= end):
+                    return page, False
+                if self._is_expired(key, now):
+                    continue
+                if len(page) == limit:
+                    return page, True
+                page.append((key, self.data[key]) if values else key)
+        return page, False
+
+    # ==================== СРОК ЖИЗНИ И ВЫТЕСНЕНИЕ ====================
+
+    def reap(self, max_keys=256):
+        """Один шаг сборщика: удалить истёкшие ключи, держа блокировку не
+        дольше reap_budget секунд и не больше max_keys ключей. True - в
+        куче остались истёкшие ключи и нужен следующий шаг"""
+        now = self.clock()
+        deadline = time.monotonic() + self.reap_budget
+        with self._lock:
+            heap = self._heap
+            for _ in range(max_keys):
+                if not heap or heap[0][0] > now:
+                    break
+                expires_at, key = heapq.heappop(heap)
+                if self.expires.get(key) == expires_at:
+                    self._remove(key)
+                    self.expired += 1
+                if time.monotonic() >= deadline:
+                    break
+            if len(heap) > 2 * len(self.expires) + 1024:
+                # Устаревших пар (после перезаписи ключей) больше, чем живых
+                self._heap = [(expires_at, key) for key, expires_at in self.expires.items()]
+                heapq.heapify(self._heap)
+            return bool(self._heap) and self._heap[0][0] <= now
+
+    def _evict(self):
+        """Вытеснять ключи, пока занятая память больше max_bytes; удаления
+        пишутся в журнал, чтобы ключи не вернулись при проигрывании"""
+        if self.eviction == 'lru':
+            rank = lambda key: self._usage[key][0]
+        else:
+            rank = lambda key: (self._usage[key][1], self._usage[key][0])
+        victims = []
+        while self.memory_bytes > self.max_bytes and self.data:
+            candidates = {self.index.random_key(self._random) for _ in range(EVICTION_SAMPLES)}
+            victim = min(candidates, key=rank)
+            self._remove(victim)
+            victims.append(victim)
+        if not victims:
+            return
+        payload = encode_record([['del', key] for key in victims])
+        self._log.write(payload)
+        self._log.flush()
+        self.log_bytes += len(payload)
+        self._unsynced += 1
+        self.evictions += len(victims)
+
+    def _sync(self):
+        if self._unsynced:
+            os.fsync(self._log.fileno())
+            self.fsyncs += 1
+            self._unsynced = 0
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    # ==================== УПЛОТНЕНИЕ ====================
+
+    def _write_snapshot(self, snapshot):
+        payload = json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        write_atomic(self.snapshot_path, payload)
+        self.snapshot_bytes = len(payload)
+
+    def compact(self):
+        """Записать снимок и начать журнал заново; запись не блокируется
+        на время сериализации снимка"""
+        with self._compact_lock:
+            with self._lock:
+                self._sync()
+                self._log.close()
+                os.replace(self.log_path, self.frozen_path)
+                self._log = open(self.log_path, 'ab')
+                self.log_bytes = 0
+                if self.expires:
+                    # Снимок хранит только значения - сроки начинают новый журнал
+                    payload = encode_record([['expire', key, expires_at]
+                                             for key, expires_at in self.expires.items()])
+                    self._log.write(payload)
+                    self._log.flush()
+                    os.fsync(self._log.fileno())
+                    self.log_bytes = len(payload)
+                snapshot = dict(self.data)
+            self._write_snapshot(snapshot)
+            os.remove(self.frozen_path)
+            fsync_dir(self.log_path)
+            self.compactions += 1
+
+    def needs_compaction(self):
+        return self.log_bytes >= max(self.compact_min_bytes, self.snapshot_bytes * self.compact_ratio)
+
+    def _background(self):
+        while not self._stop.wait(self.interval):
+            if self.fsync == 'interval':
+                self.sync()
+            if self.needs_compaction():
+                try:
+                    self.compact()
+                except OSError as e:
+                    print(f"Ошибка уплотнения журнала: {e}")
+
+    def _reaper(self):
+        while not self._stop.wait(self.reap_interval):
+            while self.reap() and not self._stop.is_set():
+                time.sleep(0)  # между шагами блокировку получают запросы
+
+    def start(self):
+        """Фоновые потоки: fsync по интервалу и уплотнение журнала,
+        сборщик истёкших ключей"""
+        self._threads = [threading.Thread(target=self._background, daemon=True, name='kv-wal'),
+                         threading.Thread(target=self._reaper, daemon=True, name='kv-reaper')]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            self._sync()
+            self._log.close()
+
+    def stats(self):
+        return {
+            'keys': len(self.data),
+            'fsync': self.fsync,
+            'writes': self.writes,
+            'fsyncs': self.fsyncs,
+            'log_bytes': self.log_bytes,
+            'snapshot_bytes': self.snapshot_bytes,
+            'compactions': self.compactions,
+            'replayed': self.replayed,
+            'truncated_bytes': self.truncated_bytes,
+            'expiring_keys': len(self.expires),
+            'expired': self.expired,
+            'memory_bytes': self.memory_bytes,
+            'max_bytes': self.max_bytes,
+            'eviction': self.eviction,
+            'evictions': self.evictions,
+        }
+
+
+class GroupCommitter:
+    """Групповая фиксация: изменения из разных потоков пишет один поток.
+
+    Всё, что пришло за window секунд после первого изменения (и пока
+    писался предыдущий пакет), уходит в журнал одним write_many с одним
+    fsync, после чего все ожидающие запросы получают подтверждение.
+    window задаёт компромисс: больше - меньше fsync, но дольше ответ.
+    """
+
+    def __init__(self, store, window=0.002, max_batch=1024):
+        self.store = store
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.committed = 0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='kv-group-commit')
+        self._thread.start()
+
+    def submit(self, ops):
+        """Записать пачку операций; вернуть управление после фиксации"""
+        done = threading.Event()
+        waiter = [done, None]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Запись в закрытое хранилище')
+            self._queue.append((ops, waiter))
+            self._cond.notify()
+        done.wait()
+        if waiter[1] is not None:
+            raise waiter[1]
+
+    def set(self, key, value, ttl=None):
+        self.submit([self.store.set_op(key, value, ttl)])
+
+    def delete(self, key):
+        self.submit([['del', key]])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+            if self.window:
+                time.sleep(self.window)
+            with self._cond:
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+            error = None
+            try:
+                self.store.write_many([ops for ops, _ in batch])
+            except Exception as e:
+                error = e
+            self.batches += 1
+            self.committed += len(batch)
+            for _, waiter in batch:
+                waiter[1] = error
+                waiter[0].set()
+
+    def close(self):
+        """Дописать очередь и остановить поток"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'batches': self.batches,
+            'committed': self.committed,
+            'avg_batch': round(self.committed / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,252 @@
+# lb_admission.py - ограничение входящей нагрузки и автоматы защиты бэкендов
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+# Очередь допуска: сколько запросов одновременно проксируется, сколько ждёт
+ADMISSION_MAX_ACTIVE = int(os.environ.get('LB_MAX_ACTIVE', 256))      # 0 - без ограничения
+ADMISSION_MAX_QUEUE = int(os.environ.get('LB_MAX_QUEUE', 1024))
+ADMISSION_MAX_WAIT = float(os.environ.get('LB_MAX_WAIT', 2.0))
+
+# Приоритеты (заголовок LB_PRIORITY_HEADER): какую долю очереди может занять
+# запрос - при росте очереди первыми отбрасываются низкоприоритетные
+PRIORITY_HEADER = os.environ.get('LB_PRIORITY_HEADER', 'X-Priority')
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+PRIORITY_QUEUE_SHARE = {'high': 1.0, 'normal': 0.75, 'low': 0.25}
+
+# Предел запросов в работе на один бэкенд (0 - без ограничения)
+BACKEND_MAX_IN_FLIGHT = int(os.environ.get('LB_BACKEND_MAX_IN_FLIGHT', 0))
+
+# Автомат защиты (circuit breaker)
+BREAKER_WINDOW = int(os.environ.get('LB_BREAKER_WINDOW', 20))
+BREAKER_MIN_REQUESTS = int(os.environ.get('LB_BREAKER_MIN_REQUESTS', 10))
+BREAKER_ERROR_RATE = float(os.environ.get('LB_BREAKER_ERROR_RATE', 0.5))
+BREAKER_OPEN_SECONDS = float(os.environ.get('LB_BREAKER_OPEN_SECONDS', 10))
+BREAKER_HALF_OPEN_REQUESTS = int(os.environ.get('LB_BREAKER_HALF_OPEN_REQUESTS', 3))
+# Пробный слот, по которому так и не пришёл результат, освобождается через столько секунд
+BREAKER_TRIAL_TIMEOUT = float(os.environ.get('LB_BREAKER_TRIAL_TIMEOUT', 30))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+
+class Overloaded(Exception):
+    """Запрос не допущен: reason - 'shed' (очередь полна) или 'queue_timeout'"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def parse_priority(value):
+    value = (value or '').strip().lower()
+    return value if value in PRIORITIES else 'normal'
+
+
+class AdmissionController:
+    """Не более max_active запросов в работе, остальные ждут в очереди.
+
+    Освободившийся слот получает ожидающий с наивысшим приоритетом (при
+    равных - пришедший раньше). Запрос, которому не хватило места в своей
+    доле очереди, отбрасывается сразу; ждавший дольше max_wait - тоже.
+    """
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, max_queue=ADMISSION_MAX_QUEUE,
+                 max_wait=ADMISSION_MAX_WAIT):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.parked = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    def acquire(self, priority='normal'):
+        """Занять слот или выбросить Overloaded"""
+        with self._lock:
+            if not self.max_active or (self.active < self.max_active and not self._waiters):
+                self.active += 1
+                self.admitted += 1
+                return
+            if len(self._waiters) + self.parked >= self.max_queue * PRIORITY_QUEUE_SHARE[priority]:
+                self.shed += 1
+                raise Overloaded('shed')
+            waiter = [PRIORITIES[priority], next(self._seq), threading.Event(), False]
+            heapq.heappush(self._waiters, waiter)
+            self.queued += 1
+
+        waiter[2].wait(self.max_wait)
+        with self._lock:
+            if waiter[3]:  # слот передан, даже если ожидание только что истекло
+                self.admitted += 1
+                return
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            self.timeouts += 1
+        raise Overloaded('queue_timeout')
+
+    def wait_for(self, event, priority='normal'):
+        """Ждать event без слота (склеенный запрос ждёт ведущего).
+
+        Ожидающий занимает место в доле очереди своего приоритета и ждёт
+        не дольше max_wait; без ограничения допуска по истечении срока
+        возвращается False, иначе - Overloaded.
+        """
+        with self._lock:
+            queued = len(self._waiters) + self.parked
+            if self.max_active and queued >= self.max_queue * PRIORITY_QUEUE_SHARE[priority]:
+                self.shed += 1
+                raise Overloaded('shed')
+            self.parked += 1
+        try:
+            done = event.wait(self.max_wait)
+        finally:
+            with self._lock:
+                self.parked -= 1
+        if not done and self.max_active:
+            with self._lock:
+                self.timeouts += 1
+            raise Overloaded('queue_timeout')
+        return done
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = heapq.heappop(self._waiters)
+                waiter[3] = True
+                waiter[2].set()
+            else:
+                self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'queued_now': len(self._waiters),
+                'parked_now': self.parked,
+                'max_active': self.max_active,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'queue_timeouts': self.timeouts,
+            }
+
+
+class CircuitBreaker:
+    """closed -> open при доле ошибок в окне не ниже error_rate;
+    open -> half_open через open_seconds; в half_open пропускается не более
+    half_open_requests пробных запросов: столько же успехов подряд
+    закрывают автомат, любая ошибка снова открывает. Пробный слот, для
+    которого record так и не был вызван (запрос оборвался исключением),
+    освобождается через trial_timeout секунд."""
+
+    def __init__(self, window=BREAKER_WINDOW, min_requests=BREAKER_MIN_REQUESTS,
+                 error_rate=BREAKER_ERROR_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_requests=BREAKER_HALF_OPEN_REQUESTS, trial_timeout=BREAKER_TRIAL_TIMEOUT):
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.half_open_requests = half_open_requests
+        self.trial_timeout = trial_timeout
+        self.state = CLOSED
+        self.results = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.trials = deque()       # когда заняты пробные слоты
+        self.successes = 0
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.results.clear()
+        self.opens += 1
+
+    def current_state(self, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self.trials.clear()
+                self.successes = 0
+            return self.state
+
+    def try_acquire(self, now=None):
+        """Можно ли отправить запрос (в half_open занимает пробный слот)"""
+        now = now or time.monotonic()
+        state = self.current_state(now)
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        with self._lock:
+            while self.trials and now - self.trials[0] >= self.trial_timeout:
+                self.trials.popleft()  # результат так и не пришёл
+            if self.state != HALF_OPEN or len(self.trials) >= self.half_open_requests:
+                return False
+            self.trials.append(now)
+            return True
+
+    def record(self, failed, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if self.trials:
+                    self.trials.popleft()
+                if failed:
+                    self._open(now)
+                else:
+                    self.successes += 1
+                    if self.successes >= self.half_open_requests:
+                        self.state = CLOSED
+                        self.results.clear()
+                return
+            if self.state == OPEN:
+                return
+            self.results.append(1 if failed else 0)
+            if (failed and len(self.results) >= self.min_requests
+                    and sum(self.results) / len(self.results) >= self.error_rate):
+                self._open(now)
+
+    def to_dict(self):
+        state = self.current_state()
+        with self._lock:
+            return {
+                'state': state,
+                'recent_errors': sum(self.results),
+                'recent_requests': len(self.results),
+                'opens': self.opens,
+            }
+
+
+class BreakerRegistry:
+    """CircuitBreaker по URL бэкенда"""
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(url, CircuitBreaker(**self.options))
+        return breaker
+
+    def discard(self, url):
+        with self._lock:
+            self._breakers.pop(url, None)
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {url: breaker.to_dict() for url, breaker in breakers}
@@ -0,0 +1,243 @@
+# lb_cache.py - кеш GET-ответов бэкендов внутри балансировщика
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+CACHE_MAX_BYTES = int(os.environ.get('LB_CACHE_BYTES', 32 * 1024 * 1024))   # 0 - кеш выключен
+CACHE_MAX_ENTRY_BYTES = int(os.environ.get('LB_CACHE_MAX_ENTRY_BYTES', 1024 * 1024))
+CACHE_MAX_TTL = float(os.environ.get('LB_CACHE_MAX_TTL', 3600))
+CACHE_STALE_WHILE_REVALIDATE = float(os.environ.get('LB_CACHE_SWR', 0))  # если бэкенд не указал
+# Сколько секунд ключ с некешируемым ответом идёт на бэкенд без склейки промахов
+CACHE_PASS_TTL = float(os.environ.get('LB_CACHE_PASS_TTL', 10))
+
+# Коды ответов, которые можно кешировать по явному разрешению (RFC 9111)
+CACHEABLE_STATUSES = frozenset([200, 203, 300, 301, 404, 410])
+
+# Счётчики обращений к кешу (ResponseCache.record)
+COUNTERS = {'hit': 'hits', 'stale': 'stale_hits', 'miss': 'misses', 'coalesced': 'coalesced',
+            'not_modified': 'not_modified', 'revalidation': 'revalidations', 'pass': 'passes'}
+
+# Заголовки, которые кеш выставляет сам
+SKIP_STORED_HEADERS = frozenset(['content-length', 'age', 'date', 'x-cache'])
+
+
+def parse_cache_control(value):
+    """Cache-Control: max-age=60, public -> {'max-age': '60', 'public': None}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def etag_matches(if_none_match, etag):
+    """Совпадает ли ETag с заголовком If-None-Match клиента"""
+    if not if_none_match or not etag:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+def request_bypasses(headers):
+    """Запрос просит не отвечать из кеша или содержит учётные данные"""
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    return ('no-cache' in directives or 'no-store' in directives
+            or 'no-cache' in headers.get('Pragma', '').lower()
+            or 'Authorization' in headers)
+
+
+def freshness(status, headers, max_ttl=CACHE_MAX_TTL, default_swr=CACHE_STALE_WHILE_REVALIDATE):
+    """(ttl, stale_while_revalidate) в секундах или None, если ответ не кешируется.
+
+    Кешируются только ответы с явным сроком свежести: s-maxage, max-age
+    или Expires. no-store, no-cache, private, Set-Cookie и Vary по
+    заголовкам, кроме Accept-Encoding, кеш пропускает мимо.
+    """
+    if status not in CACHEABLE_STATUSES or 'Set-Cookie' in headers:
+        return None
+    # Ключ кеша различает только Accept-Encoding
+    vary = {name.strip().lower() for name in headers.get('Vary', '').split(',') if name.strip()}
+    if vary - {'accept-encoding'}:
+        return None
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if {'no-store', 'no-cache', 'private'} & directives.keys():
+        return None
+    ttl = _seconds(directives.get('s-maxage'))
+    if ttl is None:
+        ttl = _seconds(directives.get('max-age'))
+    if ttl is None and headers.get('Expires'):
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+        except (TypeError, ValueError):
+            return None
+        ttl = max(0.0, expires - time.time())
+    if not ttl:
+        return None
+    swr = _seconds(directives.get('stale-while-revalidate'))
+    return min(ttl, max_ttl), default_swr if swr is None else swr
+
+
+class CacheEntry:
+    def __init__(self, status, headers, body, ttl, swr, now=None):
+        self.status = status
+        self.headers = [(key, value) for key, value in headers
+                        if key.lower() not in SKIP_STORED_HEADERS]
+        self.body = body
+        self.etag = next((value for key, value in self.headers if key.lower() == 'etag'), None)
+        self.size = len(body) + sum(len(key) + len(value) for key, value in self.headers)
+        self.refresh(ttl, swr, now)
+
+    def refresh(self, ttl, swr, now=None):
+        self.stored_at = now or time.monotonic()
+        self.expires_at = self.stored_at + ttl
+        self.stale_until = self.expires_at + swr
+
+    def is_fresh(self, now):
+        return now < self.expires_at
+
+    def can_serve_stale(self, now):
+        return now < self.stale_until
+
+    def age(self, now):
+        return int(now - self.stored_at)
+
+
+class ResponseCache:
+    """LRU по суммарному размеру ответов со сроками свежести.
+
+    Одновременные промахи по одному ключу склеиваются: на бэкенд идёт
+    только первый (begin_fetch вернул True), остальные ждут его результата.
+    Просроченная запись в окне stale-while-revalidate отдаётся сразу,
+    а обновляется в фоне одним запросом. Ключ, ответ на который оказался
+    некешируемым, на pass_ttl секунд помечается как pass: такие запросы
+    идут на бэкенд сразу, не выстраиваясь в очередь за первым.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entry_bytes=CACHE_MAX_ENTRY_BYTES,
+                 pass_ttl=CACHE_PASS_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.pass_ttl = pass_ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._pass = {}             # ключ -> до какого момента идти мимо кеша
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.passes = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key, now=None):
+        """Запись для ключа (возможно, просроченная) или None"""
+        now = now or time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not entry.can_serve_stale(now) and entry.etag is None:
+                self._remove(key)  # без ETag перепроверить нечем
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            self._pass.pop(key, None)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return key in self._entries
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def mark_pass(self, key, now=None):
+        """Запомнить, что ответ по ключу не кешируется (hit-for-pass)"""
+        if not self.pass_ttl:
+            return
+        now = now or time.monotonic()
+        with self._lock:
+            self._pass[key] = now + self.pass_ttl
+            if len(self._pass) > len(self._entries) + 1024:
+                self._pass = {k: until for k, until in self._pass.items() if until > now}
+
+    def is_pass(self, key, now=None):
+        until = self._pass.get(key)
+        return until is not None and (now or time.monotonic()) < until
+
+    def begin_fetch(self, key):
+        """(True, событие) для первого промаха по ключу, (False, событие) для остальных"""
+        with self._lock:
+            event = self._inflight.get(key)
+            if event is not None:
+                return False, event
+            event = self._inflight[key] = threading.Event()
+            return True, event
+
+    def end_fetch(self, key):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def record(self, kind, entry=None):
+        """Учесть обращение: hit, stale, miss, coalesced, not_modified, revalidation"""
+        with self._lock:
+            name = COUNTERS[kind]
+            setattr(self, name, getattr(self, name) + 1)
+            if entry is not None and kind in ('hit', 'stale', 'not_modified'):
+                self.bytes_saved += len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pass.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            served = self.hits + self.stale_hits
+            lookups = served + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'revalidations': self.revalidations,
+                'not_modified': self.not_modified,
+                'passes': self.passes,
+                'evictions': self.evictions,
+                'hit_ratio': round(served / lookups, 4) if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+            }
@@ -0,0 +1,172 @@
+# lb_health.py - активные и пассивные проверки здоровья бэкендов
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+HEALTH_INTERVAL = float(os.environ.get('LB_HEALTH_INTERVAL', 5))
+HEALTH_JITTER = float(os.environ.get('LB_HEALTH_JITTER', 0.2))
+HEALTH_RISE = int(os.environ.get('LB_HEALTH_RISE', 2))
+HEALTH_FALL = int(os.environ.get('LB_HEALTH_FALL', 3))
+
+# Пассивная проверка: окно последних ответов и пороги исключения
+OUTLIER_WINDOW = int(os.environ.get('LB_OUTLIER_WINDOW', 20))
+OUTLIER_MIN_REQUESTS = int(os.environ.get('LB_OUTLIER_MIN_REQUESTS', 10))
+OUTLIER_ERROR_RATE = float(os.environ.get('LB_OUTLIER_ERROR_RATE', 0.5))
+OUTLIER_CONSECUTIVE = int(os.environ.get('LB_OUTLIER_CONSECUTIVE', 5))
+EJECT_BASE = float(os.environ.get('LB_EJECT_BASE', 5))
+EJECT_MAX = float(os.environ.get('LB_EJECT_MAX', 300))
+
+
+def set_flag(server, active):
+    server['active'] = active
+
+
+class ServerHealth:
+    def __init__(self):
+        self.successes = 0          # подряд удачных проверок
+        self.failures = 0           # подряд неудачных проверок
+        self.results = deque(maxlen=OUTLIER_WINDOW)
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def to_dict(self, now):
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'recent_errors': sum(self.results),
+            'recent_requests': len(self.results),
+            'ejections': self.ejections,
+            'ejected_for': round(max(0.0, self.ejected_until - now), 1),
+        }
+
+
+class HealthChecker:
+    """Состояние здоровья серверов пула.
+
+    Активные проверки: сервер выключается после fall неудач подряд и
+    включается после rise успехов подряд. Пассивные: ошибки проксирования
+    и ответы 5xx, замеченные балансировщиком, исключают сервер на время,
+    которое удваивается при каждом повторном исключении (до EJECT_MAX).
+    """
+
+    def __init__(self, get_servers, probe, interval=HEALTH_INTERVAL, jitter=HEALTH_JITTER,
+                 rise=HEALTH_RISE, fall=HEALTH_FALL, max_workers=32, log=None, set_active=set_flag):
+        self.get_servers = get_servers
+        self.probe = probe
+        self.set_active = set_active
+        self.interval = interval
+        self.jitter = jitter
+        self.rise = rise
+        self.fall = fall
+        self.log = log
+        self._states = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='health')
+        self._stop = threading.Event()
+
+    def _state(self, url):
+        state = self._states.get(url)
+        if state is None:
+            state = self._states.setdefault(url, ServerHealth())
+        return state
+
+    def _set_active(self, server, active, reason):
+        """True, если состояние сервера действительно сменилось"""
+        if server['active'] == active or self.set_active(server, active) is False:
+            return False
+        if self.log:
+            self.log('health_change', backend=server['url'], active=active, reason=reason)
+        return True
+
+    def apply_probe(self, server, healthy, now=None):
+        """Учесть результат активной проверки"""
+        now = now or time.monotonic()
+        with self._lock:
+            state = self._state(server['url'])
+            if healthy:
+                state.successes += 1
+                state.failures = 0
+            else:
+                state.failures += 1
+                state.successes = 0
+            ejected = state.ejected_until > now
+            if not healthy and state.failures >= self.fall:
+                self._set_active(server, False, f"{state.failures} неудачных проверок подряд")
+            elif healthy and not ejected and not server['active'] and state.successes >= self.rise:
+                state.results.clear()
+                state.consecutive_errors = 0
+                self._set_active(server, True, f"{state.successes} удачных проверок подряд")
+
+    def record(self, server, error, now=None):
+        """Учесть ответ проксирования (пассивная проверка)"""
+        now = now or time.monotonic()
+        with self._lock:
+            state = self._state(server['url'])
+            state.results.append(1 if error else 0)
+            state.consecutive_errors = state.consecutive_errors + 1 if error else 0
+            if not error:
+                if len(state.results) == state.results.maxlen and not any(state.results):
+                    state.ejections = 0  # долго без ошибок - сбрасываем backoff
+                return
+            errors = sum(state.results)
+            too_many = (state.consecutive_errors >= OUTLIER_CONSECUTIVE
+                        or (len(state.results) >= OUTLIER_MIN_REQUESTS
+                            and errors / len(state.results) >= OUTLIER_ERROR_RATE))
+            if not too_many:
+                return
+            # server мог быть взят из старого снимка: уже исключённый сервер
+            # registry не меняет, и backoff не растёт повторно
+            duration = min(EJECT_MAX, EJECT_BASE * 2 ** state.ejections)
+            if self._set_active(server, False, f"исключён на {duration:.0f} с по ошибкам ответов"):
+                state.ejections += 1
+                state.ejected_until = now + duration
+                state.successes = 0
+                state.results.clear()
+                state.consecutive_errors = 0
+
+    def check_all(self):
+        """Проверить все серверы параллельно: время прохода ~ один таймаут"""
+        servers = list(self.get_servers())
+        results = list(self._executor.map(self.probe, servers))
+        now = time.monotonic()
+        # Пока шли пробы, часть серверов могла быть удалена из пула
+        current = {server['url'] for server in self.get_servers()}
+        for server, healthy in zip(servers, results):
+            if server['url'] in current:
+                self.apply_probe(server, healthy, now)
+        servers = list(self.get_servers())
+        return sum(1 for server in servers if server['active']), len(servers)
+
+    def next_delay(self):
+        """Интервал со случайным разбросом, чтобы проверки не шли синхронно"""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run_forever(self):
+        last_summary = None
+        while not self._stop.is_set():
+            summary = self.check_all()
+            if summary != last_summary and self.log:
+                self.log('health_summary', active=summary[0], total=summary[1])
+                last_summary = summary
+            self._stop.wait(self.next_delay())
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, daemon=True, name='health-check')
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def discard(self, url):
+        with self._lock:
+            self._states.pop(url, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {url: state.to_dict(now) for url, state in self._states.items()}
@@ -0,0 +1,173 @@
+# lb_metrics.py - метрики в формате Prometheus и структурированный журнал
+import json
+import logging
+import os
+import random
+import threading
+
+LOG_LEVEL = os.environ.get('LB_LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE = float(os.environ.get('LB_LOG_SAMPLE', 0.01))   # доля событий каждого запроса
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect  # значения считаются при каждом снятии метрик
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def forget(self, label, value):
+        """Убрать все серии с данным значением метки"""
+        if label not in self.labelnames:
+            return
+        index = self.labelnames.index(label)
+        with self._lock:
+            for labels in [labels for labels in self._values if labels[index] == value]:
+                del self._values[labels]
+
+    def render(self):
+        if self.collect is not None:
+            values = {tuple(labels): value for labels, value in self.collect()}
+            with self._lock:
+                self._values = values
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                                for labels, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, (list(state[0]), state[1], state[2]))
+                           for labels, state in self._values.items())
+        lines = self.header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = format_labels(self.labelnames, labels, [('le', format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            suffix = format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{suffix} {format_value(total)}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), collect=None):
+        return self.register(Counter(name, documentation, labelnames, collect))
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def forget(self, label, value):
+        for metric in self.metrics:
+            metric.forget(label, value)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class EventLog:
+    """Журнал событий через logging: одна строка JSON на событие.
+
+    События каждого запроса (sampled) пишутся только на уровне DEBUG и
+    лишь с вероятностью sample, поэтому в обычном режиме горячий путь
+    ограничивается проверкой isEnabledFor.
+    """
+
+    def __init__(self, name, level=LOG_LEVEL, sample=LOG_SAMPLE):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.sample = sample
+
+    def _emit(self, level, event, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, json.dumps({'event': event, **fields}, ensure_ascii=False))
+
+    def debug(self, event, **fields):
+        self._emit(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._emit(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._emit(logging.WARNING, event, fields)
+
+    def sampled(self, event, **fields):
+        if self.sample and self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.sample:
+            self._emit(logging.DEBUG, event, fields)
@@ -0,0 +1,127 @@
+# lb_registry.py - пул серверов балансировщика, безопасный для потоков
+import itertools
+import threading
+
+
+class AtomicCounter:
+    """Счётчик без блокировки: next() у itertools.count атомарен в CPython"""
+
+    def __init__(self, start=0):
+        self._count = itertools.count(start)
+        self.value = start
+
+    def next(self):
+        value = next(self._count)
+        self.value = value + 1  # только для отображения, гонка безвредна
+        return value
+
+    def reset(self, start=0):
+        self._count = itertools.count(start)
+        self.value = start
+
+
+class ServerRegistry:
+    """Список серверов с копированием при записи.
+
+    Читатели (выбор сервера на каждом запросе) берут текущий снимок -
+    неизменяемый кортеж - одним чтением атрибута, без блокировки.
+    Добавление, удаление и смена активности собирают новый снимок под
+    блокировкой писателей и публикуют его одним присваиванием, поэтому
+    читатель никогда не видит пул в промежуточном состоянии. Словари
+    серверов в опубликованном снимке не меняются - сервер с новым
+    состоянием публикуется копией, поэтому сверять серверы нужно по URL.
+    """
+
+    def __init__(self, servers=()):
+        self._lock = threading.Lock()
+        self._publish(tuple(servers))
+
+    def _publish(self, servers):
+        # Один кортеж на оба списка: читатель видит их согласованными
+        self._snapshot = (servers, tuple(server for server in servers if server['active']))
+
+    def snapshot(self):
+        return self._snapshot[0]
+
+    def active(self):
+        return self._snapshot[1]
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self.snapshot())
+
+    def __getitem__(self, index):
+        return self.snapshot()[index]
+
+    def find(self, url):
+        for server in self.snapshot():
+            if server['url'] == url:
+                return server
+        return None
+
+    def add(self, server):
+        """Добавить сервер; None, если такой URL уже есть в пуле"""
+        with self._lock:
+            servers = self.snapshot()
+            if any(existing['url'] == server['url'] for existing in servers):
+                return None
+            self._publish(servers + (server,))
+        return server
+
+    def remove(self, index):
+        """Удалить сервер по индексу; None, если индекса уже нет"""
+        with self._lock:
+            servers = self.snapshot()
+            if not 0 <= index < len(servers):
+                return None
+            removed = servers[index]
+            self._publish(servers[:index] + servers[index + 1:])
+        return removed
+
+    def replace(self, servers):
+        with self._lock:
+            self._publish(tuple(servers))
+
+    def merge(self, records):
+        """Привести пул к списку records (url, weight, active) за одну
+        публикацию; вернуть удалённые серверы.
+
+        У уже известных URL сохраняется своя активность (её ведут
+        проверки здоровья), новые берут её из записи. Чтение и публикация
+        под одной блокировкой: параллельные set_active и add не теряются.
+        """
+        with self._lock:
+            current = {server['url']: server for server in self.snapshot()}
+            merged = []
+            for record in records:
+                server = current.get(record['url'])
+                weight = record.get('weight', 1)
+                if server is None:
+                    server = {"url": record['url'], "weight": weight, "active": record.get('active', True)}
+                elif server.get('weight', 1) != weight:
+                    server = {**server, 'weight': weight}
+                merged.append(server)
+            self._publish(tuple(merged))
+        kept = {server['url'] for server in merged}
+        return [server for url, server in current.items() if url not in kept]
+
+    def set_active(self, server, active):
+        """Сменить активность сервера с тем же URL; False, если его уже нет
+        в пуле или менять нечего.
+
+        Публикуется копия словаря сервера: читатели старого снимка видят
+        его прежним, согласованным с его же списком активных.
+        """
+        with self._lock:
+            servers = self.snapshot()
+            for index, existing in enumerate(servers):
+                if existing['url'] == server['url']:
+                    break
+            else:
+                return False
+            if existing['active'] == active:
+                return False
+            self._publish(servers[:index] + ({**existing, 'active': active},) + servers[index + 1:])
+        return True
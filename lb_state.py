@@ -0,0 +1,116 @@
+# lb_state.py - пул серверов на диске, общий для балансировщиков одного хоста
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки
+    fcntl = None
+
+POOL_FILE = os.environ.get('LB_POOL_FILE', '')      # пусто - не сохранять
+POOL_SYNC_INTERVAL = float(os.environ.get('LB_POOL_SYNC_INTERVAL', 1.0))
+
+
+def pool_record(server):
+    return {'url': server['url'], 'weight': server.get('weight', 1), 'active': server['active']}
+
+
+class PoolStore:
+    """Снимок пула в JSON-файле.
+
+    Файл заменяется атомарно (временный файл + fsync + os.replace), так что
+    читатель видит либо старый, либо новый снимок целиком. Изменения
+    делаются чтением-изменением-записью под flock, поэтому несколько
+    балансировщиков на одном хосте могут править пул одновременно; номер
+    версии в файле позволяет каждому заметить чужие изменения (poll).
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock_path = self.path + '.lock'
+        self.version = 0
+        self._stat = None
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not isinstance(state, dict) or not isinstance(state.get('servers'), list):
+            raise ValueError(f'{self.path}: неверный формат снимка пула')
+        return state
+
+    def _write(self, state):
+        directory = os.path.dirname(self.path)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(directory, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self.version = state['version']
+
+    def load(self, default_servers):
+        """Серверы из файла; если файла ещё нет - записать default_servers"""
+        with self._locked():
+            state = self._read()
+            if state is None:
+                state = {'version': 1, 'updated_at': time.time(),
+                         'servers': [pool_record(server) for server in default_servers]}
+                self._write(state)
+            self.version = state['version']
+            return state['servers']
+
+    def update(self, mutate):
+        """Применить mutate(servers) -> servers к последнему снимку на диске"""
+        with self._locked():
+            state = self._read() or {'version': 0, 'servers': []}
+            self._write({'version': state['version'] + 1, 'updated_at': time.time(),
+                         'servers': mutate(state['servers'])})
+
+    def add(self, server):
+        record = pool_record(server)
+        self.update(lambda servers: servers if any(s['url'] == record['url'] for s in servers)
+                    else servers + [record])
+
+    def remove(self, url):
+        self.update(lambda servers: [s for s in servers if s['url'] != url])
+
+    def set_active(self, url, active):
+        self.update(lambda servers: [{**s, 'active': active} if s['url'] == url else s for s in servers])
+
+    def poll(self):
+        """Серверы, если снимок изменил другой процесс, иначе None"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key == self._stat:
+            return None
+        state = self._read()
+        self._stat = key
+        if state is None or state['version'] == self.version:
+            return None
+        self.version = state['version']
+        return state['servers']
@@ -0,0 +1,214 @@
+# lb_strategies.py - стратегии выбора бэкенда для балансировщика
+import bisect
+import hashlib
+import random
+import threading
+import time
+
+from lb_registry import AtomicCounter
+
+EWMA_DECAY = 0.3          # вес нового замера в скользящей средней задержки
+HASH_REPLICAS = 100       # виртуальных узлов на единицу веса в кольце хешей
+
+
+class BackendStats:
+    """Счётчики одного бэкенда: запросы в работе, ошибки, EWMA задержки"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.ewma_latency = 0.0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        return time.perf_counter()
+
+    def observe(self, started):
+        """Задержка до получения заголовков ответа"""
+        latency = time.perf_counter() - started
+        with self._lock:
+            if self.ewma_latency == 0.0:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += EWMA_DECAY * (latency - self.ewma_latency)
+        return latency
+
+    def end(self, error=False):
+        with self._lock:
+            self.in_flight -= 1
+            if error:
+                self.errors += 1
+
+    def to_dict(self):
+        return {
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'ewma_latency_ms': round(self.ewma_latency * 1000, 2),
+        }
+
+
+class StatsRegistry:
+    """BackendStats по URL бэкенда"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        stats = self._stats.get(url)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(url, BackendStats())
+        return stats
+
+    def discard(self, url):
+        with self._lock:
+            self._stats.pop(url, None)
+
+    def snapshot(self):
+        with self._lock:
+            return {url: stats.to_dict() for url, stats in self._stats.items()}
+
+
+class Strategy:
+    """Базовый класс: select() получает только активные серверы"""
+
+    name = ''
+    title = ''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def select(self, servers, key=None):
+        raise NotImplementedError
+
+
+class RoundRobin(Strategy):
+    name = 'round_robin'
+    title = 'Round-robin'
+
+    def __init__(self, stats):
+        super().__init__(stats)
+        self.counter = AtomicCounter()
+
+    @property
+    def index(self):
+        return self.counter.value
+
+    @index.setter
+    def index(self, value):
+        self.counter.reset(value)
+
+    def select(self, servers, key=None):
+        return servers[self.counter.next() % len(servers)]
+
+
+class SmoothWeightedRoundRobin(Strategy):
+    """Плавный взвешенный round-robin (как в nginx): при весах 5,1,1
+    порядок a a b a c a a, а не a a a a a b c"""
+
+    name = 'weighted'
+    title = 'Взвешенный round-robin'
+
+    def __init__(self, stats):
+        super().__init__(stats)
+        self.current = {}
+        self._lock = threading.Lock()
+
+    def select(self, servers, key=None):
+        with self._lock:
+            total = 0
+            best = None
+            for server in servers:
+                weight = max(1, int(server.get('weight', 1)))
+                total += weight
+                current = self.current.get(server['url'], 0) + weight
+                self.current[server['url']] = current
+                if best is None or current > self.current[best['url']]:
+                    best = server
+            self.current[best['url']] -= total
+            if len(self.current) > len(servers) * 2:
+                urls = {server['url'] for server in servers}
+                self.current = {url: value for url, value in self.current.items() if url in urls}
+        return best
+
+
+class LeastOutstanding(Strategy):
+    """Меньше всего запросов в работе с учётом веса"""
+
+    name = 'least_connections'
+    title = 'Наименьшее число запросов в работе'
+
+    def select(self, servers, key=None):
+        offset = random.randrange(len(servers))
+        rotated = servers[offset:] + servers[:offset]
+        return min(rotated, key=lambda server: (self.stats.get(server['url']).in_flight + 1)
+                   / max(1, int(server.get('weight', 1))))
+
+
+class PowerOfTwoEwma(Strategy):
+    """Два случайных кандидата, выигрывает меньшая EWMA-задержка x нагрузка"""
+
+    name = 'p2c_ewma'
+    title = 'P2C по EWMA-задержке'
+
+    def score(self, server):
+        stats = self.stats.get(server['url'])
+        return (stats.ewma_latency or 1e-3) * (stats.in_flight + 1) / max(1, int(server.get('weight', 1)))
+
+    def select(self, servers, key=None):
+        if len(servers) == 1:
+            return servers[0]
+        first, second = random.sample(servers, 2)
+        return first if self.score(first) <= self.score(second) else second
+
+
+class ConsistentHash(Strategy):
+    """Кольцо хешей: один и тот же ключ сессии попадает на тот же сервер,
+    а при изменении пула переезжает лишь малая часть ключей"""
+
+    name = 'consistent_hash'
+    title = 'Консистентное хеширование (привязка сессии)'
+
+    def __init__(self, stats):
+        super().__init__(stats)
+        self._ring_key = None
+        self._ring = ([], [])
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def _build(self, servers):
+        points = []
+        for server in servers:
+            for replica in range(HASH_REPLICAS * max(1, int(server.get('weight', 1)))):
+                points.append((self._hash(f"{server['url']}#{replica}"), server['url']))
+        points.sort()
+        return [point for point, _ in points], [url for _, url in points]
+
+    def select(self, servers, key=None):
+        if key is None:
+            return random.choice(servers)
+        ring_key = tuple((server['url'], server.get('weight', 1)) for server in servers)
+        with self._lock:
+            if ring_key != self._ring_key:
+                self._ring = self._build(servers)
+                self._ring_key = ring_key
+            hashes, urls = self._ring
+        index = bisect.bisect(hashes, self._hash(key)) % len(hashes)
+        url = urls[index]
+        for server in servers:
+            if server['url'] == url:
+                return server
+        return servers[0]
+
+
+STRATEGIES = {cls.name: cls for cls in
+              (RoundRobin, SmoothWeightedRoundRobin, LeastOutstanding, PowerOfTwoEwma, ConsistentHash)}
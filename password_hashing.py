@@ -0,0 +1,95 @@
+# password_hashing.py - вынос хеширования паролей в пул процессов
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """Очередь хеширования заполнена или ответ не пришёл вовремя"""
+
+
+class PasswordHasher:
+    """Ограниченный пул процессов для PBKDF2/scrypt.
+
+    Дорогие вызовы не занимают потоки запросов и GIL: потоки лишь ждут
+    результат. Число задач в очереди ограничено max_pending (включая
+    задачи, ответа которых уже не дождались) - при переполнении сразу
+    выбрасывается HashingBusy (ответ 503), а не копится очередь.
+    workers=0 - хеширование в текущем потоке.
+    """
+
+    def __init__(self, method='scrypt', workers=None, max_pending=64, timeout=10.0):
+        self.method = method
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        # Канонический префикс хеша для текущих параметров (метод и стоимость)
+        self.hash_prefix = generate_password_hash('', method).split('$', 1)[0]
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy('Очередь хеширования переполнена')
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Слот занят, пока задача не завершится: после таймаута ожидания она
+        # продолжает выполняться в процессе и по-прежнему занимает очередь
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()  # ещё не начатая задача снимается сразу
+            raise HashingBusy('Превышено время ожидания хеширования')
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Хеш создан со старыми параметрами и должен быть пересчитан"""
+        return pwhash.split('$', 1)[0] != self.hash_prefix
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.hash_prefix,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,380 @@
+# test_app7.py - тесты key-value хранилища (lab7/app7.py)
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Хранилище открывается при импорте app7, поэтому подменяем путь заранее
+_tmpdir = tempfile.mkdtemp()
+os.environ['KV_DATA_FILE'] = os.path.join(_tmpdir, 'data.json')
+os.environ['KV_BACKGROUND'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lab7'))
+
+import app7
+import kv_index
+import kv_wal
+
+app7.limiter.enabled = False
+
+
+class StoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=_tmpdir)
+        self.path = os.path.join(self.dir, 'data.json')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            if not store._log.closed:
+                store.close()
+
+    def open_store(self, **options):
+        store = kv_wal.LogStore(self.path, **options)
+        self.stores.append(store)
+        return store
+
+
+class TestWriteAheadLog(StoreTestCase):
+
+    def test_replay_after_restart(self):
+        store = self.open_store()
+        store.set('a', 1)
+        store.set('b', {'nested': [1, 2]})
+        store.delete('a')
+        store.close()
+        reopened = self.open_store()
+        self.assertEqual(reopened.data, {'b': {'nested': [1, 2]}})
+        self.assertEqual(reopened.replayed, 3)
+        self.assertFalse(os.path.exists(self.path))  # снимка ещё не было
+
+    def test_write_cost_independent_of_store_size(self):
+        store = self.open_store()
+        for i in range(1000):
+            store.set(f'key{i}', 'x' * 100)
+        before = store.log_bytes
+        store.set('one-more', 'x' * 100)
+        self.assertLess(store.log_bytes - before, 200)
+
+    def test_torn_tail_discarded(self):
+        store = self.open_store()
+        store.set('a', 1)
+        store.set('b', 2)
+        store.close()
+        with open(store.log_path, 'ab') as f:
+            f.write(kv_wal.encode_record([['set', 'c', 3]])[:-5])  # оборванная запись
+        reopened = self.open_store()
+        self.assertEqual(reopened.data, {'a': 1, 'b': 2})
+        self.assertGreater(reopened.truncated_bytes, 0)
+        reopened.set('d', 4)
+        reopened.close()
+        self.assertEqual(self.open_store().data, {'a': 1, 'b': 2, 'd': 4})
+
+    def test_compaction(self):
+        store = self.open_store()
+        for i in range(50):
+            store.set('counter', i)
+        store.set('other', 'value')
+        store.compact()
+        self.assertEqual(store.log_bytes, 0)
+        self.assertEqual(os.path.getsize(store.log_path), 0)
+        store.set('after', True)
+        store.close()
+        reopened = self.open_store()
+        self.assertEqual(reopened.data, {'counter': 49, 'other': 'value', 'after': True})
+        self.assertEqual(reopened.replayed, 1)
+
+    def test_interrupted_compaction_recovered(self):
+        store = self.open_store()
+        store.set('a', 1)
+        store.compact()
+        store.set('b', 2)
+        store.close()
+        # Сбой после переименования журнала, но до записи снимка
+        os.replace(store.log_path, store.frozen_path)
+        with open(store.log_path, 'wb') as f:
+            f.write(kv_wal.encode_record([['set', 'c', 3]]))
+        reopened = self.open_store()
+        self.assertEqual(reopened.data, {'a': 1, 'b': 2, 'c': 3})
+        self.assertFalse(os.path.exists(store.frozen_path))
+        reopened.close()
+        self.assertEqual(self.open_store().data, {'a': 1, 'b': 2, 'c': 3})
+
+    def test_corrupted_snapshot_not_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{"a": ')
+        with self.assertRaises(ValueError):
+            kv_wal.LogStore(self.path)
+
+    def test_fsync_policies(self):
+        always = self.open_store(fsync='always')
+        for i in range(10):
+            always.set(i, i)
+        self.assertEqual(always.fsyncs, 10)
+        always.close()
+        os.remove(always.log_path)
+
+        batch = self.open_store(fsync='batch', batch_size=4)
+        for i in range(10):
+            batch.set(i, i)
+        self.assertEqual(batch.fsyncs, 2)
+        batch.sync()
+        self.assertEqual(batch.fsyncs, 3)
+        with self.assertRaises(ValueError):
+            kv_wal.LogStore(self.path, fsync='never')
+
+    def test_background_compaction(self):
+        store = self.open_store(interval=0.01, compact_min_bytes=1000)
+        store.start()
+        for i in range(100):
+            store.set(f'key{i}', i)
+        for _ in range(200):
+            if store.compactions:
+                break
+            store._stop.wait(0.01)
+        self.assertGreaterEqual(store.compactions, 1)
+        store.close()
+        self.assertEqual(len(self.open_store().data), 100)
+
+
+class TestGroupCommit(StoreTestCase):
+
+    def run_writers(self, writer, threads=8, per_thread=50):
+        def work(n):
+            for i in range(per_thread):
+                writer.set(f'w{n}-{i}', i)
+
+        workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def test_one_fsync_per_batch(self):
+        store = self.open_store(fsync='always')
+        committer = kv_wal.GroupCommitter(store, window=0.005)
+        self.run_writers(committer)
+        committer.close()
+        self.assertEqual(store.writes, 400)
+        self.assertEqual(store.fsyncs, committer.batches)
+        self.assertLess(committer.batches, 400)
+        store.close()
+        self.assertEqual(len(self.open_store().data), 400)
+
+    def test_acknowledged_writes_visible(self):
+        store = self.open_store(fsync='always')
+        committer = kv_wal.GroupCommitter(store, window=0)
+        committer.set('a', 1)
+        self.assertEqual(store.data['a'], 1)
+        self.assertEqual(store.fsyncs, 1)
+        committer.close()
+
+    def test_write_errors_reported_to_every_waiter(self):
+        store = self.open_store()
+        committer = kv_wal.GroupCommitter(store, window=0)
+        store._log.close()  # запись в журнал начнёт падать
+        with self.assertRaises(ValueError):
+            committer.set('a', 1)
+        self.assertNotIn('a', store.data)
+        committer.close()
+        with self.assertRaises(RuntimeError):
+            committer.set('b', 2)
+
+
+class TestSortedIndex(StoreTestCase):
+
+    def test_matches_sorted_set(self):
+        rng = random.Random(7)
+        index = kv_index.SortedKeys(load=4)
+        expected = set()
+        for _ in range(3000):
+            key = f'k{rng.randrange(500):03d}'
+            if rng.random() < 0.6:
+                self.assertEqual(index.add(key), key not in expected)
+                expected.add(key)
+            else:
+                self.assertEqual(index.discard(key), key in expected)
+                expected.discard(key)
+        self.assertEqual(list(index.iter_from()), sorted(expected))
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(list(index.iter_from('k250', inclusive=False)),
+                         sorted(key for key in expected if key > 'k250'))
+
+    def test_scan_pages_and_prefix(self):
+        store = self.open_store()
+        store.write([['set', f'user:{i:03d}', i] for i in range(25)] + [['set', 'item:1', 1], ['set', 'z', 0]])
+        store.delete('user:010')
+
+        keys, after = [], None
+        while True:
+            page, more = store.scan('user:', after, limit=10)
+            keys.extend(page)
+            if not more:
+                break
+            after = page[-1]
+        self.assertEqual(keys, sorted(f'user:{i:03d}' for i in range(25) if i != 10))
+        self.assertEqual(store.scan('user:', 'user:005', 'user:008')[0], ['user:006', 'user:007'])
+        self.assertEqual(store.scan(limit=2, values=True), ([('item:1', 1), ('user:000', 0)], True))
+
+        store.close()
+        self.assertEqual(self.open_store().scan('item')[0], ['item:1'])  # индекс после перезапуска
+
+
+class TestExpiryAndEviction(StoreTestCase):
+
+    def open_store(self, **options):
+        return super().open_store(clock=lambda: self.now, **options)
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+
+    def test_lazy_expiry(self):
+        store = self.open_store()
+        store.set('session', 'abc', ttl=10)
+        store.set('forever', 1)
+        self.assertEqual(store.get('session'), 'abc')
+        self.assertEqual(store.ttl('session'), 10)
+        self.now += 11
+        self.assertFalse(store.contains('session'))
+        self.assertIsNone(store.get('session'))
+        self.assertNotIn('session', store.data)
+        self.assertEqual(store.expired, 1)
+        self.assertEqual(store.scan()[0], ['forever'])
+
+    def test_expiry_survives_restart_and_compaction(self):
+        store = self.open_store()
+        store.set('short', 1, ttl=10)
+        store.set('long', 2, ttl=100)
+        store.set('renewed', 3, ttl=10)
+        store.set('renewed', 3)  # перезапись без ttl снимает срок
+        store.compact()
+        store.close()
+        self.now += 50
+        reopened = self.open_store()
+        self.assertEqual(reopened.data, {'long': 2, 'renewed': 3})
+        self.assertEqual(reopened.ttl('long'), 50)
+        self.assertIsNone(reopened.ttl('renewed'))
+
+    def test_reaper_works_in_bounded_steps(self):
+        store = self.open_store(reap_budget=1.0)
+        store.write([store.set_op(f'k{i}', i, ttl=1) for i in range(1000)] + [['set', 'keep', 0]])
+        self.now += 2
+        steps = 1
+        while store.reap(max_keys=100):
+            steps += 1
+        self.assertEqual(steps, 10)
+        self.assertEqual(store.data, {'keep': 0})
+        self.assertEqual(store.expired, 1000)
+        self.assertFalse(store.reap())
+
+    def test_lru_eviction(self):
+        store = self.open_store(max_bytes=20 * 120)
+        for i in range(20):
+            store.set(f'key{i:02d}', 'x')
+        store.get('key00')
+        for i in range(20, 30):
+            store.set(f'key{i:02d}', 'x')
+        self.assertLessEqual(store.memory_bytes, store.max_bytes)
+        self.assertGreater(store.evictions, 0)
+        self.assertIn('key00', store.data)
+        self.assertIn('key29', store.data)
+        store.close()
+        self.assertEqual(set(self.open_store().data), set(store.data))  # вытеснение в журнале
+
+    def test_lfu_eviction(self):
+        store = self.open_store(max_bytes=10 * 120, eviction='lfu')
+        store.set('hot', 'x')
+        for _ in range(5):
+            store.get('hot')
+        for i in range(40):
+            store.set(f'cold{i:02d}', 'x')
+        self.assertIn('hot', store.data)
+        self.assertLessEqual(store.memory_bytes, store.max_bytes)
+        with self.assertRaises(ValueError):
+            kv_wal.LogStore(self.path, eviction='fifo')
+
+
+class TestKeyValueApi(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app7.app.test_client()
+
+    def test_set_get_delete_persisted(self):
+        response = self.client.post('/set', json={'key': 'api-key', 'value': [1, 2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/get/api-key').get_json()['value'], [1, 2])
+        self.client.post('/set', json={'key': 7, 'value': 'number key'})
+        self.assertEqual(self.client.get('/get/7').get_json()['value'], 'number key')
+        self.assertEqual(self.client.delete('/delete/api-key').status_code, 200)
+        self.assertEqual(self.client.get('/get/api-key').status_code, 404)
+
+        app7.store.sync()
+        reopened = kv_wal.LogStore(app7.DATA_FILE)
+        try:
+            self.assertEqual(reopened.data, app7.data)
+        finally:
+            reopened.close()
+
+    def test_batch_operations(self):
+        items = {f'batch-{i}': i for i in range(3000)}
+        writes = app7.store.writes
+        response = self.client.post('/mset', json={'items': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['stored'], 3000)
+        self.assertEqual(len(response.get_json()['created']), 3000)
+        self.assertEqual(app7.store.writes - writes, 1)  # одна запись журнала
+
+        body = self.client.post('/mget', json={'keys': ['batch-1', 'batch-2999', 'nope', 5]}).get_json()
+        self.assertEqual(body['values'], {'batch-1': 1, 'batch-2999': 2999})
+        self.assertEqual(body['missing'], ['nope', '5'])
+
+        body = self.client.post('/mdelete', json={'keys': list(items) + ['nope']}).get_json()
+        self.assertEqual(len(body['deleted']), 3000)
+        self.assertEqual(body['missing'], ['nope'])
+        self.assertEqual(app7.store.writes - writes, 2)
+        self.assertNotIn('batch-1', app7.data)
+
+    def test_batch_validation(self):
+        self.assertEqual(self.client.post('/mset', json={'items': []}).status_code, 400)
+        self.assertEqual(self.client.post('/mget', json={'keys': 'a'}).status_code, 400)
+        self.assertEqual(self.client.post('/mdelete', json={'keys': [{'a': 1}]}).status_code, 400)
+        with mock.patch.object(app7, 'KV_BATCH_MAX_KEYS', 2):
+            self.assertEqual(self.client.post('/mget', json={'keys': [1, 2, 3]}).status_code, 413)
+
+    def test_keys_pagination_and_dump(self):
+        self.client.post('/mset', json={'items': {f'page-{i:02d}': i for i in range(12)}})
+        body = self.client.get('/keys?prefix=page-&limit=5').get_json()
+        self.assertEqual(body['keys'], [f'page-{i:02d}' for i in range(5)])
+        self.assertEqual(body['next'], 'page-04')
+        body = self.client.get('/keys?prefix=page-&limit=5&after=page-09').get_json()
+        self.assertEqual(body['keys'], ['page-10', 'page-11'])
+        self.assertIsNone(body['next'])
+        self.assertEqual(self.client.get('/keys?limit=0').status_code, 400)
+
+        with mock.patch.object(app7, 'KV_KEYS_PAGE_SIZE', 5):
+            response = self.client.get('/dump?prefix=page-')
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(lines, [{'key': f'page-{i:02d}', 'value': i} for i in range(12)])
+
+    def test_set_with_ttl(self):
+        response = self.client.post('/set', json={'key': 'ttl-key', 'value': 1, 'ttl': 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(self.client.get('/get/ttl-key').get_json()['ttl'], 30, delta=1)
+        self.assertEqual(self.client.post('/set', json={'key': 'k', 'ttl': -1}).status_code, 400)
+        self.assertEqual(self.client.post('/set', json={'key': 'k', 'ttl': '5'}).status_code, 400)
+
+        self.client.post('/mset', json={'items': {'ttl-a': 1, 'ttl-b': 2}, 'ttl': 0.05})
+        self.assertTrue(self.client.get('/exists/ttl-a').get_json()['exists'])
+        threading.Event().wait(0.1)
+        self.assertFalse(self.client.get('/exists/ttl-a').get_json()['exists'])
+        self.assertEqual(self.client.get('/get/ttl-b').status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
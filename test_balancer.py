@@ -0,0 +1,859 @@
+# test_balancer.py - тесты балансировщика (balancer.py)
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from unittest import mock
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+os.environ['LB_HEALTH_CHECK'] = '0'
+os.environ['LB_POOL_SYNC'] = '0'
+POOL_DIR = tempfile.mkdtemp()
+os.environ['LB_POOL_FILE'] = os.path.join(POOL_DIR, 'lb_pool.json')
+
+import balancer
+import lb_admission
+import lb_cache
+import lb_health
+import lb_registry
+import lb_state
+import lb_strategies
+
+try:
+    import aiohttp
+    from aiohttp.test_utils import TestClient, TestServer
+    import async_balancer
+except ImportError:  # aiohttp - необязательная зависимость
+    aiohttp = None
+
+
+# Сколько раз бэкенды отдали кешируемые ответы
+backend_hits = Counter()
+
+
+def make_backend(name):
+    """Тестовый бэкенд по образцу lab7/serv.py"""
+    backend = Flask(name)
+
+    @backend.route('/health')
+    def health():
+        return jsonify({"status": "healthy", "instance_id": name})
+
+    @backend.route('/process', methods=['GET', 'POST'])
+    def process():
+        if request.args.get('delay'):
+            time.sleep(float(request.args['delay']))
+        return jsonify({"instance_id": name, "method": request.method})
+
+    @backend.route('/echo', methods=['GET', 'POST', 'PUT'])
+    def echo():
+        return request.get_data(), 200, {'X-Instance': name}
+
+    @backend.route('/chunks')
+    def chunks():
+        def generate():
+            for i in range(100):
+                yield f'{i:04d}'.encode() * 256
+        return generate(), 200, {'Connection': 'X-Private', 'X-Private': 'secret',
+                                 'Keep-Alive': 'timeout=5'}
+
+    @backend.route('/cached/<item>')
+    def cached(item):
+        backend_hits[item] += 1
+        if request.args.get('delay'):
+            time.sleep(float(request.args['delay']))
+        etag = f'"{item}-v1"'
+        headers = {'Cache-Control': 'max-age=60, stale-while-revalidate=30', 'ETag': etag}
+        if request.headers.get('If-None-Match') == etag:
+            return '', 304, headers
+        return jsonify({"item": item, "instance_id": name}), 200, headers
+
+    @backend.route('/status/<int:code>')
+    def status(code):
+        return jsonify({"instance_id": name}), code
+
+    return backend
+
+
+def start_backend(name):
+    server = make_server('127.0.0.1', 0, make_backend(name), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class BalancerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = []
+        cls.urls = []
+        for name in ('backend_a', 'backend_b'):
+            server, url = start_backend(name)
+            cls.servers.append(server)
+            cls.urls.append(url)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+
+    def setUp(self):
+        balancer.server_pool.replace({"url": url, "weight": 1, "active": True} for url in self.urls)
+        balancer.set_strategy('round_robin')
+        balancer.strategies['round_robin'].index = 0
+        for url in self.urls:
+            balancer.health_checker.discard(url)
+            balancer.breakers.discard(url)
+        balancer.response_cache.clear()
+        # Тестовый клиент не закрывает ответы сам, а слот допуска
+        # освобождается при закрытии - у каждого теста своя очередь
+        admission = mock.patch.object(balancer, 'admission', lb_admission.AdmissionController())
+        admission.start()
+        self.addCleanup(admission.stop)
+        self.client = balancer.app.test_client()
+
+
+class TestProxy(BalancerTestCase):
+
+    def test_round_robin(self):
+        seen = [self.client.get('/process').get_json()['instance_id'] for _ in range(4)]
+        self.assertEqual(seen, ['backend_a', 'backend_b', 'backend_a', 'backend_b'])
+
+    def test_connections_reused(self):
+        for _ in range(20):
+            self.client.post('/echo', data=b'payload')
+        stats = self.client.get('/health').get_json()['connection_pool']
+        for url in self.urls:
+            backend = stats['backends'][url]
+            self.assertLessEqual(backend['connections_opened'], 2)
+        self.assertGreater(stats['reuse_rate'], 0.8)
+
+    def test_dead_backend_returns_502(self):
+        balancer.server_pool.replace([{"url": "http://127.0.0.1:9", "weight": 1, "active": True}])
+        response = self.client.get('/process')
+        self.assertEqual(response.status_code, 502)
+
+
+class TestStrategies(BalancerTestCase):
+
+    def fake_servers(self, *weights):
+        return [{"url": f"http://backend-{i}", "weight": weight, "active": True}
+                for i, weight in enumerate(weights)]
+
+    def test_smooth_weighted_round_robin(self):
+        strategy = lb_strategies.SmoothWeightedRoundRobin(lb_strategies.StatsRegistry())
+        servers = self.fake_servers(5, 1, 1)
+        order = [strategy.select(servers)['url'][-1] for _ in range(7)]
+        self.assertEqual(order, ['0', '0', '1', '0', '2', '0', '0'])
+
+    def test_least_outstanding(self):
+        stats = lb_strategies.StatsRegistry()
+        strategy = lb_strategies.LeastOutstanding(stats)
+        servers = self.fake_servers(1, 1)
+        stats.get(servers[0]['url']).begin()
+        self.assertEqual(strategy.select(servers)['url'], servers[1]['url'])
+
+    def test_p2c_prefers_fast_backend(self):
+        stats = lb_strategies.StatsRegistry()
+        strategy = lb_strategies.PowerOfTwoEwma(stats)
+        servers = self.fake_servers(1, 1)
+        stats.get(servers[0]['url']).ewma_latency = 0.5
+        stats.get(servers[1]['url']).ewma_latency = 0.01
+        self.assertEqual(strategy.select(servers)['url'], servers[1]['url'])
+
+    def test_consistent_hash_affinity(self):
+        strategy = lb_strategies.ConsistentHash(lb_strategies.StatsRegistry())
+        servers = self.fake_servers(1, 1, 1, 1)
+        keys = [f'user-{i}' for i in range(200)]
+        before = {key: strategy.select(servers, key)['url'] for key in keys}
+        self.assertEqual(before, {key: strategy.select(servers, key)['url'] for key in keys})
+
+        after = {key: strategy.select(servers[:3], key)['url'] for key in keys}
+        moved = [key for key in keys if before[key] != after[key]]
+        self.assertTrue(all(before[key] == servers[3]['url'] for key in moved))
+
+    def test_switch_strategy_from_admin(self):
+        response = self.client.post('/set_strategy', data={'strategy': 'consistent_hash'})
+        self.assertEqual(response.status_code, 302)
+        seen = {self.client.get('/process', headers={'X-Session-Id': 'abc'}).get_json()['instance_id']
+                for _ in range(6)}
+        self.assertEqual(len(seen), 1)
+        page = self.client.get('/').get_data(as_text=True)
+        self.assertIn('value="consistent_hash" selected', page)
+
+        response = self.client.post('/set_strategy', data={'strategy': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestServerRegistry(BalancerTestCase):
+
+    def test_round_robin_even_under_threads(self):
+        balancer.server_pool.replace({"url": f"http://backend{i}", "weight": 1, "active": True}
+                                     for i in range(4))
+        counts = {}
+        lock = threading.Lock()
+
+        def worker():
+            local = {}
+            for _ in range(2000):
+                url = balancer.get_next_server()['url']
+                local[url] = local.get(url, 0) + 1
+            with lock:
+                for url, count in local.items():
+                    counts[url] = counts.get(url, 0) + count
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(counts.values()), {4000})
+
+    def test_selection_while_pool_changes(self):
+        stable = [{"url": f"http://stable{i}", "weight": 1, "active": True} for i in range(2)]
+        balancer.server_pool.replace(stable)
+        stop = threading.Event()
+        errors = []
+        selected = set()
+
+        def select():
+            try:
+                while not stop.is_set():
+                    server = balancer.get_next_server()
+                    if server is None:
+                        errors.append('пул оказался пуст')
+                    else:
+                        selected.add(server['url'])
+            except Exception as e:  # IndexError и т.п. - именно то, что ловим
+                errors.append(repr(e))
+
+        def mutate():
+            for i in range(300):
+                url = f"http://temp{i % 5}"
+                balancer.add_server(url, True)
+                server = balancer.server_pool.find(url)
+                balancer.server_pool.set_active(server, False)
+                balancer.server_pool.set_active(server, True)
+                index = next(n for n, s in enumerate(balancer.server_pool) if s['url'] == url)
+                balancer.remove_server(index)
+
+        readers = [threading.Thread(target=select) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        with mock.patch.object(balancer, 'pool_store', None):
+            mutate()
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual([server['url'] for server in balancer.server_pool], [s['url'] for s in stable])
+        self.assertTrue({s['url'] for s in stable} <= selected)
+
+    def test_registry_rejects_duplicates_and_stale_updates(self):
+        registry = lb_registry.ServerRegistry()
+        server = registry.add({"url": "http://a", "active": True})
+        self.assertIsNone(registry.add({"url": "http://a", "active": True}))
+        self.assertEqual(registry.remove(0), server)
+        self.assertIsNone(registry.remove(0))
+        self.assertFalse(registry.set_active(server, False))
+        self.assertEqual(registry.active(), ())
+
+    def test_merge_keeps_concurrent_changes(self):
+        registry = lb_registry.ServerRegistry([{"url": f"http://s{i}", "weight": 1, "active": True}
+                                               for i in range(50)])
+        records = [{"url": f"http://s{i}", "weight": 2, "active": True} for i in range(50)]
+        stop = threading.Event()
+
+        def flip():
+            while not stop.is_set():
+                for server in registry.snapshot():
+                    registry.set_active(server, False)
+
+        thread = threading.Thread(target=flip)
+        thread.start()
+        try:
+            for _ in range(200):
+                registry.merge(records)
+        finally:
+            stop.set()
+            thread.join()
+        registry.merge(records)
+        # Ни одно выключение не затёрто слиянием
+        self.assertEqual(registry.active(), ())
+        self.assertEqual({server['weight'] for server in registry}, {2})
+        removed = registry.merge(records[1:] + [{"url": "http://new", "active": False}])
+        self.assertEqual([server['url'] for server in removed], ['http://s0'])
+        self.assertFalse(registry.find('http://new')['active'])
+
+    def test_set_active_copies_on_write(self):
+        registry = lb_registry.ServerRegistry([{"url": "http://a", "active": True}])
+        old_servers, old_active = registry.snapshot(), registry.active()
+        self.assertTrue(registry.set_active(old_servers[0], False))
+        self.assertFalse(registry.set_active(old_servers[0], False))  # менять нечего
+        # Старый снимок не тронут и согласован со своим списком активных
+        self.assertTrue(old_servers[0]['active'])
+        self.assertEqual(old_active, old_servers)
+        self.assertFalse(registry.find('http://a')['active'])
+        self.assertEqual(registry.active(), ())
+
+
+class TestHealthChecker(unittest.TestCase):
+
+    def setUp(self):
+        self.server = {"url": "http://backend", "weight": 1, "active": True}
+        self.checker = lb_health.HealthChecker(lambda: [self.server], None, rise=2, fall=3, log=None)
+
+    def test_rise_and_fall_thresholds(self):
+        for healthy in (False, False, True, False, False):
+            self.checker.apply_probe(self.server, healthy)
+        self.assertTrue(self.server['active'])
+        self.checker.apply_probe(self.server, False)
+        self.assertFalse(self.server['active'])
+        self.checker.apply_probe(self.server, True)
+        self.assertFalse(self.server['active'])
+        self.checker.apply_probe(self.server, True)
+        self.assertTrue(self.server['active'])
+
+    def test_passive_ejection_with_backoff(self):
+        durations = []
+        now = 1000.0
+        for _ in range(3):
+            for _ in range(lb_health.OUTLIER_CONSECUTIVE):
+                self.checker.record(self.server, error=True, now=now)
+            self.assertFalse(self.server['active'])
+            durations.append(self.checker._states[self.server['url']].ejected_until - now)
+            # Во время исключения удачные пробы сервер не возвращают
+            self.checker.apply_probe(self.server, True, now=now)
+            self.checker.apply_probe(self.server, True, now=now)
+            self.assertFalse(self.server['active'])
+            now += durations[-1] + 1
+            self.checker.apply_probe(self.server, True, now=now)
+            self.checker.apply_probe(self.server, True, now=now)
+            self.assertTrue(self.server['active'])
+        self.assertEqual(durations, [lb_health.EJECT_BASE * 2 ** i for i in range(3)])
+
+    def test_probes_run_concurrently(self):
+        servers = [{"url": f"http://backend{i}", "active": True} for i in range(10)]
+        barrier = threading.Barrier(len(servers), timeout=5)
+
+        def probe(server):
+            barrier.wait()  # пройдёт, только если все пробы идут одновременно
+            return True
+
+        checker = lb_health.HealthChecker(lambda: servers, probe, log=None)
+        self.assertEqual(checker.check_all(), (10, 10))
+
+    def test_jittered_interval(self):
+        delays = {self.checker.next_delay() for _ in range(20)}
+        self.assertGreater(len(delays), 1)
+        for delay in delays:
+            self.assertLessEqual(abs(delay - self.checker.interval),
+                                 self.checker.interval * self.checker.jitter)
+
+
+class TestPassiveHealth(BalancerTestCase):
+
+    def test_dead_backend_ejected(self):
+        dead = {"url": "http://127.0.0.1:9", "weight": 1, "active": True}
+        balancer.server_pool.add(dead)
+        try:
+            for _ in range(lb_health.OUTLIER_CONSECUTIVE * len(balancer.server_pool)):
+                self.client.get('/process')
+            self.assertFalse(balancer.server_pool.find(dead['url'])['active'])
+            seen = {self.client.get('/process').status_code for _ in range(4)}
+            self.assertEqual(seen, {200})
+            health = self.client.get('/health').get_json()['health']
+            self.assertEqual(health[dead['url']]['ejections'], 1)
+        finally:
+            balancer.health_checker.discard(dead['url'])
+
+
+class TestResponseCache(BalancerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        balancer.response_cache = lb_cache.ResponseCache()
+
+    def test_hit_after_miss(self):
+        first = self.client.get('/cached/a')
+        second = self.client.get('/cached/a')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(backend_hits['a'], 1)
+        stats = self.client.get('/health').get_json()['cache']
+        self.assertEqual(stats['hit_ratio'], 0.5)
+        self.assertEqual(stats['bytes_saved'], len(second.get_data()))
+
+    def test_uncacheable_and_bypass(self):
+        self.client.get('/process')
+        self.assertEqual(self.client.get('/process').headers.get('X-Cache'), None)
+        self.client.get('/cached/b')
+        response = self.client.get('/cached/b', headers={'Cache-Control': 'no-cache'})
+        self.assertNotIn('X-Cache', response.headers)
+        self.assertEqual(backend_hits['b'], 2)
+
+    def test_client_etag_gets_304(self):
+        self.client.get('/cached/c')
+        response = self.client.get('/cached/c', headers={'If-None-Match': '"c-v1"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(backend_hits['c'], 1)
+
+    def test_concurrent_misses_coalesced(self):
+        results = []
+
+        def fetch():
+            results.append(balancer.app.test_client().get('/cached/d?delay=0.3').status_code)
+
+        threads = [threading.Thread(target=fetch) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [200] * 10)
+        self.assertEqual(backend_hits['d'], 1)
+        self.assertEqual(balancer.response_cache.stats()['coalesced'], 9)
+
+    def test_coalesced_wait_bounded_by_admission(self):
+        controller = lb_admission.AdmissionController(max_active=8, max_queue=4, max_wait=0.1)
+        results = []
+
+        def fetch():
+            results.append(balancer.app.test_client().get('/cached/slow?delay=0.5').status_code)
+
+        with mock.patch.object(balancer, 'admission', controller):
+            leader = threading.Thread(target=fetch)
+            leader.start()
+            time.sleep(0.1)
+            started = time.monotonic()
+            follower = balancer.app.test_client().get('/cached/slow?delay=0.5')
+            waited = time.monotonic() - started
+            leader.join()
+        self.assertEqual(follower.status_code, 503)
+        self.assertLess(waited, 0.4)
+        self.assertEqual(results, [200])
+        self.assertEqual(controller.stats()['queue_timeouts'], 1)
+        self.assertEqual(controller.stats()['parked_now'], 0)
+
+    def test_uncacheable_key_not_coalesced(self):
+        self.client.get('/process?delay=0.2')
+        results = []
+
+        def fetch():
+            results.append(balancer.app.test_client().get('/process?delay=0.2').status_code)
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [200] * 5)
+        stats = balancer.response_cache.stats()
+        self.assertEqual(stats['coalesced'], 0)
+        self.assertEqual(stats['passes'], 5)
+        # Кешируемый ответ снимает пометку pass
+        balancer.response_cache.mark_pass('/cached/g?|')
+        self.client.get('/cached/g')
+        self.assertEqual(self.client.get('/cached/g').headers['X-Cache'], 'HIT')
+
+    def test_foreign_validator_does_not_refresh_entry(self):
+        self.client.get('/cached/h')
+        entry = balancer.response_cache.get('/cached/h?|')
+        entry.etag = '"h-v0"'  # в кеше более старая версия
+        entry.refresh(0, 0, now=time.monotonic() - 1)
+        response = self.client.get('/cached/h', headers={'If-None-Match': '"h-v1"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Cache', response.headers)
+        self.assertFalse(entry.is_fresh(time.monotonic()))
+        self.assertEqual(balancer.response_cache.stats()['not_modified'], 0)
+
+    def test_stale_while_revalidate(self):
+        self.client.get('/cached/e')
+        entry = balancer.response_cache.get('/cached/e?|')
+        entry.refresh(0, 30, now=time.monotonic() - 1)
+        response = self.client.get('/cached/e')
+        self.assertEqual(response.headers['X-Cache'], 'STALE')
+        for _ in range(50):
+            if entry.is_fresh(time.monotonic()):
+                break
+            time.sleep(0.01)
+        # Фоновая перепроверка по ETag: бэкенд ответил 304, срок продлён
+        self.assertTrue(entry.is_fresh(time.monotonic()))
+        self.assertEqual(backend_hits['e'], 2)
+        self.assertEqual(balancer.response_cache.stats()['not_modified'], 1)
+
+    def test_lru_bounded_by_bytes(self):
+        cache = lb_cache.ResponseCache(max_bytes=1000, max_entry_bytes=600)
+        for key in 'abc':
+            cache.put(key, lb_cache.CacheEntry(200, [], b'x' * 400, 60, 0))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.stats()['bytes'], 1000)
+        self.assertFalse(cache.put('big', lb_cache.CacheEntry(200, [], b'x' * 700, 60, 0)))
+
+    def test_freshness_rules(self):
+        self.assertEqual(lb_cache.freshness(200, {'Cache-Control': 'public, max-age=10'}), (10.0, 0.0))
+        self.assertEqual(lb_cache.freshness(200, {'Cache-Control': 'max-age=10, s-maxage=5'})[0], 5.0)
+        for headers in ({}, {'Cache-Control': 'no-store, max-age=10'},
+                        {'Cache-Control': 'private, max-age=10'},
+                        {'Cache-Control': 'max-age=10', 'Vary': 'Cookie'}):
+            self.assertIsNone(lb_cache.freshness(200, headers))
+        self.assertIsNone(lb_cache.freshness(500, {'Cache-Control': 'max-age=10'}))
+
+
+class TestMetrics(BalancerTestCase):
+
+    def metric(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_metrics_endpoint(self):
+        before = self.client.get('/metrics').get_data(as_text=True)
+        url = self.urls[0]
+        selected = f'lb_selections_total{{backend="{url}",strategy="round_robin"}}'
+        latency = f'lb_upstream_latency_seconds_count{{backend="{url}"}}'
+        for _ in range(4):
+            self.client.get('/process')
+        response = self.client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertEqual(self.metric(text, selected) - self.metric(before, selected), 2)
+        self.assertEqual(self.metric(text, latency) - self.metric(before, latency), 2)
+        self.assertIn(f'lb_upstream_latency_seconds_bucket{{backend="{url}",le="+Inf"}}', text)
+        self.assertIn(f'lb_backend_up{{backend="{url}"}} 1', text)
+        self.assertIn('# TYPE lb_upstream_latency_seconds histogram', text)
+
+    def test_error_types_counted(self):
+        bad_gateway = balancer.errors.value('bad_gateway')
+        no_backend = balancer.errors.value('no_backend')
+        balancer.server_pool.replace([{"url": "http://127.0.0.1:9", "weight": 1, "active": True}])
+        self.assertEqual(self.client.get('/process').status_code, 502)
+        balancer.server_pool.replace([])
+        with mock.patch.object(balancer.admission, 'max_wait', 0.05):
+            self.assertEqual(self.client.get('/process').status_code, 503)
+        self.assertEqual(balancer.errors.value('bad_gateway'), bad_gateway + 1)
+        self.assertEqual(balancer.errors.value('no_backend'), no_backend + 1)
+
+    def test_per_request_logging_sampled(self):
+        events = balancer.events
+        with self.assertLogs('balancer', 'DEBUG') as logs:
+            events.logger.setLevel('DEBUG')
+            try:
+                with mock.patch.object(events, 'sample', 1.0):
+                    self.client.get('/process')
+                with mock.patch.object(events, 'sample', 0.0):
+                    self.client.get('/process')
+            finally:
+                events.logger.setLevel('INFO')
+            events.info('marker')
+        selected = [line for line in logs.output if '"selected"' in line]
+        self.assertEqual(len(selected), 1)
+        self.assertIn(self.urls[0], selected[0])
+
+
+class TestAdmissionControl(unittest.TestCase):
+
+    def queue_up(self, controller, priority, results):
+        def run():
+            try:
+                controller.acquire(priority)
+                results.append(priority)
+            except lb_admission.Overloaded as e:
+                results.append(e.reason)
+        thread = threading.Thread(target=run)
+        thread.start()
+        for _ in range(100):
+            if controller.stats()['queued'] + controller.shed > len(results) - 1:
+                break
+            time.sleep(0.005)
+        return thread
+
+    def test_priority_order_and_shedding(self):
+        controller = lb_admission.AdmissionController(max_active=1, max_queue=4, max_wait=5)
+        controller.acquire()
+        results = []
+        threads = [self.queue_up(controller, 'low', results),
+                   self.queue_up(controller, 'normal', results),
+                   self.queue_up(controller, 'high', results)]
+        # Доля low - четверть очереди (одно место), оно уже занято
+        threads.append(self.queue_up(controller, 'low', results))
+        threads[-1].join()
+        self.assertEqual(results, ['shed'])
+        for _ in range(3):
+            controller.release()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['shed', 'high', 'normal', 'low'])
+        self.assertEqual(controller.stats()['active'], 1)
+
+    def test_queue_deadline(self):
+        controller = lb_admission.AdmissionController(max_active=1, max_queue=4, max_wait=0.05)
+        controller.acquire()
+        with self.assertRaises(lb_admission.Overloaded) as caught:
+            controller.acquire()
+        self.assertEqual(caught.exception.reason, 'queue_timeout')
+        controller.release()
+        controller.acquire()
+        self.assertEqual(controller.stats()['queued_now'], 0)
+
+    def test_parked_waiters_count_against_queue(self):
+        controller = lb_admission.AdmissionController(max_active=1, max_queue=1, max_wait=5)
+        event = threading.Event()
+        thread = threading.Thread(target=controller.wait_for, args=(event, 'high'))
+        thread.start()
+        time.sleep(0.05)
+        controller.acquire()
+        with self.assertRaises(lb_admission.Overloaded) as caught:
+            controller.acquire('high')
+        self.assertEqual(caught.exception.reason, 'shed')
+        event.set()
+        thread.join()
+        self.assertEqual(controller.stats()['parked_now'], 0)
+
+    def test_circuit_breaker_states(self):
+        breaker = lb_admission.CircuitBreaker(window=10, min_requests=4, error_rate=0.5,
+                                              open_seconds=10, half_open_requests=2)
+        now = 100.0
+        for failed in (False, True, False, True):
+            breaker.record(failed, now)
+        self.assertEqual(breaker.current_state(now), lb_admission.OPEN)
+        self.assertFalse(breaker.try_acquire(now))
+        now += 10
+        self.assertEqual(breaker.current_state(now), lb_admission.HALF_OPEN)
+        self.assertTrue(breaker.try_acquire(now))
+        self.assertTrue(breaker.try_acquire(now))
+        self.assertFalse(breaker.try_acquire(now))
+        breaker.record(True, now)
+        self.assertEqual(breaker.current_state(now), lb_admission.OPEN)
+        now += 10
+        for _ in range(2):
+            self.assertTrue(breaker.try_acquire(now))
+            breaker.record(False, now)
+        self.assertEqual(breaker.current_state(now), lb_admission.CLOSED)
+
+    def test_lost_trial_slots_expire(self):
+        breaker = lb_admission.CircuitBreaker(window=10, min_requests=1, error_rate=0.5,
+                                              open_seconds=10, half_open_requests=2, trial_timeout=5)
+        now = 100.0
+        breaker.record(True, now)
+        now += 10
+        for _ in range(2):
+            try:
+                self.assertTrue(breaker.try_acquire(now))
+                raise RuntimeError('запрос оборвался до record')
+            except RuntimeError:
+                pass
+        self.assertFalse(breaker.try_acquire(now + 1))
+        now += 5
+        self.assertTrue(breaker.try_acquire(now))
+        breaker.record(False, now)
+        self.assertTrue(breaker.try_acquire(now))
+        breaker.record(False, now)
+        self.assertEqual(breaker.current_state(now), lb_admission.CLOSED)
+
+
+class TestOverloadProtection(BalancerTestCase):
+
+    def test_slots_released_after_streaming(self):
+        for path in ('/echo', '/process', '/cached/f'):
+            with self.client.get(path) as response:
+                response.get_data()
+        with self.client.get('/process') as response:
+            pass  # закрыт непрочитанным
+        self.assertEqual(balancer.admission.active, 0)
+        self.assertEqual(balancer.admission.admitted, 4)
+
+    def test_overloaded_returns_503(self):
+        controller = lb_admission.AdmissionController(max_active=1, max_queue=0, max_wait=0.05)
+        controller.acquire()
+        with mock.patch.object(balancer, 'admission', controller):
+            response = self.client.get('/process')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(controller.shed, 1)
+
+    def test_breaker_opens_on_errors(self):
+        registry = lb_admission.BreakerRegistry(min_requests=4, error_rate=0.5, open_seconds=60)
+        with mock.patch.object(balancer, 'breakers', registry), \
+                mock.patch.object(balancer.admission, 'max_wait', 0.05):
+            for _ in range(8):
+                self.assertEqual(self.client.get('/status/500').status_code, 500)
+            self.assertEqual(self.client.get('/process').status_code, 503)
+            states = {url: breaker['state'] for url, breaker in registry.snapshot().items()}
+        self.assertEqual(states, {url: 'open' for url in self.urls})
+
+    def test_backend_concurrency_limit(self):
+        busy = balancer.backend_stats.get(self.urls[0])
+        busy.begin()
+        try:
+            with mock.patch.object(balancer, 'BACKEND_MAX_IN_FLIGHT', 1):
+                seen = {self.client.get('/process').get_json()['instance_id'] for _ in range(4)}
+        finally:
+            busy.end()
+        self.assertEqual(seen, {'backend_b'})
+
+
+class TestPoolPersistence(BalancerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(tempfile.mkdtemp(dir=POOL_DIR), 'pool.json')
+        store = lb_state.PoolStore(self.path)
+        store.load(balancer.server_pool.snapshot())
+        patcher = mock.patch.object(balancer, 'pool_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored_urls(self):
+        with open(self.path, encoding='utf-8') as f:
+            return [server['url'] for server in json.load(f)['servers']]
+
+    def test_admin_changes_persisted(self):
+        self.client.post('/add_instance', data={'ip': '127.0.0.1', 'port': '9', 'weight': '3'})
+        self.assertEqual(self.stored_urls(), self.urls + ['http://127.0.0.1:9'])
+        self.client.post('/remove_instance', data={'index': '0'})
+        self.assertEqual(self.stored_urls(), self.urls[1:] + ['http://127.0.0.1:9'])
+        # Свои изменения синхронизация не применяет повторно
+        self.assertFalse(balancer.sync_pool())
+
+    def test_changes_from_other_balancer_synced(self):
+        kept = balancer.server_pool.find(self.urls[1])
+        other = lb_state.PoolStore(self.path)
+        other.remove(self.urls[0])
+        other.add({"url": "http://127.0.0.1:9", "weight": 2, "active": False})
+        self.assertTrue(balancer.sync_pool())
+        self.assertEqual([server['url'] for server in balancer.server_pool],
+                         [self.urls[1], 'http://127.0.0.1:9'])
+        self.assertIs(balancer.server_pool.find(self.urls[1]), kept)
+        self.assertFalse(balancer.server_pool.find('http://127.0.0.1:9')['active'])
+        self.assertFalse(balancer.sync_pool())
+
+    def test_health_changes_persisted(self):
+        server = balancer.server_pool.find(self.urls[0])
+        balancer.health_checker.apply_probe(server, False)
+        for _ in range(lb_health.HEALTH_FALL):
+            balancer.health_checker.apply_probe(balancer.server_pool.find(self.urls[0]), False)
+        balancer.pool_updates.join()
+        with open(self.path, encoding='utf-8') as f:
+            stored = {s['url']: s['active'] for s in json.load(f)['servers']}
+        self.assertEqual(stored, {self.urls[0]: False, self.urls[1]: True})
+
+    def test_slow_persistence_does_not_block_health_lock(self):
+        write = balancer.pool_store.set_active
+
+        def slow_write(*args):
+            time.sleep(0.5)
+            write(*args)
+
+        with mock.patch.object(balancer.pool_store, 'set_active', slow_write):
+            for _ in range(lb_health.HEALTH_FALL):
+                balancer.health_checker.apply_probe(balancer.server_pool.find(self.urls[0]), False)
+            started = time.monotonic()
+            balancer.health_checker.record(balancer.server_pool.find(self.urls[1]), error=False)
+            self.assertLess(time.monotonic() - started, 0.1)
+            balancer.pool_updates.join()
+        self.assertFalse(lb_state.PoolStore(self.path).load([])[0]['active'])
+
+    def test_pool_reloaded_at_startup(self):
+        lb_state.PoolStore(self.path).add({"url": "http://127.0.0.1:9", "weight": 1, "active": False})
+        env = dict(os.environ, LB_POOL_FILE=self.path, LB_BACKENDS='http://ignored:1')
+        output = subprocess.run(
+            [sys.executable, '-c',
+             'import balancer; print([(s["url"], s["active"]) for s in balancer.server_pool])'],
+            env=env, capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__) or '.',
+        ).stdout
+        self.assertEqual(output.strip(), repr([(url, True) for url in self.urls]
+                                              + [('http://127.0.0.1:9', False)]))
+
+    def test_persistence_is_opt_in(self):
+        env = {key: value for key, value in os.environ.items() if key != 'LB_POOL_FILE'}
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(__file__))
+        workdir = tempfile.mkdtemp(dir=POOL_DIR)
+        output = subprocess.run(
+            [sys.executable, '-c', 'import balancer; print(balancer.pool_store)'],
+            env=env, capture_output=True, text=True, check=True, cwd=workdir,
+        ).stdout
+        self.assertEqual(output.strip(), 'None')
+        self.assertEqual(os.listdir(workdir), [])
+
+    def test_concurrent_writers_from_processes(self):
+        script = ('import sys, lb_state\n'
+                  'store = lb_state.PoolStore(sys.argv[1])\n'
+                  'for i in range(20):\n'
+                  '    store.add({"url": f"http://w{sys.argv[2]}-{i}", "active": True})\n')
+        writers = [subprocess.Popen([sys.executable, '-c', script, self.path, str(n)],
+                                    cwd=os.path.dirname(__file__) or '.') for n in range(4)]
+        for writer in writers:
+            self.assertEqual(writer.wait(timeout=60), 0)
+        self.assertEqual(len(self.stored_urls()), len(self.urls) + 80)
+
+
+class TestStreamingProxy(BalancerTestCase):
+
+    def test_large_body_round_trip(self):
+        payload = os.urandom(5 * 1024 * 1024)
+        response = self.client.post('/echo', data=payload)
+        self.assertEqual(response.get_data(), payload)
+        self.assertEqual(response.headers['Content-Length'], str(len(payload)))
+
+    def test_hop_by_hop_headers_filtered(self):
+        response = self.client.get('/chunks')
+        self.assertEqual(len(response.get_data()), 100 * 4 * 256)
+        for header in ('Connection', 'X-Private', 'Keep-Alive', 'Transfer-Encoding',
+                       'Content-Length'):
+            self.assertNotIn(header, response.headers)
+
+    def test_buffered_mode(self):
+        with mock.patch.object(balancer, 'STREAMING', False):
+            response = self.client.put('/echo', data=b'abc')
+        self.assertEqual(response.get_data(), b'abc')
+        self.assertEqual(response.headers['Content-Length'], '3')
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp не установлен')
+class TestAsyncEngine(BalancerTestCase, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.async_client = TestClient(TestServer(async_balancer.create_app(health_check=False)))
+        await self.async_client.start_server()
+
+    async def asyncTearDown(self):
+        await self.async_client.close()
+
+    async def test_round_robin_and_streaming(self):
+        seen = []
+        for _ in range(4):
+            response = await self.async_client.get('/process')
+            seen.append((await response.json())['instance_id'])
+        self.assertEqual(seen, ['backend_a', 'backend_b', 'backend_a', 'backend_b'])
+
+        payload = os.urandom(2 * 1024 * 1024)
+        response = await self.async_client.post('/echo', data=payload)
+        self.assertEqual(await response.read(), payload)
+
+        metrics = await (await self.async_client.get('/metrics')).text()
+        self.assertIn(f'lb_upstream_latency_seconds_count{{backend="{self.urls[0]}"}}', metrics)
+
+    async def test_admin_routes(self):
+        response = await self.async_client.get('/')
+        self.assertIn('Панель управления', await response.text())
+
+        response = await self.async_client.post('/remove_instance', data={'index': '1'},
+                                                allow_redirects=False)
+        self.assertEqual(response.status, 302)
+        health = await (await self.async_client.get('/health')).json()
+        self.assertEqual([server['url'] for server in health['server_pool']], self.urls[:1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,468 @@
+# test_subscriptions.py - тесты приложения подписок (app.py)
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import date
+from unittest import mock
+
+# База создаётся при импорте app, поэтому подменяем путь заранее
+_tmpdir = tempfile.mkdtemp()
+os.environ['SUBSCRIPTIONS_DB'] = os.path.join(_tmpdir, 'test_subscriptions.db')
+os.environ.setdefault('HASH_WORKERS', '0')
+
+import app as subscriptions_app
+from app import app, db_pool, ROUTE_QUERIES, SCHEMA_VERSION, migrate_db, rebuild_user_totals
+import billing
+import charge_dates
+import forecast
+from password_hashing import HashingBusy, PasswordHasher
+from werkzeug.security import generate_password_hash
+
+
+def login_client(username, password='secret'):
+    """Зарегистрировать пользователя и вернуть авторизованный клиент"""
+    client = app.test_client()
+    client.post('/register', data={'username': username, 'password': password})
+    client.post('/login', data={'username': username, 'password': password})
+    with client.session_transaction() as sess:
+        user_id = sess['user_id']
+    return client, user_id
+
+
+def add_subscription(client, name, amount, interval='monthly', start_date='2024-01-15'):
+    return client.post('/subscriptions/add', data={
+        'name': name, 'amount': amount, 'interval': interval, 'start_date': start_date,
+    })
+
+
+def user_totals(user_id):
+    with db_pool.connection() as conn:
+        row = conn.execute('SELECT * FROM user_totals WHERE user_id = ?', (user_id,)).fetchone()
+    return dict(row) if row else None
+
+
+class TestChargeDates(unittest.TestCase):
+
+    def test_calendar_months(self):
+        self.assertEqual(charge_dates.next_charge('2024-01-15', 'monthly'), '2024-02-15')
+        self.assertEqual(charge_dates.next_charge('2024-01-31', 'monthly'), '2024-02-29')
+        self.assertEqual(charge_dates.next_charge('2023-12-31', 'monthly'), '2024-01-31')
+
+    def test_yearly_from_leap_day(self):
+        self.assertEqual(charge_dates.next_charge('2024-02-29', 'yearly'), '2025-02-28')
+        self.assertEqual(charge_dates.next_charge_after('2024-02-29', 'yearly', '2027-06-01'),
+                         '2028-02-29')
+
+    def test_charge_after_is_anchored_to_start(self):
+        self.assertEqual(charge_dates.next_charge_after('2024-01-31', 'monthly', '2024-03-30'),
+                         '2024-03-31')
+        self.assertEqual(charge_dates.next_charge_after('2024-01-01', 'weekly', '2024-01-15'),
+                         '2024-01-22')
+        self.assertEqual(charge_dates.next_charge_after('2024-05-01', 'weekly', '2024-01-01'),
+                         '2024-05-08')
+
+    def test_batch_api(self):
+        self.assertEqual(charge_dates.next_charges(['2024-01-01', '2024-01-01'], ['weekly', 'yearly']),
+                         ['2024-01-08', '2025-01-01'])
+
+    def test_invalid_date(self):
+        for value in ('2024-13-01', '20240101', '', None):
+            with self.assertRaises(ValueError):
+                charge_dates.next_charge(value, 'monthly')
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_wal_mode(self):
+        with db_pool.connection() as conn:
+            mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode.lower(), 'wal')
+
+    def test_connection_reused_between_requests(self):
+        client = app.test_client()
+        client.get('/login')
+        created = db_pool.stats()['created']
+        for _ in range(5):
+            client.post('/login', data={'username': 'nobody', 'password': 'x'})
+        stats = db_pool.stats()
+        self.assertEqual(stats['created'], created)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_db_stats_route(self):
+        response = app.test_client().get('/db_stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('checkouts', response.get_json())
+
+
+class TestQueryPlans(unittest.TestCase):
+
+    def test_schema_version(self):
+        with db_pool.connection() as conn:
+            self.assertEqual(migrate_db(conn), SCHEMA_VERSION)
+
+    def test_route_queries_use_indexes(self):
+        with db_pool.connection() as conn:
+            for route, sql in ROUTE_QUERIES.items():
+                params = (None,) * sql.count('?')
+                plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                details = [row['detail'] for row in plan]
+                with self.subTest(route=route, plan=details):
+                    self.assertTrue(details)
+                    for detail in details:
+                        self.assertFalse(detail.startswith('SCAN'), detail)
+                        self.assertNotIn('TEMP B-TREE', detail)
+
+
+class TestUserTotals(unittest.TestCase):
+
+    def test_totals_follow_add_edit_delete(self):
+        client, user_id = login_client('totals_user')
+        add_subscription(client, 'Music', '120', 'monthly')
+        add_subscription(client, 'Cloud', '1200', 'yearly')
+        add_subscription(client, 'News', '30', 'weekly')
+
+        totals = user_totals(user_id)
+        self.assertEqual(totals['active_count'], 3)
+        self.assertAlmostEqual(totals['total_all'], 1350)
+        self.assertAlmostEqual(totals['total_monthly'], 120 + 100 + 30 * 52 / 12)
+
+        with db_pool.connection() as conn:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM subscriptions WHERE user_id = ? ORDER BY id', (user_id,))]
+        client.post(f'/subscriptions/edit/{ids[0]}', data={
+            'name': 'Music', 'amount': '240', 'interval': 'yearly', 'start_date': '2024-01-15',
+        })
+        client.get(f'/subscriptions/delete/{ids[2]}')
+
+        totals = user_totals(user_id)
+        self.assertEqual(totals['active_count'], 2)
+        self.assertAlmostEqual(totals['total_all'], 1440)
+        self.assertAlmostEqual(totals['total_monthly'], 120)
+
+        page = client.get('/subscriptions').get_data(as_text=True)
+        self.assertIn('Итого в месяц: 120.00', page)
+
+    def test_rebuild_matches_incremental(self):
+        client, user_id = login_client('rebuild_user')
+        add_subscription(client, 'A', '10.5', 'monthly')
+        add_subscription(client, 'B', '7', 'weekly')
+        before = user_totals(user_id)
+        with db_pool.connection() as conn:
+            conn.execute('UPDATE user_totals SET total_all = -1 WHERE user_id = ?', (user_id,))
+            conn.commit()
+            rebuild_user_totals(conn)
+        after = user_totals(user_id)
+        self.assertEqual(before['active_count'], after['active_count'])
+        self.assertAlmostEqual(before['total_all'], after['total_all'])
+        self.assertAlmostEqual(before['total_monthly'], after['total_monthly'])
+
+
+class TestPagination(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client, cls.user_id = login_client('pages_user')
+        for day in range(1, 8):
+            add_subscription(cls.client, f'Sub{day}', '10', 'weekly', f'2024-03-{day:02d}')
+
+    def test_keyset_pages_cover_all_rows(self):
+        seen = []
+        url = '/subscriptions?limit=3'
+        while url:
+            page = self.client.get(url).get_data(as_text=True)
+            seen += [f'Sub{day}' for day in range(1, 8) if f'<td>Sub{day}</td>' in page]
+            marker = 'after='
+            if marker in page:
+                cursor = page.split(marker, 1)[1].split('"', 1)[0]
+                url = f'/subscriptions?limit=3&after={cursor}'
+            else:
+                url = None
+        self.assertEqual(seen, [f'Sub{day}' for day in range(1, 8)])
+
+    def test_stream_mode(self):
+        response = self.client.get('/subscriptions?stream=1')
+        self.assertTrue(response.is_streamed)
+        page = response.get_data(as_text=True)
+        for day in range(1, 8):
+            self.assertIn(f'<td>Sub{day}</td>', page)
+
+
+class TestBilling(unittest.TestCase):
+
+    def setUp(self):
+        self.client, self.user_id = login_client('billing_user')
+        with db_pool.connection() as conn:
+            conn.execute('DELETE FROM subscriptions WHERE user_id = ?', (self.user_id,))
+            conn.execute('DELETE FROM billing_runs')
+            conn.commit()
+        for day in range(1, 11):
+            add_subscription(self.client, f'Due{day}', '5', 'weekly', f'2023-12-{day:02d}')
+
+    def due_dates(self):
+        with db_pool.connection() as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT next_charge_date FROM subscriptions WHERE user_id = ? ORDER BY id',
+                (self.user_id,))]
+
+    def test_advances_past_as_of(self):
+        with db_pool.connection() as conn:
+            stats = billing.run_billing(conn, as_of='2024-01-20',
+                                        chunk_size=3, log=None)
+        self.assertEqual(stats['processed'], 10)
+        self.assertEqual(stats['chunks'], 4)
+        for next_date in self.due_dates():
+            self.assertGreater(next_date, '2024-01-20')
+            self.assertLessEqual(next_date, '2024-01-27')
+
+    def test_resume_after_interruption(self):
+        with db_pool.connection() as conn:
+            first = billing.run_billing(conn, as_of='2024-01-20',
+                                        chunk_size=4, max_chunks=1, log=None)
+            second = billing.run_billing(conn, as_of='2024-01-20',
+                                         chunk_size=4, log=None)
+        self.assertEqual(first['run_id'], second['run_id'])
+        self.assertEqual(first['processed'] + second['processed'], 10)
+        self.assertEqual(second['processed_total'], 10)
+
+    def test_bad_start_date_skipped(self):
+        with db_pool.connection() as conn:
+            bad_id = conn.execute('SELECT MIN(id) FROM subscriptions WHERE user_id = ?',
+                                  (self.user_id,)).fetchone()[0]
+            conn.execute("UPDATE subscriptions SET start_date = '2024-1-5' WHERE id = ?", (bad_id,))
+            conn.commit()
+            messages = []
+            stats = billing.run_billing(conn, as_of='2024-01-20',
+                                        chunk_size=3, log=messages.append)
+            run = conn.execute('SELECT finished_at FROM billing_runs WHERE id = ?',
+                               (stats['run_id'],)).fetchone()
+        self.assertEqual(stats['processed'], 9)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertIsNotNone(run[0])  # запуск дошёл до конца
+        self.assertIn(str(bad_id), messages[-1])
+        dates = self.due_dates()
+        self.assertEqual(dates[0], '2023-12-08')  # не продлена
+        for next_date in dates[1:]:
+            self.assertGreater(next_date, '2024-01-20')
+
+
+class TestPasswordHashing(unittest.TestCase):
+
+    def test_process_pool_hash_and_check(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+        try:
+            pwhash = hasher.hash('secret')
+            self.assertTrue(hasher.check(pwhash, 'secret'))
+            self.assertFalse(hasher.check(pwhash, 'wrong'))
+            self.assertFalse(hasher.needs_rehash(pwhash))
+        finally:
+            hasher.shutdown()
+
+    def test_slot_held_until_timed_out_job_finishes(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_pending=1, timeout=0.05)
+        try:
+            with self.assertRaises(HashingBusy):
+                hasher._run(time.sleep, 0.5)
+            # Задача ещё выполняется - новая не встаёт в очередь за ней
+            with self.assertRaises(HashingBusy):
+                hasher.hash('secret')
+            self.assertEqual(hasher.stats()['rejected'], 1)
+            for _ in range(100):
+                if not hasher.stats()['pending']:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(hasher.stats()['pending'], 0)
+            hasher.timeout = 10
+            self.assertTrue(hasher.check(hasher.hash('secret'), 'secret'))
+        finally:
+            hasher.shutdown()
+
+    def test_legacy_hash_upgraded_on_login(self):
+        legacy = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+        with db_pool.connection() as conn:
+            conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                         ('legacy_user', legacy))
+            conn.commit()
+        response = app.test_client().post('/login', data={'username': 'legacy_user',
+                                                          'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        with db_pool.connection() as conn:
+            stored = conn.execute('SELECT password FROM users WHERE username = ?',
+                                  ('legacy_user',)).fetchone()[0]
+        self.assertNotEqual(stored, legacy)
+        self.assertFalse(subscriptions_app.hasher.needs_rehash(stored))
+
+    def test_backpressure_returns_503(self):
+        login_client('busy_user')
+        busy = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_pending=1)
+        busy._slots.acquire()  # единственный слот уже занят
+        with mock.patch.object(subscriptions_app, 'hasher', busy):
+            response = app.test_client().post('/login', data={'username': 'busy_user',
+                                                              'password': 'secret'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+
+class TestUserCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = subscriptions_app.user_cache
+        self.cache.clear()
+
+    def test_duplicate_registration_rejected(self):
+        client = app.test_client()
+        client.post('/register', data={'username': 'dup_user', 'password': 'a'})
+        client.post('/login', data={'username': 'dup_user', 'password': 'a'})  # попадает в кеш
+        with mock.patch.object(subscriptions_app.hasher, 'hash') as hash_password:
+            page = client.post('/register', data={'username': 'dup_user', 'password': 'b'})
+        self.assertIn('Имя уже занято', page.get_data(as_text=True))
+        hash_password.assert_not_called()  # занятое имя не хешируется
+
+    def test_registration_cache_miss_single_query(self):
+        client = app.test_client()
+        client.post('/register', data={'username': 'miss_user', 'password': 'a'})
+        with mock.patch.object(subscriptions_app, 'get_user_by_username') as lookup:
+            page = client.post('/register', data={'username': 'miss_user', 'password': 'b'})
+        self.assertIn('Имя уже занято', page.get_data(as_text=True))
+        lookup.assert_not_called()  # без SELECT перед INSERT
+
+    def test_registration_race_caught_by_unique(self):
+        client = app.test_client()
+        client.post('/register', data={'username': 'race_user', 'password': 'a'})
+        # Второй процесс ещё не видит пользователя в своём кеше
+        self.cache.put('race_user', None)
+        page = client.post('/register', data={'username': 'race_user', 'password': 'b'})
+        self.assertIn('Имя уже занято', page.get_data(as_text=True))
+
+    def test_login_hits_cache(self):
+        login_client('cached_user')
+        before = self.cache.stats()
+        app.test_client().post('/login', data={'username': 'cached_user', 'password': 'secret'})
+        after = self.cache.stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_negative_entry_invalidated_on_register(self):
+        client = app.test_client()
+        before = self.cache.stats()['negative_hits']
+        client.post('/login', data={'username': 'late_user', 'password': 'secret'})
+        client.post('/login', data={'username': 'late_user', 'password': 'secret'})
+        self.assertEqual(self.cache.stats()['negative_hits'], before + 1)
+
+        client.post('/register', data={'username': 'late_user', 'password': 'secret'})
+        response = client.post('/login', data={'username': 'late_user', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_lru_eviction(self):
+        from user_cache import UserCache, MISSING
+        cache = UserCache(max_size=2)
+        cache.put('a', {'id': 1})
+        cache.put('b', {'id': 2})
+        cache.get('a')
+        cache.put('c', {'id': 3})
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('a'), {'id': 1})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TestBulkImportExport(unittest.TestCase):
+
+    CSV = ('name,amount,interval,start_date\n'
+           'Music,120,monthly,2024-01-15\n'
+           'Broken,abc,monthly,2024-01-15\n'
+           'Cloud,1200,yearly,2024-02-01\n')
+
+    def test_csv_import_then_export(self):
+        client, user_id = login_client('bulk_user')
+        response = client.post('/subscriptions/import?format=csv', data=self.CSV,
+                               content_type='text/csv')
+        result = response.get_json()
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual(result['errors'], [{'line': 3, 'error': 'Некорректная сумма'}])
+        self.assertEqual(user_totals(user_id)['active_count'], 2)
+
+        export = client.get('/subscriptions/export?format=ndjson')
+        self.assertTrue(export.is_streamed)
+        lines = export.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Music', 'Cloud'])
+
+    def test_ndjson_file_upload(self):
+        client, user_id = login_client('bulk_file_user')
+        body = '\n'.join(json.dumps({'name': f'S{i}', 'amount': i, 'interval': 'weekly',
+                                      'start_date': '2024-05-01'}) for i in range(2500))
+        response = client.post('/subscriptions/import?format=ndjson',
+                               data={'file': (io.BytesIO(body.encode()), 'subs.ndjson')})
+        self.assertEqual(response.get_json()['imported'], 2500)
+
+        export = client.get('/subscriptions/export?format=csv').get_data(as_text=True)
+        self.assertEqual(len(export.splitlines()), 2501)
+
+    def test_ndjson_field_types_reported_per_row(self):
+        client, user_id = login_client('bulk_types_user')
+        records = [{'name': 5, 'amount': 1, 'interval': 'monthly', 'start_date': '2024-01-01'},
+                   {'name': 'A', 'amount': 1, 'interval': ['monthly'], 'start_date': '2024-01-01'},
+                   {'name': 'B', 'amount': 1, 'interval': 'monthly', 'start_date': 20240101},
+                   {'name': 'C', 'amount': 1, 'interval': 'monthly', 'start_date': '2024-01-01',
+                    'next_charge_date': 'soon'},
+                   {'name': 'D', 'amount': 1, 'interval': 'monthly', 'start_date': '2024-01-01',
+                    'next_charge_date': '2024-03-01'}]
+        response = client.post('/subscriptions/import?format=ndjson',
+                               data='\n'.join(json.dumps(record) for record in records))
+        result = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(result['imported'], 1)
+        self.assertEqual([error['line'] for error in result['errors']], [1, 2, 3, 4])
+        self.assertEqual(result['errors'][3]['error'], 'Некорректная дата следующего списания')
+        self.assertEqual(user_totals(user_id)['active_count'], 1)
+
+    def test_missing_columns(self):
+        client, _ = login_client('bulk_bad_user')
+        response = client.post('/subscriptions/import', data='name,amount\nA,1\n')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestForecast(unittest.TestCase):
+
+    def test_timeline_range_sum(self):
+        today = charge_dates.parse_date('2024-01-10')
+        rows = [
+            {'start_date': '2024-01-01', 'interval': 'weekly', 'amount': 10.0,
+             'next_charge_date': '2024-01-08'},
+            {'start_date': '2023-03-31', 'interval': 'monthly', 'amount': 100.0,
+             'next_charge_date': '2024-01-31'},
+        ]
+        timeline = forecast.build_timeline(rows, today, charge_dates.parse_date('2024-03-31'))
+        buckets = forecast.month_buckets(timeline, 3)
+        self.assertEqual(buckets[0], {'month': '2024-01', 'total': 130.0, 'count': 4})
+        self.assertEqual(buckets[1], {'month': '2024-02', 'total': 140.0, 'count': 5})
+        self.assertEqual(buckets[2]['count'], 5)
+
+    def test_timeline_skips_bad_dates(self):
+        today = charge_dates.parse_date('2024-01-10')
+        rows = [
+            {'start_date': '2024-1-5', 'interval': 'weekly', 'amount': 10.0,
+             'next_charge_date': '2024-01-12'},
+            {'start_date': '2024-01-01', 'interval': 'monthly', 'amount': 100.0,
+             'next_charge_date': '2024-02-01'},
+        ]
+        timeline = forecast.build_timeline(rows, today, charge_dates.parse_date('2024-03-31'))
+        self.assertEqual(timeline.range_sum(today, timeline.horizon), (200.0, 2))
+
+    def test_endpoint_invalidated_on_add(self):
+        client, _ = login_client('forecast_user')
+        today = date.today()
+        add_subscription(client, 'Yearly', '1200', 'yearly', today.isoformat())
+        first = client.get('/subscriptions/forecast?months=24').get_json()
+        self.assertEqual(len(first['months']), 24)
+        self.assertEqual(first['count'], 1)
+        self.assertEqual(first['total'], 1200)
+
+        add_subscription(client, 'Weekly', '10', 'weekly', today.isoformat())
+        second = client.get('/subscriptions/forecast?months=24').get_json()
+        self.assertGreater(second['count'], 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
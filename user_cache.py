@@ -0,0 +1,74 @@
+# user_cache.py - кеш пользователей по имени с TTL и вытеснением LRU
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class UserCache:
+    """LRU-кеш строк таблицы users внутри процесса.
+
+    Хранит и найденных пользователей, и отрицательные ответы (имени нет
+    в базе) - с более коротким TTL. Кеш у каждого процесса свой, поэтому
+    при вставке и изменении пользователя запись нужно сбрасывать через
+    invalidate(); устаревание между процессами ограничено TTL.
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0, negative_ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, username):
+        """Пользователь (dict), None для известного отсутствия или MISSING"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(username)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, username, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        with self._lock:
+            self._entries[username] = (time.monotonic() + ttl, user)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }